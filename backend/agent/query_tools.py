@@ -18,6 +18,7 @@ from embedder import Embedder
 from agent_profiles import AgentProfiles
 from mdb_timeseries_coll_creator import TimeSeriesCollectionCreator
 from mdb_vector_search_idx_creator import VectorSearchIDXCreator
+from fleet_registry import FleetRegistry, DEFAULT_FLEET_SIZES
 
 from dotenv import load_dotenv
 
@@ -58,6 +59,8 @@ class QueryTools(MongoDBConnector):
         self.mdb_timeseries_granularity = self.config.get("MDB_TIMESERIES_GRANULARITY")
         self.default_timeseries_data = self.config.get("DEFAULT_TIMESERIES_DATA")
         self.critical_conditions_config = self.config.get("CRITICAL_CONDITIONS")
+        # Car-id range of every fleet, same FLEET_SIZES as the simulation
+        self.fleet_registry = FleetRegistry(self.config.get("FLEET_SIZES") or DEFAULT_FLEET_SIZES)
         self.mdb_embeddings_collection = self.config.get("MDB_EMBEDDINGS_COLLECTION") # historical_recommendations
         self.mdb_embeddings_collection_vs_field = self.config.get("MDB_EMBEDDINGS_COLLECTION_VS_FIELD")
         self.mdb_vs_index = self.config.get("MDB_VS_INDEX")
@@ -339,14 +342,8 @@ class QueryTools(MongoDBConnector):
             car_id = car.get("car_id")
             # Determine fleet index based on car_id
             if car_id is not None:
-                if 0 <= car_id <= 99:
-                    fleet_idx = "0"
-                elif 100 <= car_id <= 199:
-                    fleet_idx = "1"
-                elif 200 <= car_id <= 299:
-                    fleet_idx = "2"
-                else:
-                    fleet_idx = None
+                fleet = self.fleet_registry.fleet_of(car_id)
+                fleet_idx = str(fleet.number - 1) if fleet else None
 
                 if fleet_idx is not None:
                     allowed_fields = set(mapped_user_preferences[fleet_idx])
@@ -571,10 +568,6 @@ class QueryTools(MongoDBConnector):
         # Handle empty user_filters
         if user_filters and len(user_filters) > 0:
             for fleet_prefs in user_filters:
-                
-                car_ids1 = None
-                car_ids2 = None
-                car_ids3 = None
 
                 logger.info(f"Processing user filter: {fleet_prefs}")
                 
@@ -582,15 +575,13 @@ class QueryTools(MongoDBConnector):
                     # logger.info(f"Skipping preference")
                     continue
                 if fleet_prefs:
-                    if fleet_prefs == "Fleet 1":
-                        car_ids1 = list(range(0, fleet_capacity[0]))  # Car IDs 0-99
-                        match_stage["$or"].append({"car_id": {"$in": car_ids1}})
-                    if fleet_prefs == "Fleet 2":
-                        car_ids2 = list(range(100, fleet_capacity[1]))  # Car IDs 100-199
-                        match_stage["$or"].append({"car_id": {"$in": car_ids2}})
-                    if fleet_prefs == "Fleet 3":
-                        car_ids3 = list(range(200, fleet_capacity[2]))  # Car IDs 200-299
-                        match_stage["$or"].append({"car_id": {"$in": car_ids3}})
+                    if isinstance(fleet_prefs, str) and fleet_prefs.startswith("Fleet "):
+                        # "Fleet N": the selected cars of fleet N, as a car_id range
+                        number = int(fleet_prefs.split()[-1]) if fleet_prefs.split()[-1].isdigit() else 0
+                        count = fleet_capacity[number - 1] if 0 < number <= len(fleet_capacity) else 0
+                        condition = self.fleet_registry.car_id_condition(number, count)
+                        if condition:
+                            match_stage["$or"].append(condition)
                     elif fleet_prefs in ["downtown","utxa", "north_austin","capitol_area","south_austin","airport_zone","south_east_austin","south_west_austin","barton_creek","georgetown"]:
                         # For geofence filters, use current_geozone field instead
                         match_stage["$or"].append({"current_geozone": fleet_prefs})
@@ -605,9 +596,8 @@ class QueryTools(MongoDBConnector):
             logger.info("No user filters provided. Returning all data.")
 
         if match_stage["$or"] == []:
-            match_stage["$or"].append({"car_id": {"$in": list(range(0, fleet_capacity[0]))}})
-            match_stage["$or"].append({"car_id": {"$in": list(range(0, fleet_capacity[1]))}})
-            match_stage["$or"].append({"car_id": {"$in": list(range(0, fleet_capacity[2]))}})
+            # Selected cars of every fleet
+            match_stage["$or"] = self.fleet_capacity_conditions(fleet_capacity)
             
         # Handle agent_filters
         if agent_filters:
@@ -651,22 +641,9 @@ class QueryTools(MongoDBConnector):
         match_stage = {}
         match_stage["$or"] = []
 
-        # Fix the car ID ranges to match the logic in build_match_stage
+        # Same car ID ranges as build_match_stage
         if user_preferences:
-            if len(fleet_capacity) > 0 and fleet_capacity[0] > 0:
-                car_ids1 = list(range(0, fleet_capacity[0]))  # 0 to fleet_capacity[0]-1
-                match_stage["$or"].append({"car_id": {"$in": car_ids1}})
-                logger.info(f"Fleet 1 car IDs: {car_ids1[:5]}...{car_ids1[-5:] if len(car_ids1) > 5 else car_ids1}")
-                
-            if len(fleet_capacity) > 1 and fleet_capacity[1] > 0:
-                car_ids2 = list(range(100, 100 + fleet_capacity[1]))  # 100 to 100+fleet_capacity[1]-1
-                match_stage["$or"].append({"car_id": {"$in": car_ids2}})
-                logger.info(f"Fleet 2 car IDs: {car_ids2[:5]}...{car_ids2[-5:] if len(car_ids2) > 5 else car_ids2}")
-                
-            if len(fleet_capacity) > 2 and fleet_capacity[2] > 0:
-                car_ids3 = list(range(200, 200 + fleet_capacity[2]))  # 200 to 200+fleet_capacity[2]-1
-                match_stage["$or"].append({"car_id": {"$in": car_ids3}})
-                logger.info(f"Fleet 3 car IDs: {car_ids3[:5]}...{car_ids3[-5:] if len(car_ids3) > 5 else car_ids3}")
+            match_stage["$or"] = self.fleet_capacity_conditions(fleet_capacity)
 
         logger.info(f"Match stage for maintenance data: {match_stage}")
 
@@ -723,8 +700,9 @@ class QueryTools(MongoDBConnector):
             user_preferences (str): User preferences string.
 
         Returns:
-            [int]: an array of the last car IDs in the fleet
-            for example [50,150,250] for fleets 1,2,3 so we know we should search for car IDs 0-50, 100-150, 200-250
+            [int]: an array with the number of cars selected in every fleet
+            for example [50,50,50] for fleets 1,2,3 so we know we should search for the first 50 car IDs of each fleet
+            (1-50, 101-150, 201-250 with the default fleet_registry)
         """
         fleet_numbers = []
         for preference in user_preferences:
@@ -732,6 +710,15 @@ class QueryTools(MongoDBConnector):
                 fleet_numbers.append(preference[-1])
         return fleet_numbers
 
+    def fleet_capacity_conditions(self, fleet_capacity: list) -> list:
+        """
+        car_id range conditions ($gte/$lte) for the first fleet_capacity[i] cars of fleet i+1.
+        Empty fleets are left out.
+        """
+        conditions = [self.fleet_registry.car_id_condition(number, count)
+                      for number, count in enumerate(fleet_capacity, start=1)]
+        return [condition for condition in conditions if condition]
+
     def obtain_checkpoint(self):
 
         checkpoint_collection = self.get_collection(self.mdb_checkpointer_collection)
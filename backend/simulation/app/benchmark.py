@@ -0,0 +1,234 @@
+"""
+Headless simulation benchmark.
+
+Runs the shipping simulation loops (Car.run tasks, or FleetEngine.run) on
+the fast simulation clock for a fixed virtual duration, against a null or
+in-memory telemetry sink (no HTTP, no database), with geofences from a
+local fixture, and prints the results as JSON:
+
+    python benchmark.py --cars 1000 --engine vectorized --duration 600
+    python benchmark.py --cars 300 --engine tasks --sink memory --output bench.json
+
+Reported: car steps/s, documents/s, event loop lag percentiles, peak RSS
+and batch flush latency, plus the parameters of the run (seed included,
+so the same run can be repeated on another code version).
+
+Without --routes, seeded synthetic routes around Austin are generated so
+the benchmark needs no data files.
+"""
+import os
+
+os.environ.setdefault("TELEMETRY_SPILL_DIR", "")  # benchmark sinks never fail, no spill log
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+import numpy as np
+
+import route_manager
+from route_manager import ROUTES, load_routes
+from simulation_clock import simulation_clock
+from simulation_random import simulation_random, STREAM_FLEET_ENGINE
+from telemetry_pipeline import TelemetryPipeline
+from telemetry_sinks import create_sink
+
+logger = logging.getLogger(__name__)
+
+default_geofences_fixture = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures", "geofences.json")
+lag_probe_interval = 0.01  # seconds
+
+
+def _percentiles(values, scale: float = 1000.0) -> dict:
+    """p50/p95/p99/max of a list of seconds, in milliseconds."""
+    if not values:
+        return {"count": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * scale
+    return {"count": len(values), "p50": round(float(p50), 3), "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3), "max": round(float(max(values)) * scale, 3)}
+
+
+def write_synthetic_routes(path: str, count: int, seed: int):
+    """Random-walk routes around Austin in the processed_routes.json format."""
+    rng = np.random.default_rng(seed)
+    routes = {}
+    for route_id in range(1, count + 1):
+        n_steps = int(rng.integers(300, 1500))
+        start = np.array([30.2, -97.85]) + rng.uniform(0, [0.18, 0.2])
+        steps = start + np.cumsum(rng.normal(0, 1e-4, (n_steps, 2)), axis=0)
+        routes[str(route_id)] = {
+            "steps": [{"lat": float(lat), "lng": float(lng)} for lat, lng in steps],
+            "distancePerStep": float(rng.uniform(8, 20)),
+            "timePerStep": float(rng.uniform(1, 3)),
+        }
+    with open(path, "w") as f:
+        json.dump(routes, f)
+
+
+class Counters:
+    def __init__(self):
+        self.flush_latencies = []
+        self.lag = []
+
+
+async def _lag_probe(counters: Counters, stop: asyncio.Event):
+    """Measure how late the event loop wakes a short sleep up."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(lag_probe_interval)
+        counters.lag.append(max(time.perf_counter() - start - lag_probe_interval, 0.0))
+
+
+async def _run_simulation(cars, args, sink, pipeline):
+    """
+    Run the shipping simulation loops (Car.run tasks or FleetEngine.run) on the fast simulation clock for
+    args.duration simulated seconds, with main's telemetry going to the benchmark pipeline. Returns the car steps.
+    """
+    import main
+    import state_manager
+    from fleet_engine import FleetEngine
+
+    saved = main.telemetry_pipeline, main.telemetry_sink
+    main.telemetry_pipeline, main.telemetry_sink = pipeline, sink  # add_to_batch and the clock backpressure use them
+    state_manager.STATE_FILE = None  # keep the service's persisted state out of it
+    session = aiohttp.ClientSession()  # the loops require one, the benchmark sinks never use it
+    steps_before = sum(car.real_step for car in cars)
+    try:
+        if args.engine == "vectorized":
+            engine = FleetEngine(cars, tick_seconds=args.tick, motion=args.motion,
+                                 seed=simulation_random.seed_sequence(STREAM_FLEET_ENGINE))
+            tasks = [simulation_clock.track(asyncio.create_task(engine.run(session)))]
+        else:
+            engine = None
+            tasks = [simulation_clock.track(asyncio.create_task(car.run(session))) for car in cars]
+        state_manager.set_state("running")
+        await simulation_clock.sleep(args.duration)
+        state_manager.set_state("stopped")  # the loops exit at their next state check
+        await asyncio.gather(*tasks)
+    finally:
+        main.telemetry_pipeline, main.telemetry_sink = saved
+        await session.close()
+    if engine is not None:
+        return int(engine.real_step.sum()) - steps_before
+    return sum(car.real_step for car in cars) - steps_before
+
+
+async def run_benchmark(args) -> dict:
+    import main
+    from car_manager import create_cars, clear_all_cars
+
+    with open(args.geofences) as f:
+        main.geofence_manager.set_geofences(json.load(f).get("geofences", []))
+
+    simulation_random.reset(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        routes_path = args.routes
+        if routes_path is None:
+            routes_path = os.path.join(tmp, "synthetic_routes.json")
+            write_synthetic_routes(routes_path, args.cars + 1, simulation_random.seed)
+        ROUTES.clear()
+        load_routes(routes_path, main.geofence_manager, cache_dir=os.path.join(tmp, "route_cache"))
+    if not ROUTES:
+        raise SystemExit(f"No routes loaded from {routes_path}")
+
+    await clear_all_cars()
+    cars = await create_cars(args.cars)
+
+    sink = create_sink(args.sink)
+    counters = Counters()
+
+    async def timed_write(batch):
+        start = time.perf_counter()
+        success = await sink.write(batch)
+        counters.flush_latencies.append(time.perf_counter() - start)
+        return success
+
+    pipeline = TelemetryPipeline(timed_write, batch_size=args.batch_size, flush_interval=args.flush_seconds,
+                                 max_queue=args.max_queue, max_in_flight=args.max_in_flight)
+    pipeline.start()
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_lag_probe(counters, stop))
+
+    start_time = datetime.now(timezone.utc)
+    simulation_clock.reset("fast", start=start_time)
+    wall_start = time.perf_counter()
+    car_steps = await _run_simulation(cars, args, sink, pipeline)
+    await pipeline.stop()
+    wall_seconds = time.perf_counter() - wall_start
+    stop.set()
+    await probe
+
+    return {
+        "engine": args.engine,
+        "motion": args.motion if args.engine == "vectorized" else None,
+        "cars": len(cars),
+        "virtual_duration_s": args.duration,
+        "sink": sink.name,
+        "seed": simulation_random.seed,
+        "routes": args.routes or f"synthetic ({len(ROUTES)})",
+        "geozone_table": bool(route_manager.ROUTE_GEOZONES),
+        "wall_seconds": round(wall_seconds, 3),
+        "virtual_speedup": round(args.duration / wall_seconds, 2) if wall_seconds else None,
+        "car_steps": car_steps,
+        "steps_per_sec": round(car_steps / wall_seconds, 1) if wall_seconds else None,
+        "documents": sink.documents_written,
+        "documents_per_sec": round(sink.documents_written / wall_seconds, 1) if wall_seconds else None,
+        "loop_lag_ms": _percentiles(counters.lag),
+        "flush_latency_ms": _percentiles(counters.flush_latencies),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),  # ru_maxrss is KiB on Linux
+        "pipeline": pipeline.stats(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "started_at": start_time.isoformat(),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless simulation benchmark (null/memory sink, virtual time).")
+    parser.add_argument("--cars", type=int, default=300)
+    parser.add_argument("--engine", choices=("tasks", "vectorized"), default="vectorized")
+    parser.add_argument("--duration", type=float, default=600.0, help="virtual seconds to simulate")
+    parser.add_argument("--tick", type=float, default=1.0, help="vectorized engine tick, virtual seconds")
+    parser.add_argument("--motion", choices=("steps", "interpolated"), default="steps", help="vectorized engine motion")
+    parser.add_argument("--sink", choices=("null", "memory"), default="null")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--routes", default=None, help="routes JSON or binary store, synthetic routes if omitted")
+    parser.add_argument("--geofences", default=default_geofences_fixture)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--flush-seconds", type=float, default=1.0)
+    parser.add_argument("--max-queue", type=int, default=100000)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--output", default=None, help="write the JSON result here instead of stdout")
+    parser.add_argument("--log-level", default="ERROR")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(_main(args))
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+async def _main(args):
+    import main as simulation_main  # sets up logging, then quiet it down for the run
+    logging.getLogger().setLevel(args.log_level)
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(args.log_level)
+    return await run_benchmark(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
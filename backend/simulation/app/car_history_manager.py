@@ -1,14 +1,17 @@
 import asyncio  
-import random  
 import logging
 from route_manager import ROUTES  
+from session_registry import historic_session_registry
+from simulation_random import simulation_random, STREAM_HISTORIC_CAR_INIT
+from global_context import fleet_registry
 
 logger = logging.getLogger(__name__)
 
-async def _create_car_range(start_id: int, num_cars: int, session: str, history_cars: list):
+async def _create_car_range(fleet, num_cars: int, session: str, history_cars: list):
     from main import Car
-    if num_cars <= 0 or num_cars > 100:
-        logger.info(f"Skipping car creation for range {start_id}-{start_id+num_cars-1}: num_cars={num_cars} is out of allowed bounds (1-100)")
+    start_id = fleet.first_car_id
+    if num_cars <= 0 or num_cars > fleet.size:
+        logger.info(f"Skipping car creation for fleet {fleet.number}: num_cars={num_cars} is out of allowed bounds (1-{fleet.size})")
         return
     for car_id in range(start_id, start_id + num_cars):
         try:
@@ -22,19 +25,20 @@ async def _create_car_range(start_id: int, num_cars: int, session: str, history_
             logger.error(f"Failed to initialize route for Car {car_id}: {e}")
             continue
         #logger.info(f"Initializing Car {car_id} for Route {route_id} at coordinates ({lat}, {lng}).")
+        rng = simulation_random.generator(STREAM_HISTORIC_CAR_INIT, car_id)
         car = Car(
             car_id=car_id,
             current_route=route_id,
             latitude=lat,
             longitude=lng,
-            traveled_distance=random.uniform(0, 10000),
+            traveled_distance=rng.uniform(0, 10000),
             traveled_distance_since_start=0.0,
-            fuel_level=random.uniform(1000, 5000),
+            fuel_level=rng.uniform(1000, 5000),
             max_fuel_level=5000.0,
-            oil_temperature=random.uniform(70, 120),
-            engine_oil_level=random.uniform(500, 2000),
-            performance_score=random.uniform(80, 100),
-            availability_score=random.uniform(80, 100),
+            oil_temperature=rng.uniform(70, 120),
+            engine_oil_level=rng.uniform(500, 2000),
+            performance_score=rng.uniform(80, 100),
+            availability_score=rng.uniform(80, 100),
             run_time=0.0,
             quality_score=1.0,
             is_oil_leak=False,
@@ -44,18 +48,18 @@ async def _create_car_range(start_id: int, num_cars: int, session: str, history_
             average_speed=0.0,
             is_moving=False,
             current_geozone="No Geofence found",
-            sessions=[session],
             is_historic=True
         )
+        historic_session_registry.add(session, [car_id])
         history_cars.append(car)
         await register_h_car(car)
 
-async def create_hist_cars(num_cars_1: int, num_cars_2: int, num_cars_3: int, session: str):
-    logger.info(f"{num_cars_1 + num_cars_2 + num_cars_3} past cars about to be created")
+async def create_hist_cars(fleet_counts: list, session: str):
+    """Historic cars for the first fleet_counts[i] cars of every fleet (fleet_registry)."""
+    logger.info(f"{sum(fleet_counts)} past cars about to be created")
     history_cars = []
-    await _create_car_range(1, num_cars_1, session, history_cars)
-    await _create_car_range(101, num_cars_2, session, history_cars)
-    await _create_car_range(201, num_cars_3, session, history_cars)
+    for fleet, num_cars in zip(fleet_registry.fleets, fleet_counts):
+        await _create_car_range(fleet, num_cars, session, history_cars)
     logger.info(f"Successfully created {len(history_cars)} past cars")
     return history_cars
 
@@ -74,12 +78,18 @@ async def get_h_car_by_id(car_id: int):
     async with HISTORIC_LOCK:  
         return HISTORIC_CARS.get(car_id)  
   
+async def get_h_car_ids():  
+    """Ids of all registered historic cars."""  
+    async with HISTORIC_LOCK:  
+        return list(HISTORIC_CARS)  
+  
 async def get_h_all_cars():  
     """Retrieve all cars from the registry."""  
     async with HISTORIC_LOCK:  
         return list(HISTORIC_CARS.values())  
   
 async def clear_h_all_cars():  
-    """Clear all registered cars."""  
+    """Clear all registered cars and their sessions."""  
     async with HISTORIC_LOCK:  
         HISTORIC_CARS.clear()  
+        historic_session_registry.clear()  
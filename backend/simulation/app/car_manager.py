@@ -1,16 +1,30 @@
 import asyncio  
-import random  
 import logging
 from route_manager import ROUTES  
+from session_registry import session_registry
+from simulation_random import simulation_random, STREAM_FLEET_INIT
+from simulation_logging import log_event
 
 logger = logging.getLogger(__name__)
 
-async def create_cars(num_cars: int):
+async def create_cars(num_cars: int, first_car_id: int = 1):
     from main import Car
-    """Create cars (register and initialize them)"""  
+    """Create cars first_car_id .. first_car_id+num_cars-1 (register and initialize them)"""  
     logger.info(f"{num_cars} about to be created")
+    last_car_id = first_car_id + num_cars - 1
+    # Initial state of the whole fleet drawn at once from the run's seed, from car 1 on
+    # so a car starts the same whichever shard creates it
+    rng = simulation_random.generator(STREAM_FLEET_INIT)
+    initial = {
+        "traveled_distance": rng.uniform(0, 10000, last_car_id).tolist(),
+        "fuel_level": rng.uniform(1000, 5000, last_car_id).tolist(),
+        "oil_temperature": rng.uniform(70, 120, last_car_id).tolist(),
+        "engine_oil_level": rng.uniform(500, 2000, last_car_id).tolist(),
+        "performance_score": rng.uniform(80, 100, last_car_id).tolist(),
+        "availability_score": rng.uniform(80, 100, last_car_id).tolist(),
+    }
     cars = []  
-    for car_id in range(1, num_cars + 1):  
+    for car_id in range(first_car_id, last_car_id + 1):  
         # Cycle through available routes  
         try:
             route_id = car_id % len(ROUTES) + 1 if ROUTES else car_id
@@ -22,7 +36,7 @@ async def create_cars(num_cars: int):
         except Exception as e:
             logger.error(f"Failed to initialize route for Car {car_id}: {e}")
             continue
-        logger.info(f"Initializing Car {car_id} for Route {route_id} at coordinates ({lat}, {lng}).")  
+        log_event("car.initialized", logging.DEBUG, car_id=car_id, route=route_id, lat=lat, lng=lng)  
  
         # Initialize a new Car instance  
         car = Car(  
@@ -30,14 +44,14 @@ async def create_cars(num_cars: int):
             current_route=route_id,
             latitude=lat,
             longitude=lng,
-            traveled_distance=random.uniform(0, 10000),
+            traveled_distance=initial["traveled_distance"][car_id - 1],
             traveled_distance_since_start=0.0,
-            fuel_level=random.uniform(1000, 5000),
+            fuel_level=initial["fuel_level"][car_id - 1],
             max_fuel_level=5000.0,
-            oil_temperature=random.uniform(70, 120),
-            engine_oil_level=random.uniform(500, 2000),
-            performance_score=random.uniform(80, 100),
-            availability_score=random.uniform(80, 100),
+            oil_temperature=initial["oil_temperature"][car_id - 1],
+            engine_oil_level=initial["engine_oil_level"][car_id - 1],
+            performance_score=initial["performance_score"][car_id - 1],
+            availability_score=initial["availability_score"][car_id - 1],
             run_time=0.0,
             quality_score=1.0,
             is_oil_leak=False,
@@ -47,7 +61,6 @@ async def create_cars(num_cars: int):
             average_speed=0.0,
             is_moving=False,
             current_geozone="No Geofence found",
-            sessions=[],
             is_historic=False 
         )  
   
@@ -70,12 +83,18 @@ async def get_car_by_id(car_id: int):
     async with CARS_LOCK:  
         return GLOBAL_CARS.get(car_id)  
   
+async def get_car_ids():  
+    """Ids of all registered cars."""  
+    async with CARS_LOCK:  
+        return list(GLOBAL_CARS)  
+  
 async def get_all_cars():  
     """Retrieve all cars from the registry."""  
     async with CARS_LOCK:  
         return list(GLOBAL_CARS.values())  
   
 async def clear_all_cars():  
-    """Clear all registered cars."""  
+    """Clear all registered cars and their sessions."""  
     async with CARS_LOCK:  
         GLOBAL_CARS.clear()  
+        session_registry.clear()  
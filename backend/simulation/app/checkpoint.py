@@ -0,0 +1,220 @@
+"""
+Simulation checkpoints.
+
+A restart used to recreate every car with create_cars (fresh random state)
+and lose the sessions, route progress and accumulated distance, so the
+history backfill had to make up for it. Now the live fleet is written to
+CHECKPOINT_PATH every CHECKPOINT_INTERVAL_SECONDS and on shutdown, and
+routes/simulation.restore_simulation() brings it back at startup.
+
+A checkpoint is one compressed .npz file, written to a temporary file and
+renamed so a crash never leaves half a checkpoint:
+
+    meta              JSON: format, engine, motion, state, seed, clock, car range
+    car.<field>       one array per Car column (fleet_engine FLOAT/INT/BOOL_FIELDS)
+    car.current_geozone
+    engine.<field>    vectorized engine bookkeeping (phases, waits, route positions)
+    sessions.ids      live session ids, with their cars as one flat array
+    sessions.offsets  (sessions.car_ids[offsets[i]:offsets[i + 1]] are the cars of ids[i])
+    sessions.car_ids
+    noise.car_ids     tasks engine: where each car's noise stream (CarNoise) is,
+    noise.pos         as its PCG64 state words and the position in its block
+    noise.pcg64
+
+The car columns are copied on the event loop, so they are one consistent
+state; compressing and writing happen in a thread. An explicit stop removes
+the checkpoint (a stopped simulation comes back stopped). The noise carries
+on where it was (the vectorized engine's stream is engine_rng in meta), so a
+restored run does not repeat the noise it already produced. Historic cars are
+not saved, they belong to history jobs, which do not survive a restart.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from fleet_engine import FLOAT_FIELDS, INT_FIELDS, BOOL_FIELDS, ENGINE_ARRAYS
+from session_registry import session_registry
+from global_context import checkpoint_path, checkpoint_interval_seconds
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_FORMAT = 1
+CAR_COLUMNS = FLOAT_FIELDS + INT_FIELDS + BOOL_FIELDS
+COLUMN_DTYPES = {**{name: np.float64 for name in FLOAT_FIELDS}, **{name: np.int64 for name in INT_FIELDS},
+                 **{name: bool for name in BOOL_FIELDS}}
+UINT64_MASK = (1 << 64) - 1
+
+
+def _pack_pcg64(state: dict) -> list:
+    """PCG64 bit generator state as 6 uint64 words: state and increment (high, low), has_uint32, uinteger."""
+    words = state["state"]
+    return [words["state"] >> 64, words["state"] & UINT64_MASK, words["inc"] >> 64, words["inc"] & UINT64_MASK,
+            state["has_uint32"], state["uinteger"]]
+
+
+def _unpack_pcg64(row) -> dict:
+    state_high, state_low, inc_high, inc_low, has_uint32, uinteger = (int(word) for word in row)
+    return {"bit_generator": "PCG64", "state": {"state": state_high << 64 | state_low, "inc": inc_high << 64 | inc_low},
+            "has_uint32": has_uint32, "uinteger": uinteger}
+
+
+def capture(cars, engine=None, meta: dict = None) -> dict:
+    """Arrays of a checkpoint (copies) from the registered cars, or from the fleet engine when there is one."""
+    arrays = {}
+    if engine is not None:
+        for name in CAR_COLUMNS:
+            arrays[f"car.{name}"] = getattr(engine, name).copy()
+        arrays["car.current_geozone"] = engine.current_geozone.astype(str)
+        for name in ENGINE_ARRAYS:
+            arrays[f"engine.{name}"] = getattr(engine, name).copy()
+    else:
+        for name in CAR_COLUMNS:
+            arrays[f"car.{name}"] = np.array([getattr(car, name) for car in cars], dtype=COLUMN_DTYPES[name])
+        arrays["car.current_geozone"] = np.array([str(car.current_geozone) for car in cars])
+
+    # Cars that have not stepped yet have no stream, they start from their seed anyway
+    noisy = [] if engine is not None else [car for car in cars if getattr(car, "noise", None) is not None]
+    states = [car.noise.state() for car in noisy]
+    arrays["noise.car_ids"] = np.array([car.car_id for car in noisy], dtype=np.int64)
+    arrays["noise.pos"] = np.array([pos for _, pos in states], dtype=np.int64)
+    arrays["noise.pcg64"] = np.array([_pack_pcg64(state) for state, _ in states], dtype=np.uint64).reshape(-1, 6)
+
+    session_ids = session_registry.sessions()
+    members = [session_registry.cars_of(session_id) for session_id in session_ids]
+    arrays["sessions.ids"] = np.array(session_ids, dtype=str)
+    arrays["sessions.offsets"] = np.cumsum([0] + [len(cars_of) for cars_of in members], dtype=np.int64)
+    arrays["sessions.car_ids"] = np.concatenate(members).astype(np.int64) if members else np.zeros(0, dtype=np.int64)
+    arrays["meta"] = np.array(json.dumps({"format": CHECKPOINT_FORMAT, **(meta or {})}))
+    return arrays
+
+
+def write_checkpoint(path: str, arrays: dict):
+    """Write a checkpoint atomically (temporary file, then rename)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path: str) -> dict:
+    """Arrays of a checkpoint, "meta" decoded. Raises ValueError for an unknown format."""
+    with np.load(path, allow_pickle=False) as data:
+        checkpoint = {name: data[name] for name in data.files}
+    checkpoint["meta"] = json.loads(str(checkpoint["meta"]))
+    if checkpoint["meta"].get("format") != CHECKPOINT_FORMAT:
+        raise ValueError(f"Unsupported checkpoint format {checkpoint['meta'].get('format')}")
+    return checkpoint
+
+
+def checkpoint_sessions(checkpoint: dict):
+    """(session_id, car ids) of every session in a checkpoint."""
+    offsets, car_ids = checkpoint["sessions.offsets"], checkpoint["sessions.car_ids"]
+    for i, session_id in enumerate(checkpoint["sessions.ids"].tolist()):
+        yield session_id, car_ids[offsets[i]:offsets[i + 1]]
+
+
+def checkpoint_noise(checkpoint: dict):
+    """(car_id, bit generator state, block position) of every saved noise stream, for CarNoise.restore()."""
+    if "noise.car_ids" not in checkpoint:
+        return
+    for car_id, pos, row in zip(checkpoint["noise.car_ids"].tolist(), checkpoint["noise.pos"].tolist(),
+                                checkpoint["noise.pcg64"]):
+        yield car_id, _unpack_pcg64(row), pos
+
+
+class CheckpointManager:
+    def __init__(self, path: str = "", interval: float = 300.0):
+        self.path = path
+        self.interval = interval
+        self.last_saved_at = None
+        self.restored = None  # car range and state brought back at startup (routes/simulation.restore_simulation)
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    async def save(self) -> bool:
+        """Checkpoint the running (or paused) simulation of this process, False when there is nothing to save."""
+        from car_manager import get_all_cars
+        from simulation_clock import simulation_clock
+        from simulation_random import simulation_random
+        from state_manager import get_state
+        import routes.simulation as simulation
+
+        if not self.enabled or get_state() == "stopped":
+            return False
+        cars = await get_all_cars()
+        if not cars:
+            return False
+        engine = simulation.FLEET_ENGINE
+        meta = {
+            "engine": "vectorized" if engine is not None else "tasks",
+            "motion": engine.motion if engine is not None else None,
+            "state": get_state(),
+            "seed": simulation_random.seed,
+            "clock": {"mode": simulation_clock.mode, "speed": simulation_clock.speed,
+                      "now": simulation_clock.now().isoformat()},
+            "first_car_id": min(car.car_id for car in cars),
+            "num_cars": len(cars),
+            "saved_at": time.time(),
+        }
+        if engine is not None:
+            meta.update(engine_time=engine.time, engine_tick_count=engine.tick_count,
+                        engine_rng=engine.rng.bit_generator.state)
+        arrays = capture(cars, engine, meta)
+        start = time.perf_counter()
+        await asyncio.to_thread(write_checkpoint, self.path, arrays)
+        self.last_saved_at = meta["saved_at"]
+        logger.info(f"Checkpointed {len(cars)} cars to {self.path} in {time.perf_counter() - start:.3f}s")
+        return True
+
+    def load(self):
+        """The checkpoint at path, None when there is none or it cannot be read."""
+        if not self.enabled or not os.path.exists(self.path):
+            return None
+        try:
+            return read_checkpoint(self.path)
+        except Exception as e:
+            logger.error(f"Could not read checkpoint {self.path}, starting without it: {e}")
+            return None
+
+    def discard(self):
+        """Remove the checkpoint (the simulation was stopped)."""
+        if self.enabled and os.path.exists(self.path):
+            os.remove(self.path)
+            logger.info(f"Removed checkpoint {self.path}")
+
+    async def run(self, interval: float):
+        """Save every interval (wall) seconds until cancelled."""
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                await self.save()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error writing checkpoint: {e}")
+
+    def start(self, interval: float = None):
+        if self.enabled and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run(interval or self.interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+checkpoint_manager = CheckpointManager(checkpoint_path, checkpoint_interval_seconds)
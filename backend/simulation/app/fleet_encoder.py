@@ -0,0 +1,179 @@
+"""
+Columnar telemetry encoder for the fleet engine.
+
+Instead of building one document per car field by field (FleetEngine.to_document),
+the fields of all cars being sent are rounded at once on the state arrays and
+written into the output format per batch:
+
+- bson_documents: the fixed-size part of every document (numbers, flags,
+  coordinates, timestamp) is laid out as BSON in a NumPy structured array
+  and dumped with one tobytes(); only the variable tail (geozone name and
+  sessions) is appended per car, from a cache of encoded values. The result
+  is a RawBSONDocument per car that the BSON wire format and the mongo sink
+  pass on without encoding again.
+- documents: plain dicts built from the rounded columns, for the JSON
+  wire format and the file sink.
+"""
+import struct
+from datetime import datetime
+
+import bson
+import numpy as np
+from bson.raw_bson import RawBSONDocument
+
+from session_registry import session_registry
+
+# Rounded like Car.to_document, in document order
+ROUNDED_FIELDS = (
+    ("fuel_level", 1),
+    ("engine_oil_level", 1),
+    ("traveled_distance", 2),
+    ("run_time", 2),
+    ("performance_score", 2),
+    ("quality_score", 2),
+    ("availability_score", 2),
+    ("max_fuel_level", 2),
+    ("oee", 2),
+    ("oil_temperature", 2),
+    ("speed", 2),
+    ("average_speed", 2),
+)
+FLAG_FIELDS = ("is_oil_leak", "is_engine_running", "is_crashed", "is_moving")
+
+BSON_DOUBLE, BSON_STRING, BSON_DOCUMENT, BSON_ARRAY, BSON_BOOL, BSON_DATETIME, BSON_INT32 = \
+    0x01, 0x02, 0x03, 0x04, 0x08, 0x09, 0x10
+
+
+def _element(bson_type: int, name: str) -> bytes:
+    """BSON element header: type byte and the field name as a cstring."""
+    return bytes([bson_type]) + name.encode() + b"\x00"
+
+
+def _fixed_layout():
+    """
+    (slot, dtype, constant) triples of the fixed-size document part. Value slots
+    have a name and a dtype; constant runs (element headers, the GeoJSON
+    skeleton) have the bytes to write.
+    """
+    layout = [(None, None, _element(BSON_INT32, "car_id")), ("car_id", "<i4", None)]
+    for name, _ in ROUNDED_FIELDS:
+        layout += [(None, None, _element(BSON_DOUBLE, name)), (name, "<f8", None)]
+    for name in FLAG_FIELDS:
+        layout += [(None, None, _element(BSON_BOOL, name)), (name, "u1", None)]
+    layout += [(None, None, _element(BSON_INT32, "current_route")), ("current_route", "<i4", None)]
+
+    # "coordinates": {"type": "Point", "coordinates": [longitude, latitude]}
+    point_array_len = 4 + 2 * (len(_element(BSON_DOUBLE, "0")) + 8) + 1
+    point_type = _element(BSON_STRING, "type") + struct.pack("<i", 6) + b"Point\x00"
+    point_coords_header = _element(BSON_ARRAY, "coordinates")
+    point_len = 4 + len(point_type) + len(point_coords_header) + point_array_len + 1
+    layout += [
+        (None, None, _element(BSON_DOCUMENT, "coordinates") + struct.pack("<i", point_len) + point_type
+         + point_coords_header + struct.pack("<i", point_array_len) + _element(BSON_DOUBLE, "0")),
+        ("longitude", "<f8", None),
+        (None, None, _element(BSON_DOUBLE, "1")),
+        ("latitude", "<f8", None),
+        (None, None, b"\x00\x00"),  # end of the array and of the point
+    ]
+    layout += [(None, None, _element(BSON_DATETIME, "timestamp")), ("timestamp", "<i8", None)]
+    return layout
+
+
+class FleetDocumentEncoder:
+    """Encodes the documents of a set of fleet rows in one pass over the state arrays."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.layout = _fixed_layout()
+        fields, constants = [], {}
+        for k, (slot, dtype, constant) in enumerate(self.layout):
+            if slot is None:
+                fields.append((f"_c{k}", f"S{len(constant)}"))
+                constants[f"_c{k}"] = constant
+            else:
+                fields.append((slot, dtype))
+        self.dtype = np.dtype(fields)
+        self.constants = constants
+        self._geozone_cache = {}
+        self._sessions_cache = {}
+
+    def _rounded(self, idx):
+        return {name: np.round(getattr(self.engine, name)[idx], digits) for name, digits in ROUNDED_FIELDS}
+
+    def _geozone_element(self, geozone: str) -> bytes:
+        encoded = self._geozone_cache.get(geozone)
+        if encoded is None:
+            value = str(geozone).encode()
+            encoded = _element(BSON_STRING, "current_geozone") + struct.pack("<i", len(value) + 1) + value + b"\x00"
+            self._geozone_cache[geozone] = encoded
+        return encoded
+
+    def _sessions_element(self, sessions: tuple) -> bytes:
+        encoded = self._sessions_cache.get(sessions)
+        if encoded is None:
+            encoded = _element(BSON_DOCUMENT, "metadata") + bson.encode({"sessions": list(sessions)})
+            if len(self._sessions_cache) > 4096:
+                self._sessions_cache.clear()
+            self._sessions_cache[sessions] = encoded
+        return encoded
+
+    def bson_documents(self, idx, timestamp: datetime) -> list:
+        """RawBSONDocument for every row in idx, all stamped with the same timestamp."""
+        engine = self.engine
+        idx = np.asarray(idx)
+        fixed = np.zeros(idx.size, dtype=self.dtype)
+        for name, value in self.constants.items():
+            fixed[name] = value
+        for name, values in self._rounded(idx).items():
+            fixed[name] = values
+        for name in FLAG_FIELDS:
+            fixed[name] = getattr(engine, name)[idx]
+        fixed["car_id"] = engine.car_id[idx]
+        fixed["current_route"] = engine.current_route[idx]
+        fixed["longitude"] = np.round(engine.longitude[idx], 7)
+        fixed["latitude"] = np.round(engine.latitude[idx], 7)
+        fixed["timestamp"] = int(timestamp.timestamp() * 1000)
+
+        raw = fixed.tobytes()
+        size = self.dtype.itemsize
+        pack_len = struct.Struct("<i").pack
+        geozones = engine.current_geozone[idx].tolist()
+        sessions = session_registry.sessions_for(engine.car_id[idx].tolist())
+        documents = []
+        for k in range(idx.size):
+            tail = self._geozone_element(geozones[k]) + self._sessions_element(sessions[k])
+            body = raw[k * size:(k + 1) * size] + tail
+            documents.append(RawBSONDocument(pack_len(len(body) + 5) + body + b"\x00"))
+        return documents
+
+    def documents(self, idx, timestamp: str) -> list:
+        """Plain dict documents for every row in idx (same shape as FleetEngine.to_document)."""
+        engine = self.engine
+        idx = np.asarray(idx)
+        rounded = {name: values.tolist() for name, values in self._rounded(idx).items()}
+        flags = {name: getattr(engine, name)[idx].tolist() for name in FLAG_FIELDS}
+        car_id = engine.car_id[idx].tolist()
+        current_route = engine.current_route[idx].tolist()
+        longitude = np.round(engine.longitude[idx], 7).tolist()
+        latitude = np.round(engine.latitude[idx], 7).tolist()
+        geozones = engine.current_geozone[idx].tolist()
+        sessions = session_registry.sessions_for(car_id)
+        documents = []
+        for k in range(idx.size):
+            doc = {"car_id": car_id[k]}
+            doc.update({name: values[k] for name, values in rounded.items()})
+            doc.update({name: values[k] for name, values in flags.items()})
+            doc.update({
+                "current_route": current_route[k],
+                "current_geozone": geozones[k],
+                "coordinates": {
+                    "type": "Point",
+                    "coordinates": [longitude[k], latitude[k]]
+                },
+                "metadata": {
+                    "sessions": list(sessions[k])
+                },
+                "timestamp": timestamp,
+            })
+            documents.append(doc)
+        return documents
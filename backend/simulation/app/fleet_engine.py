@@ -0,0 +1,446 @@
+"""
+Vectorized fleet engine.
+
+Instead of one asyncio task per Car, the whole fleet lives in NumPy arrays
+(struct-of-arrays) and is advanced once per tick with array operations.
+Cars registered in GLOBAL_CARS become CarView objects, thin views over one
+row of the engine state, so the sessions API keeps working unchanged.
+
+Two ways to move the cars along their routes (ENGINE_MOTION):
+
+    steps         vertex by vertex at the route's timePerStep, like Car.run,
+                  so cars on dense polylines step (and send) more often
+    interpolated  at the route's average speed every tick, the position
+                  interpolated on the cumulative distances of the route
+                  (route_manager.ROUTE_DISTANCES); geofence checks and
+                  telemetry go by ticks, not by polyline density
+"""
+import asyncio
+import logging
+import time
+
+import numpy as np
+
+import state_manager
+import route_manager
+from route_manager import ROUTES, ROUTE_DISTANCES, cumulative_distances, interpolate_positions
+from fleet_encoder import FleetDocumentEncoder
+from session_registry import session_registry, historic_session_registry
+from simulation_clock import simulation_clock
+from simulation_logging import log_event
+from fleet_kpis import fleet_kpis, status_codes
+from fleet_snapshot import fleet_snapshot
+from global_context import constant_fuel_consumption_per_m, constant_oil_consumption_per_m
+
+logger = logging.getLogger(__name__)
+
+# Same probabilities and waits used by Car.run
+crash_probability_per_step = 0.001
+failure_wait_seconds = 60
+route_switch_wait_seconds = 10
+geofence_check_every_n_steps = 10
+
+MOTIONS = ("steps", "interpolated")
+
+# Columns copied from the Car dataclass, in the same units
+FLOAT_FIELDS = (
+    "fuel_level", "max_fuel_level", "oil_temperature", "engine_oil_level",
+    "traveled_distance", "traveled_distance_since_start", "availability_score",
+    "run_time", "quality_score", "performance_score", "latitude", "longitude",
+    "speed", "average_speed", "speed_total", "oee",
+)
+INT_FIELDS = ("car_id", "current_route", "step_index", "real_step", "route_index", "steps_route")
+BOOL_FIELDS = ("is_engine_running", "is_crashed", "is_oil_leak", "is_moving")
+# Engine bookkeeping kept in checkpoints next to the car columns
+ENGINE_ARRAYS = ("step_phase", "resume_at", "switch_pending", "failure_pending", "route_started", "route_position")
+
+
+class FleetEngine:
+    """Struct-of-arrays state for a fleet of cars, advanced one tick at a time."""
+
+    def __init__(self, cars, tick_seconds: float = 1.0, seed=None, motion: str = "steps"):
+        if motion not in MOTIONS:
+            raise ValueError(f"Unknown engine motion '{motion}', expected one of {MOTIONS}")
+        self.size = len(cars)
+        self.tick_seconds = float(tick_seconds)
+        self.motion = motion
+        self.time = 0.0  # engine seconds spent running, pauses excluded
+        self.tick_count = 0
+        self.rng = np.random.default_rng(seed)
+
+        for name in FLOAT_FIELDS:
+            setattr(self, name, np.array([getattr(c, name) for c in cars], dtype=np.float64))
+        for name in INT_FIELDS:
+            setattr(self, name, np.array([getattr(c, name) for c in cars], dtype=np.int64))
+        for name in BOOL_FIELDS:
+            setattr(self, name, np.array([getattr(c, name) for c in cars], dtype=bool))
+        self.current_geozone = np.array([c.current_geozone for c in cars], dtype=object)
+        self.route_ids = np.array([c.route_ids for c in cars], dtype=np.int64).reshape(self.size, 2)
+
+        self.step_phase = np.zeros(self.size, dtype=np.float64)  # fractional steps accumulated
+        self.resume_at = np.zeros(self.size, dtype=np.float64)  # engine time the car may move again
+        self.switch_pending = np.zeros(self.size, dtype=bool)  # finished route, waiting to swap
+        self.failure_pending = np.zeros(self.size, dtype=bool)  # failed, waiting to be repaired
+        self.route_started = np.zeros(self.size, dtype=bool)
+
+        self._build_route_tables()
+        # Distance along the current route (m), interpolated motion
+        self.route_position = np.zeros(self.size, dtype=np.float64)
+        current_route = self.route_ids[np.arange(self.size), self.route_index]
+        on_route = self.step_index < self.route_length[current_route]
+        self.route_position[on_route] = (self.route_cum[self.route_offset[current_route[on_route]] + self.step_index[on_route]]
+                                         - self.route_base[current_route[on_route]])
+        self.views = [CarView(self, i, c) for i, c in enumerate(cars)]
+        self.encoder = FleetDocumentEncoder(self)
+
+    def load_state(self, state: dict):
+        """Resume from a checkpoint: ENGINE_ARRAYS, time, tick count and rng."""
+        for name in ENGINE_ARRAYS:
+            getattr(self, name)[:] = state[name]
+        self.time = float(state["time"])
+        self.tick_count = int(state["tick_count"])
+        self.rng.bit_generator.state = state["rng"]
+
+    def _build_route_tables(self):
+        """Flatten ROUTES into dense lookup tables indexed by route id."""
+        max_route = max(ROUTES.keys(), default=0)
+        max_route = max(max_route, int(self.route_ids.max(initial=0)))
+        self.route_valid = np.zeros(max_route + 1, dtype=bool)
+        self.route_length = np.zeros(max_route + 1, dtype=np.int64)
+        self.route_offset = np.zeros(max_route + 1, dtype=np.int64)
+        self.route_dist_per_step = np.zeros(max_route + 1, dtype=np.float64)
+        self.route_time_per_step = np.ones(max_route + 1, dtype=np.float64)
+        self.route_distance = np.zeros(max_route + 1, dtype=np.float64)  # total length (m)
+        self.route_base = np.zeros(max_route + 1, dtype=np.float64)  # offset of the route in route_cum
+
+        coords, zones, distances, offset, base = [], [], [], 0, 0.0
+        for route_id, (steps, dist_per_step, time_per_step) in ROUTES.items():
+            self.route_valid[route_id] = len(steps) > 0 and time_per_step > 0
+            self.route_length[route_id] = len(steps)
+            self.route_offset[route_id] = offset
+            self.route_dist_per_step[route_id] = dist_per_step
+            self.route_time_per_step[route_id] = time_per_step if time_per_step > 0 else 1.0
+            coords.append(np.asarray(steps, dtype=np.float64).reshape(-1, 2))
+            route_distances = ROUTE_DISTANCES.get(route_id)
+            if route_distances is None or len(route_distances) != len(steps):
+                route_distances = cumulative_distances(steps, dist_per_step)
+            self.route_distance[route_id] = route_distances[-1] if len(route_distances) else 0.0
+            self.route_base[route_id] = base
+            # Offset by the routes before it, so route_cum increases over the whole table (one searchsorted for all cars)
+            distances.append(route_distances + base)
+            base += self.route_distance[route_id]
+            # Precomputed geozone per step, -2 where the table has no entry (checked live instead)
+            route_zones = route_manager.ROUTE_GEOZONES.get(route_id)
+            zones.append(route_zones if route_zones is not None and len(route_zones) == len(steps)
+                         else np.full(len(steps), -2, dtype=np.int32))
+            offset += len(steps)
+        self.route_coords = np.concatenate(coords) if coords else np.zeros((0, 2), dtype=np.float64)
+        self.route_zone = np.concatenate(zones) if zones else np.zeros(0, dtype=np.int32)
+        self.route_cum = np.concatenate(distances) if distances else np.zeros(0, dtype=np.float64)
+        self.route_speed = self.route_dist_per_step / self.route_time_per_step  # m/s, average over the route
+
+        if self.motion == "interpolated":
+            # Needs a segment to move along; a route counts as many steps as it takes ticks
+            self.route_valid &= self.route_length >= 2
+            duration = self.route_time_per_step * np.maximum(self.route_length - 1, 0)
+            self.route_steps = np.maximum(np.ceil(duration / self.tick_seconds), 1).astype(np.int64)
+        else:
+            self.route_steps = self.route_length
+
+    def advance(self, dt: float = None):
+        """
+        Advance every car by dt seconds of simulated time.
+
+        Returns:
+            np.ndarray: indices of cars that reached a telemetry send step this tick.
+        """
+        from main import oee_not_zero_on_start, timeseries_send_every_n_steps
+
+        dt = self.tick_seconds if dt is None else dt
+        self.time += dt
+        self.tick_count += 1
+        self.current_route = self.route_ids[np.arange(self.size), self.route_index]
+
+        # Cars starting a route count its steps once, like Car.run does on entering a route
+        starting = ~self.route_started & self.route_valid[self.current_route]
+        self.steps_route[starting] += self.route_steps[self.current_route[starting]]
+        self.route_started |= starting
+
+        due = self.resume_at <= self.time
+        self._repair(self.failure_pending & due)
+        self._switch_routes(self.switch_pending & due)
+
+        movable = (due & self.is_engine_running & ~self.switch_pending
+                   & self.route_valid[self.current_route])
+        idx = np.flatnonzero(movable)
+        if idx.size == 0:
+            return idx
+
+        route = self.current_route[idx]
+        interpolated = self.motion == "interpolated"
+        if interpolated:
+            # Every moving car advances dt at its route's speed, one step per tick
+            n_steps = np.ones(idx.size, dtype=np.int64)
+            move_distance_m = np.minimum(self.route_speed[route] * dt, self.route_distance[route] - self.route_position[idx])
+            elapsed = np.full(idx.size, dt)
+            self.route_position[idx] += move_distance_m
+            first_row = self.route_offset[route]
+            self.latitude[idx], self.longitude[idx], coord_row = interpolate_positions(
+                self.route_coords, self.route_cum, first_row, first_row + self.route_length[route] - 1,
+                self.route_base[route] + self.route_position[idx])
+        else:
+            time_per_step = self.route_time_per_step[route]
+            self.step_phase[idx] += dt / time_per_step
+            n_steps = np.floor(self.step_phase[idx]).astype(np.int64)
+            stepping = n_steps > 0
+            idx, route, time_per_step, n_steps = idx[stepping], route[stepping], time_per_step[stepping], n_steps[stepping]
+            if idx.size == 0:
+                return idx
+            self.step_phase[idx] -= n_steps
+
+            # Never run past the end of the route in a single tick
+            first_step = self.step_index[idx]
+            n_steps = np.minimum(n_steps, self.route_length[route] - first_step)
+            last_step = first_step + n_steps - 1
+            coord_row = self.route_offset[route] + last_step
+            position = self.route_coords[coord_row]
+            self.latitude[idx] = position[:, 0]
+            self.longitude[idx] = position[:, 1]
+            move_distance_m = self.route_dist_per_step[route] * n_steps
+            elapsed = time_per_step * n_steps
+
+        # Same arithmetic as Car.update, applied for n_steps at once
+        self.real_step[idx] += n_steps
+        self.engine_oil_level[idx] = np.maximum(self.engine_oil_level[idx] - move_distance_m * constant_oil_consumption_per_m, 0)
+        self.traveled_distance[idx] += move_distance_m
+        self.traveled_distance_since_start[idx] += move_distance_m
+        self.fuel_level[idx] = np.maximum(self.fuel_level[idx] - move_distance_m * constant_fuel_consumption_per_m, 0)
+        self.run_time[idx] += elapsed
+        speed = (move_distance_m / 1000) / (elapsed / 3600) + self.rng.uniform(-4.35, 4.25, idx.size)
+        speed = np.maximum(speed, 0)
+        self.speed_total[idx] += speed * n_steps
+        self.average_speed[idx] = self.speed_total[idx] / self.real_step[idx]
+
+        crashed = self.rng.random(idx.size) < 1 - (1 - crash_probability_per_step) ** n_steps
+        out_of_fuel = self.fuel_level[idx] <= 0
+        oil_leak = self.engine_oil_level[idx] <= 0
+        failed = crashed | out_of_fuel | oil_leak
+        self.is_crashed[idx] |= crashed
+        self.is_oil_leak[idx] |= oil_leak
+        self.is_engine_running[idx] &= ~failed
+        speed[failed] = 0
+        self.speed[idx] = speed
+        self.is_moving[idx] = speed > 0
+        if failed.any():
+            failed_idx = idx[failed]
+            self.failure_pending[failed_idx] = True
+            self.resume_at[failed_idx] = self.time + failure_wait_seconds
+            log_event("fleet.failures", logging.WARNING, cars=failed_idx.size, crashed=int(crashed.sum()),
+                      out_of_fuel=int(out_of_fuel.sum()), oil_leak=int(oil_leak.sum()))
+
+        # Performance attributes
+        steps_route = self.steps_route[idx]
+        performance = np.where(
+            steps_route > 0,
+            np.minimum(1, (self.real_step[idx] + oee_not_zero_on_start) / (steps_route + oee_not_zero_on_start)),
+            0,
+        )
+        self.performance_score[idx] = performance
+        self.quality_score[:] = fleet_kpis.quality  # share of the fleet running, last KPI tick (as Car.update)
+        self.availability_score[idx] = np.clip(self.availability_score[idx] + self.rng.uniform(-0.02, 0.02, idx.size), 0.6, 1)
+        self.oee[idx] = self.quality_score[idx] * self.availability_score[idx] * performance
+
+        if interpolated:
+            # Every k ticks of a car, staggered by car id so the fleet does not send on the same tick
+            def crosses(every):
+                return (self.real_step[idx] + self.car_id[idx]) % every == 0
+        else:
+            # A step k is "hit" if some processed index in [first_step, last_step] is a multiple of k
+            def crosses(every):
+                return (last_step // every - (first_step - 1) // every) > 0
+
+        geofence_check = crosses(geofence_check_every_n_steps)
+        if geofence_check.any():
+            self._update_geozones(idx[geofence_check], coord_row[geofence_check])
+
+        if interpolated:
+            self.step_index[idx] = coord_row - self.route_offset[route]  # step the car is past
+            finished = idx[self.route_position[idx] >= self.route_distance[route]]
+        else:
+            self.step_index[idx] = last_step + 1
+            finished = idx[self.step_index[idx] >= self.route_length[route]]
+        if finished.size:
+            self.switch_pending[finished] = True
+            self.resume_at[finished] = self.time + route_switch_wait_seconds
+
+        return idx[crosses(timeseries_send_every_n_steps) & ~failed]
+
+    def _repair(self, idx_mask):
+        """Bring failed cars back after their wait, same rules as Car.run."""
+        idx = np.flatnonzero(idx_mask)
+        if idx.size == 0:
+            return
+        crashed = self.is_crashed[idx]
+        out_of_fuel = self.fuel_level[idx] <= 0
+        oil_leak = self.engine_oil_level[idx] <= 0
+        self.is_crashed[idx[crashed]] = False
+        self.fuel_level[idx[out_of_fuel]] = self.max_fuel_level[idx[out_of_fuel]]
+        self.engine_oil_level[idx[oil_leak]] = 1000
+        self.is_oil_leak[idx[oil_leak]] = False
+        self.is_engine_running[idx] = True
+        self.failure_pending[idx] = False
+
+    def _switch_routes(self, idx_mask):
+        """Swap finished cars to their other route."""
+        idx = np.flatnonzero(idx_mask)
+        if idx.size == 0:
+            return
+        self.route_index[idx] = 1 - self.route_index[idx]
+        self.step_index[idx] = 0
+        self.step_phase[idx] = 0
+        self.route_position[idx] = 0
+        self.switch_pending[idx] = False
+        self.current_route[idx] = self.route_ids[idx, self.route_index[idx]]
+        valid = self.route_valid[self.current_route[idx]]
+        self.steps_route[idx[valid]] += self.route_steps[self.current_route[idx[valid]]]
+
+    def _update_geozones(self, idx, coord_idx):
+        from main import geofence_manager
+
+        # O(1) lookup in the precomputed route geozone table
+        zones = self.route_zone[coord_idx]
+        known = zones >= -1
+        self.current_geozone[idx[known]] = route_manager.GEOZONE_NAMES[zones[known]]
+        unknown = idx[~known]
+        if unknown.size == 0:
+            return
+        # One batched STRtree query for the cars whose route is not in the table
+        try:
+            self.current_geozone[unknown] = geofence_manager.check_points_in_geofences(self.longitude[unknown], self.latitude[unknown])
+        except Exception as e:
+            log_event("fleet.geofence_error", logging.WARNING, cars=unknown.size, error=e)
+            self.current_geozone[unknown] = "Error checking geofence"
+
+    def to_document(self, i: int):
+        """Build the timeseries document for the car at row i (same shape as Car.to_document)."""
+        return {
+            "car_id": int(self.car_id[i]),
+            "fuel_level": round(float(self.fuel_level[i]), 1),
+            "engine_oil_level": round(float(self.engine_oil_level[i]), 1),
+            "traveled_distance": round(float(self.traveled_distance[i]), 2),
+            "run_time": round(float(self.run_time[i]), 2),
+            "performance_score": round(float(self.performance_score[i]), 2),
+            "quality_score": round(float(self.quality_score[i]), 2),
+            "availability_score": round(float(self.availability_score[i]), 2),
+            "max_fuel_level": round(float(self.max_fuel_level[i]), 2),
+            "oee": round(float(self.oee[i]), 2),
+            "oil_temperature": round(float(self.oil_temperature[i]), 2),
+            "is_oil_leak": bool(self.is_oil_leak[i]),
+            "is_engine_running": bool(self.is_engine_running[i]),
+            "is_crashed": bool(self.is_crashed[i]),
+            "current_route": int(self.current_route[i]),
+            "speed": round(float(self.speed[i]), 2),
+            "average_speed": round(float(self.average_speed[i]), 2),
+            "is_moving": bool(self.is_moving[i]),
+            "current_geozone": self.current_geozone[i],
+            "coordinates": {
+                "type": "Point",
+                "coordinates": [round(float(self.longitude[i]), 7), round(float(self.latitude[i]), 7)]
+            },
+            "metadata": {
+                "sessions": list(self.views[i].sessions)
+            }
+        }
+
+    async def run(self, session):
+        """Drive the fleet until the simulation is stopped (replaces one Car.run task per car)."""
+        from main import add_many_to_batch, telemetry_sink
+
+        logger.info(f"Fleet engine started with {self.size} cars, tick {self.tick_seconds}s")
+        try:
+            while True:
+                if session is None:
+                    raise RuntimeError("HTTP_SESSION is not initialized. Check startup_event.")
+
+                if state_manager.is_paused():
+                    logger.info("Fleet engine: Simulation paused.")
+                    await state_manager.wait_while_paused()
+                    continue
+                elif state_manager.is_stopped():
+                    logger.info("Fleet engine: Simulation stopped. Exiting.")
+                    break
+
+                tick_start = time.perf_counter()
+                send_idx = self.advance()
+                fleet_kpis.record_many(self.car_id, status_codes(self.is_engine_running, self.is_crashed, self.fuel_level),
+                                       self.oee, self.availability_score, self.performance_score)
+                fleet_snapshot.record_many(self.car_id, self.longitude, self.latitude, self.is_crashed, self.is_moving,
+                                           self.is_engine_running, self.is_oil_leak)
+                if send_idx.size:
+                    timestamp = simulation_clock.now()
+                    if telemetry_sink.raw_bson:
+                        documents = self.encoder.bson_documents(send_idx, timestamp)
+                    else:
+                        documents = self.encoder.documents(send_idx, timestamp.isoformat())
+                    await add_many_to_batch(documents)
+
+                elapsed = time.perf_counter() - tick_start
+                budget = simulation_clock.wall_seconds(self.tick_seconds)
+                if budget and elapsed > budget:
+                    logger.warning(f"Fleet engine tick {self.tick_count} took {elapsed:.3f}s (> {budget:g}s)")
+                await simulation_clock.sleep(self.tick_seconds, spent=elapsed)
+        except asyncio.CancelledError:
+            logger.info("Fleet engine task cancelled.")
+        except Exception as e:
+            logger.error(f"Fleet engine: Unexpected error occurred: {e}")
+
+
+def _column_property(name):
+    def getter(self):
+        return self._engine.__dict__[name][self._index].item()
+
+    def setter(self, value):
+        self._engine.__dict__[name][self._index] = value
+
+    return property(getter, setter)
+
+
+class CarView:
+    """Thin view of one engine row that behaves like a Car for the sessions API."""
+
+    def __init__(self, engine: FleetEngine, index: int, car):
+        self._engine = engine
+        self._index = index
+        self.route_ids = list(car.route_ids)
+        self.is_historic = car.is_historic
+
+    @property
+    def current_geozone(self):
+        return self._engine.current_geozone[self._index]
+
+    @property
+    def registry(self):
+        return historic_session_registry if self.is_historic else session_registry
+
+    @property
+    def sessions(self):
+        return self.registry.sessions_of(self.car_id)
+
+    async def get_sessions(self):
+        """Get a copy of current sessions."""
+        return list(self.sessions)
+
+    async def to_document(self):
+        return self._engine.to_document(self._index)
+
+    async def add_session(self, session_id: str):
+        """Append a new session ID to metadata['sessions']."""
+        self.registry.add(session_id, [self.car_id])
+
+    async def clear_sessions(self):
+        """Clear all session IDs."""
+        self.registry.remove_car(self.car_id)
+
+
+for _name in FLOAT_FIELDS + INT_FIELDS + BOOL_FIELDS:
+    setattr(CarView, _name, _column_property(_name))
@@ -0,0 +1,208 @@
+"""
+Fleet KPI aggregator.
+
+Cars write their KPI row (status, OEE, availability, performance) into
+preallocated arrays indexed by car id: Car.update one row per step, the
+fleet engine all of its rows per tick. No locks, everything runs on the
+event loop. Once per tick (KPI_INTERVAL_SECONDS) update() reduces the rows
+to counters and sums for the whole fleet and for every fleet of
+fleet_registry, and keeps the last KPI_WINDOW_TICKS of them in a ring for
+rolling averages. quality is the share of tracked cars with the engine
+running, read by the cars from the last tick.
+
+GET /simulation/kpis serves the last tick from memory. Shard workers
+return raw() and the coordinator adds them up with merge_raw() before
+render(), so the numbers are the same sharded or not.
+"""
+import asyncio
+import logging
+
+import numpy as np
+
+from global_context import fleet_registry, kpi_interval_seconds, kpi_window_ticks
+
+logger = logging.getLogger(__name__)
+
+# Car status codes, one per tracked row (a failed car keeps its first failure until repaired)
+UNTRACKED, RUNNING, CRASHED, OUT_OF_FUEL, OIL_LEAK = -1, 0, 1, 2, 3
+STATUS_NAMES = ("running", "crashed", "out_of_fuel", "oil_leak")
+SCORES = ("oee", "availability", "performance")
+
+
+def car_status(is_engine_running: bool, is_crashed: bool, fuel_level: float) -> int:
+    """Status code of a car from its Car fields, the first failure when it has several."""
+    if is_engine_running:
+        return RUNNING
+    if is_crashed:
+        return CRASHED
+    if fuel_level <= 0:
+        return OUT_OF_FUEL
+    return OIL_LEAK
+
+
+def status_codes(is_engine_running, is_crashed, fuel_level) -> np.ndarray:
+    """car_status over arrays (fleet engine)."""
+    return np.select([is_engine_running, is_crashed, fuel_level <= 0], [RUNNING, CRASHED, OUT_OF_FUEL], OIL_LEAK).astype(np.int8)
+
+
+class FleetKpis:
+    def __init__(self, registry, window: int = 60):
+        self.registry = registry
+        self.window = max(int(window), 1)
+        self.groups = len(registry.fleets) + 1  # group 0 is the whole fleet
+        self._allocate(registry.total_cars)
+        self.counts = np.zeros((self.groups, len(STATUS_NAMES)), dtype=np.int64)
+        self.sums = np.zeros((self.groups, len(SCORES)), dtype=np.float64)
+        self._ring_sums = np.zeros((self.window, self.groups, len(SCORES)), dtype=np.float64)
+        self._ring_cars = np.zeros((self.window, self.groups), dtype=np.int64)
+        self.ticks = 0
+        self.quality = 1.0
+        self.updated_at = None
+        self._task = None
+
+    def _allocate(self, max_car_id: int):
+        """Rows for car ids 0..max_car_id, keeping the ones already written."""
+        size = max_car_id + 1
+        status = np.full(size, UNTRACKED, dtype=np.int8)
+        scores = np.zeros((size, len(SCORES)), dtype=np.float64)
+        if hasattr(self, "status"):
+            status[:len(self.status)] = self.status
+            scores[:len(self.scores)] = self.scores
+        self.status, self.scores = status, scores
+        # Fleet number of every car id, 0 outside all fleets (counted in the whole fleet only)
+        self.fleet_of = np.zeros(size, dtype=np.int64)
+        for fleet in self.registry.fleets:
+            self.fleet_of[fleet.first_car_id:min(fleet.last_car_id, max_car_id) + 1] = fleet.number
+
+    def _ensure(self, max_car_id: int):
+        """Grow the rows (doubling) when a run has more cars than the fleets."""
+        if max_car_id >= len(self.status):
+            self._allocate(max(max_car_id, 2 * (len(self.status) - 1)))
+
+    def record(self, car_id: int, status: int, oee: float, availability: float, performance: float):
+        """KPI row of one car (Car.update)."""
+        if car_id >= len(self.status):
+            self._ensure(car_id)
+        self.status[car_id] = status
+        row = self.scores[car_id]
+        row[0], row[1], row[2] = oee, availability, performance
+
+    def record_many(self, car_ids: np.ndarray, status: np.ndarray, oee: np.ndarray, availability: np.ndarray,
+                    performance: np.ndarray):
+        """KPI rows of many cars at once (fleet engine tick)."""
+        if car_ids.size == 0:
+            return
+        self._ensure(int(car_ids.max()))
+        self.status[car_ids] = status
+        self.scores[car_ids, 0] = oee
+        self.scores[car_ids, 1] = availability
+        self.scores[car_ids, 2] = performance
+
+    def forget(self, car_ids=None):
+        """Stop tracking some cars, or all of them (simulation stopped, the rolling window starts over)."""
+        if car_ids is None:
+            self.status[:] = UNTRACKED
+            self._ring_sums[:] = 0
+            self._ring_cars[:] = 0
+            self.ticks = 0
+            self.quality = 1.0
+        else:
+            self.status[np.asarray(car_ids, dtype=np.int64)] = UNTRACKED
+
+    def update(self):
+        """Reduce the car rows to per-fleet counters and score sums, one tick."""
+        from simulation_clock import simulation_clock
+
+        tracked = np.flatnonzero(self.status != UNTRACKED)
+        fleets = self.fleet_of[tracked]
+        # One bincount per array over (fleet, status) or fleet; row 0 (cars outside the fleets) becomes the whole fleet
+        counts = np.bincount(fleets * len(STATUS_NAMES) + self.status[tracked],
+                             minlength=self.groups * len(STATUS_NAMES)).reshape(self.groups, len(STATUS_NAMES))
+        sums = np.stack([np.bincount(fleets, weights=self.scores[tracked, i], minlength=self.groups)
+                         for i in range(len(SCORES))], axis=1)
+        self.counts[0], self.sums[0] = counts.sum(axis=0), sums.sum(axis=0)
+        self.counts[1:], self.sums[1:] = counts[1:], sums[1:]
+        slot = self.ticks % self.window
+        self._ring_sums[slot] = self.sums
+        self._ring_cars[slot] = self.counts.sum(axis=1)
+        self.ticks += 1
+        cars = int(self.counts[0].sum())
+        self.quality = float(self.counts[0, RUNNING] / cars) if cars else 1.0
+        self.updated_at = simulation_clock.now()
+
+    def raw(self) -> dict:
+        """Counters and sums of the last tick, plain lists so they can cross a pipe and be merged."""
+        filled = min(self.ticks, self.window)
+        return {
+            "ticks": self.ticks,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "counts": self.counts.tolist(),
+            "sums": self.sums.tolist(),
+            "rolling_sums": (self._ring_sums[:filled].sum(axis=0) / max(filled, 1)).tolist(),
+            "rolling_cars": (self._ring_cars[:filled].sum(axis=0) / max(filled, 1)).tolist(),
+        }
+
+    def render(self, raw: dict) -> dict:
+        """KPIs of the whole fleet and of every fleet from raw() (or merge_raw())."""
+        counts, sums = np.array(raw["counts"]), np.array(raw["sums"])
+        rolling_sums, rolling_cars = np.array(raw["rolling_sums"]), np.array(raw["rolling_cars"])
+
+        def group(g):
+            cars = int(counts[g].sum())
+            kpis = {"cars": cars, **{name: int(counts[g, i]) for i, name in enumerate(STATUS_NAMES)}}
+            kpis["quality"] = round(float(counts[g, RUNNING] / cars), 4) if cars else None
+            kpis.update({name: round(float(sums[g, i] / cars), 4) if cars else None for i, name in enumerate(SCORES)})
+            kpis["rolling"] = {name: round(float(rolling_sums[g, i] / rolling_cars[g]), 4) if rolling_cars[g] else None
+                               for i, name in enumerate(SCORES)}
+            return kpis
+
+        return {
+            "updated_at": raw["updated_at"],
+            "ticks": raw["ticks"],
+            "window_ticks": self.window,
+            "interval_seconds": kpi_interval_seconds,
+            "fleet": group(0),
+            "fleets": [{"fleet": f.number, **group(f.number)} for f in self.registry.fleets],
+        }
+
+    async def run(self, interval: float):
+        """Update every interval (wall) seconds until cancelled."""
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                self.update()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error updating fleet KPIs: {e}")
+
+    def start(self, interval: float = None):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(interval or kpi_interval_seconds))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def merge_raw(raws: list) -> dict:
+    """Add up the raw() of several shards (counters, sums and rolling averages all add), all zero without any."""
+    raws = [raw for raw in raws if raw]
+    if not raws:
+        groups = len(fleet_registry.fleets) + 1
+        return {"counts": [[0] * len(STATUS_NAMES)] * groups, "sums": [[0.0] * len(SCORES)] * groups,
+                "rolling_sums": [[0.0] * len(SCORES)] * groups, "rolling_cars": [0.0] * groups,
+                "ticks": 0, "updated_at": None}
+    merged = {key: np.sum([np.array(raw[key]) for raw in raws], axis=0).tolist()
+              for key in ("counts", "sums", "rolling_sums", "rolling_cars")}
+    merged["ticks"] = min(raw["ticks"] for raw in raws)
+    merged["updated_at"] = min((raw["updated_at"] for raw in raws if raw["updated_at"]), default=None)
+    return merged
+
+
+fleet_kpis = FleetKpis(fleet_registry, kpi_window_ticks)
@@ -0,0 +1,147 @@
+"""
+Live fleet snapshot.
+
+The live map needs every car's position and status flags, which the
+simulator already holds: Car.update writes its row, the fleet engine all of
+its rows per tick, into preallocated arrays indexed by car id (the same
+layout as fleet_kpis). GET /simulation/snapshot publishes them at most every
+SNAPSHOT_INTERVAL_SECONDS, so map polling costs no database work.
+
+Publishing compares the rows with the last published ones. The rows that
+changed, and the snapshot, get a new tick: wall milliseconds, kept strictly
+increasing, so ticks from an earlier process are always older than the new
+ones. That gives:
+
+- the ETag of the snapshot (If-None-Match answers 304 without building
+  anything);
+- ?since=<tick> deltas: only the cars changed after that tick, plus the cars
+  no longer simulated in "removed". A change of session membership after
+  `since` makes the reply a full one ("full": true).
+"""
+import time
+
+import numpy as np
+
+from global_context import snapshot_interval_seconds
+
+FLAG_NAMES = ("is_crashed", "is_moving", "is_engine_running", "is_oil_leak")
+
+
+class FleetSnapshot:
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.tick = 0
+        self.membership_tick = 0  # tick at which the session membership last changed
+        self._membership_version = None
+        self._published_at = None
+        self._allocate(0)
+
+    def _allocate(self, max_car_id: int):
+        """Live and published rows for car ids 0..max_car_id, keeping the ones already written."""
+        size = max_car_id + 1
+        for name, shape, dtype in (("tracked", (size,), bool), ("position", (size, 2), np.float64),
+                                   ("flags", (size, len(FLAG_NAMES)), bool)):
+            for attr in (name, f"_published_{name}"):
+                array = np.zeros(shape, dtype=dtype)
+                if hasattr(self, attr):
+                    old = getattr(self, attr)
+                    array[:len(old)] = old
+                setattr(self, attr, array)
+        changed_at = np.zeros(size, dtype=np.int64)
+        if hasattr(self, "changed_at"):
+            changed_at[:len(self.changed_at)] = self.changed_at
+        self.changed_at = changed_at
+
+    def _ensure(self, max_car_id: int):
+        """Grow the rows (doubling) when a car id is past the end."""
+        if max_car_id >= len(self.tracked):
+            self._allocate(max(max_car_id, 2 * (len(self.tracked) - 1)))
+
+    def record(self, car_id: int, longitude: float, latitude: float, is_crashed: bool, is_moving: bool,
+               is_engine_running: bool, is_oil_leak: bool):
+        """Row of one car (Car.update)."""
+        if car_id >= len(self.tracked):
+            self._ensure(car_id)
+        self.tracked[car_id] = True
+        position, flags = self.position[car_id], self.flags[car_id]
+        position[0], position[1] = longitude, latitude
+        flags[0], flags[1], flags[2], flags[3] = is_crashed, is_moving, is_engine_running, is_oil_leak
+
+    def record_many(self, car_ids: np.ndarray, longitude: np.ndarray, latitude: np.ndarray, is_crashed: np.ndarray,
+                    is_moving: np.ndarray, is_engine_running: np.ndarray, is_oil_leak: np.ndarray):
+        """Rows of many cars at once (fleet engine tick)."""
+        if car_ids.size == 0:
+            return
+        self._ensure(int(car_ids.max()))
+        self.tracked[car_ids] = True
+        self.position[car_ids, 0] = longitude
+        self.position[car_ids, 1] = latitude
+        for i, values in enumerate((is_crashed, is_moving, is_engine_running, is_oil_leak)):
+            self.flags[car_ids, i] = values
+
+    def forget(self):
+        """No car is simulated any more (simulation stopped); they show up as removed at the next publish."""
+        self.tracked[:] = False
+
+    def publish(self, membership_version: int, force: bool = False):
+        """Give the rows changed since the last publish a new tick, at most every interval (wall) seconds."""
+        now = time.monotonic()
+        if not force and self._published_at is not None and now - self._published_at < self.interval:
+            return
+        self._published_at = now
+        tracked = self.tracked
+        changed = (tracked != self._published_tracked) | (tracked & (
+            (self.position != self._published_position).any(axis=1) | (self.flags != self._published_flags).any(axis=1)))
+        membership_changed = membership_version != self._membership_version
+        if not membership_changed and not changed.any():
+            return
+        self.tick = max(self.tick + 1, int(time.time() * 1000))
+        self.changed_at[changed] = self.tick
+        self._published_tracked[:] = tracked
+        self._published_position[:] = self.position
+        self._published_flags[:] = self.flags
+        if membership_changed:
+            self._membership_version = membership_version
+            self.membership_tick = self.tick
+
+    def etag(self) -> str:
+        return f'"{self.tick}"'
+
+    def view(self, car_ids: np.ndarray, since: int = None) -> dict:
+        """Published rows of car_ids: all of them, or only the ones changed after the tick since."""
+        car_ids = car_ids[car_ids < len(self.changed_at)]
+        full = since is None or since < self.membership_tick
+        removed = car_ids[:0]
+        if not full:
+            car_ids = car_ids[self.changed_at[car_ids] > since]
+            removed = car_ids[~self._published_tracked[car_ids]]
+        car_ids = car_ids[self._published_tracked[car_ids]]
+        flags = self._published_flags[car_ids].tolist()
+        cars = [
+            {
+                "car_id": car_id,
+                "coordinates": {"type": "Point", "coordinates": [round(longitude, 7), round(latitude, 7)]},
+                **dict(zip(FLAG_NAMES, car_flags)),
+            }
+            for car_id, (longitude, latitude), car_flags in zip(car_ids.tolist(), self._published_position[car_ids].tolist(), flags)
+        ]
+        return {"tick": self.tick, "full": full, "cars": cars, "removed": removed.tolist()}
+
+
+def merge_views(views: list) -> dict:
+    """
+    One snapshot from the view() of several shards. The tick is the oldest of
+    the shards, so a delta from it may repeat a few cars of the newer shards.
+    No views (no shard has cars) is an empty full snapshot.
+    """
+    if not views:
+        return {"tick": 0, "full": True, "cars": [], "removed": []}
+    return {
+        "tick": min(view["tick"] for view in views),
+        "full": all(view["full"] for view in views),
+        "cars": sorted((car for view in views for car in view["cars"]), key=lambda car: car["car_id"]),
+        "removed": sorted(car_id for view in views for car_id in view["removed"]),
+    }
+
+
+fleet_snapshot = FleetSnapshot(snapshot_interval_seconds)
@@ -1,59 +1,127 @@
-from shapely.geometry import shape, Point  
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+import shapely
+import numpy as np
+import hashlib
 import logging
-import aiohttp  
-from global_context import geofences 
-logger = logging.getLogger(__name__)  
-
-class GeofenceManager:  
-    def __init__(self):  
-        self.geofences = []  # Store geofences as a list  
-        
-    async def load_geofences(self, url: str, session: aiohttp.ClientSession):  
-        """  
-        Load geofences directly into memory using the provided HTTP session.  
-        Args:  
-            url (str): The endpoint to fetch geofences from.  
-            session (aiohttp.ClientSession): The session to use for the HTTP request.  
-
-        """ 
-        global geofences 
-        try:  
-            async with session.get(url) as response:  
-                if response.status == 200:  
-                    data = await response.json()  # Parse the response as JSON  
-                    geofences = []  # Clear any existing geofences  
-  
-                    # Process fetched geofences  
-                    for geofence in data.get("geofences", []):  
-                        polygon = shape(geofence["geometry"])  # Convert geometry to shapely polygons  
-                        geofences.append({  
-                            "name": geofence["name"],  
-                            "geometry": polygon  
-                        })  
-  
-                    logger.info(f"Loaded {len(geofences)} geofences into memory from API.")  
-                else:  
-                    logger.error(f"Failed to fetch geofences. HTTP status: {response.status}")  
-        except Exception as e:  
-            logger.error(f"Error loading geofences from API: {str(e)}")  
-
-
-    def check_point_in_geofences(self, longitude: float, latitude: float) -> str:  
-        """  
-        Check if the given coordinates are inside any loaded geofence.  
-  
-        Args:  
-            longitude (float): The longitude of the point.  
-            latitude (float): The latitude of the point.  
-  
-        Returns:  
-            str: The name of the geofence if the point is inside one, otherwise "No active geofence".  
-        """  
-        point = Point(longitude, latitude)  # Create a point from the car's position  
-        global geofences
-        for geofence in geofences:  
-            if geofence["geometry"].contains(point):  # Check if the point is within the polygon  
-                return geofence["name"]  # Return the name of the matching geofence  
-  
-        return "No active geofence"  
+import time
+import aiohttp
+from metrics import geofence_check_duration, geofence_points_checked
+logger = logging.getLogger(__name__)
 
+NO_GEOFENCE = "No active geofence"
+
+class GeofenceManager:
+    def __init__(self):
+        self.geofences = []  # Store geofences as a list, in load order
+        self.polygons = np.array([], dtype=object)  # Prepared shapely geometries, same order as geofences
+        self.tree = None  # STRtree over polygons, built at load time
+        self._names = np.array([NO_GEOFENCE], dtype=object)  # names + NO_GEOFENCE at index -1
+
+    async def load_geofences(self, url: str, session: aiohttp.ClientSession):
+        """
+        Load geofences directly into memory using the provided HTTP session.
+        Args:
+            url (str): The endpoint to fetch geofences from.
+            session (aiohttp.ClientSession): The session to use for the HTTP request.
+
+        """
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    data = await response.json()  # Parse the response as JSON
+                    self.set_geofences(data.get("geofences", []))
+                    logger.info(f"Loaded {len(self.geofences)} geofences into memory from API.")
+                else:
+                    logger.error(f"Failed to fetch geofences. HTTP status: {response.status}")
+        except Exception as e:
+            logger.error(f"Error loading geofences from API: {str(e)}")
+
+    def set_geofences(self, raw_geofences: list):
+        """
+        Replace the loaded geofences and rebuild the spatial index.
+
+        Args:
+            raw_geofences (list): geofence dicts with "name" and a GeoJSON "geometry".
+        """
+        geofences = []
+        for geofence in raw_geofences:
+            polygon = shape(geofence["geometry"])  # Convert geometry to shapely polygons
+            geofences.append({
+                "name": geofence["name"],
+                "geometry": polygon
+            })
+        self.geofences = geofences
+        self.polygons = np.array([g["geometry"] for g in geofences], dtype=object)
+        shapely.prepare(self.polygons)  # Prepared geometries make the contains tests much cheaper
+        self.tree = STRtree(self.polygons) if len(self.polygons) else None
+        self._names = np.array([g["name"] for g in geofences] + [NO_GEOFENCE], dtype=object)
+
+    def fingerprint(self) -> str:
+        """Hash of the loaded geofence set (names and geometries), used to key cached geozone tables."""
+        digest = hashlib.sha256()
+        for geofence in self.geofences:
+            digest.update(geofence["name"].encode())
+            digest.update(shapely.to_wkb(geofence["geometry"]))
+        return digest.hexdigest()
+
+    def classify_points(self, longitudes, latitudes) -> np.ndarray:
+        """
+        Find the geofence containing each point.
+
+        Only the geofences whose bounding box holds the point are tested, and
+        when geofences overlap the first one in load order wins, like the
+        sequential scan did.
+
+        Returns:
+            np.ndarray: index into self.geofences for every point, -1 when outside all of them.
+        """
+        longitudes = np.asarray(longitudes, dtype=np.float64).reshape(-1)
+        latitudes = np.asarray(latitudes, dtype=np.float64).reshape(-1)
+        result = np.full(longitudes.size, -1, dtype=np.int64)
+        if self.tree is None or longitudes.size == 0:
+            return result
+
+        start = time.perf_counter()
+        point_idx, geofence_idx = self.tree.query(shapely.points(longitudes, latitudes))
+        if point_idx.size:
+            inside = shapely.contains_xy(self.polygons[geofence_idx], longitudes[point_idx], latitudes[point_idx])
+            point_idx, geofence_idx = point_idx[inside], geofence_idx[inside]
+
+            first = np.full(longitudes.size, len(self.polygons), dtype=np.int64)
+            np.minimum.at(first, point_idx, geofence_idx)
+            found = first < len(self.polygons)
+            result[found] = first[found]
+        geofence_check_duration.observe(time.perf_counter() - start)
+        geofence_points_checked.inc(longitudes.size)
+        return result
+
+    def geofence_names(self, indices) -> np.ndarray:
+        """Map classify_points indices to geofence names (NO_GEOFENCE for -1)."""
+        return self._names[np.asarray(indices, dtype=np.int64)]
+
+    def check_points_in_geofences(self, longitudes, latitudes) -> np.ndarray:
+        """
+        Classify a whole batch of positions (e.g. every car of the fleet) in one call.
+
+        Args:
+            longitudes: array-like of longitudes.
+            latitudes: array-like of latitudes.
+
+        Returns:
+            np.ndarray: geofence name for every point, "No active geofence" when outside all of them.
+        """
+        return self.geofence_names(self.classify_points(longitudes, latitudes))
+
+    def check_point_in_geofences(self, longitude: float, latitude: float) -> str:
+        """
+        Check if the given coordinates are inside any loaded geofence.
+
+        Args:
+            longitude (float): The longitude of the point.
+            latitude (float): The latitude of the point.
+
+        Returns:
+            str: The name of the geofence if the point is inside one, otherwise "No active geofence".
+        """
+        return self.check_points_in_geofences([longitude], [latitude])[0]
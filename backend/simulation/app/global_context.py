@@ -3,6 +3,7 @@ from pydantic_settings import BaseSettings
 from dotenv import load_dotenv
 import os  
 from datetime import datetime, timezone, timedelta
+from fleet_registry import FleetRegistry, DEFAULT_FLEET_SIZES
 load_dotenv()
 
 #context needed for global multithreading
@@ -25,13 +26,94 @@ def get_session():
 constant_fuel_consumption_per_m = 0.0009  # ml/m  
 constant_oil_consumption_per_m = 0.0005  # ml/m  
 
-cars_to_run=300
 latest_telemetry = datetime.now(timezone.utc) - timedelta(hours=1)  
 
 timeseries_post=os.getenv("TIMESERIES_POST_ENDPOINT")
 timeseries_get=os.getenv("TIMESERIES_GET_ENDPOINT")
 geofences_service=os.getenv("GEOFENCES_SERVICE_ENDPOINT")
 static_service=os.getenv("STATIC_SERVICE_ENDPOINT")
+
+# Cars per fleet, fleets are consecutive car-id ranges from car 1 (same setting in timeSeriesGET and agent)
+fleet_sizes=os.getenv("FLEET_SIZES", DEFAULT_FLEET_SIZES)
+fleet_registry=FleetRegistry(fleet_sizes)
+
+# Simulation engine: "tasks" (one asyncio task per car) or "vectorized" (FleetEngine, one task for the fleet)
+simulation_engine=os.getenv("SIMULATION_ENGINE", "tasks")
+engine_tick_seconds=float(os.getenv("ENGINE_TICK_SECONDS", "1.0"))
+# How the vectorized engine moves cars: "steps" (vertex by vertex at timePerStep) or "interpolated" (route speed every tick)
+engine_motion=os.getenv("ENGINE_MOTION", "steps")
+# Fleet KPIs (fleet_kpis.py): wall seconds between aggregations and ticks in the rolling window
+kpi_interval_seconds=float(os.getenv("KPI_INTERVAL_SECONDS", "1.0"))
+kpi_window_ticks=int(os.getenv("KPI_WINDOW_TICKS", "300"))
+# Live fleet snapshot (fleet_snapshot.py): wall seconds between publishes of the car rows
+snapshot_interval_seconds=float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "0.5"))
+# Shared-memory fleet state (shared_fleet_state.py): segment name ("" disables it), ring slots, wall seconds between
+# publishes and car ids per slot (0 for the fleets of FLEET_SIZES)
+shared_state_name=os.getenv("SHARED_STATE_NAME", "")
+shared_state_slots=int(os.getenv("SHARED_STATE_SLOTS", "4"))
+shared_state_interval_seconds=float(os.getenv("SHARED_STATE_INTERVAL_SECONDS", "1.0"))
+shared_state_capacity=int(os.getenv("SHARED_STATE_CAPACITY", "0"))
+# Worker processes the cars are split across (shard_coordinator.py), 0 or 1 runs them in the API process
+simulation_shards=int(os.getenv("SIMULATION_SHARDS", "0"))
+
+# Simulated time (simulation_clock.py): "realtime", "scaled" (SIMULATION_SPEED times wall time) or "fast" (as fast as
+# possible), and the ISO 8601 start of a run (unset for now)
+simulation_clock_mode=os.getenv("SIMULATION_CLOCK", "realtime")
+simulation_speed=float(os.getenv("SIMULATION_SPEED", "1.0"))
+simulation_clock_start=os.getenv("SIMULATION_CLOCK_START") or None
+# Fast mode, sharded: simulated seconds a shard's clock may run ahead of the slowest shard
+shard_clock_window_seconds=float(os.getenv("SHARD_CLOCK_WINDOW_SECONDS", "60"))
+
+# Logging (simulation_logging.py): level, file ("" for stdout only), "text" or "json", levels of hot-path events by
+# name or group ("car=WARNING,telemetry.batch_sent=OFF") and how many records per second each event may write
+log_level=os.getenv("LOG_LEVEL", "INFO").upper()
+log_file=os.getenv("LOG_FILE", "simulation.log")
+log_format=os.getenv("LOG_FORMAT", "text")
+log_event_levels=os.getenv("LOG_EVENT_LEVELS", "")
+log_event_rate=float(os.getenv("LOG_EVENT_RATE", "5"))
+log_event_burst=int(os.getenv("LOG_EVENT_BURST", "20"))
+
+# Random seed of every run (cars, noise, failures, history), unset for a fresh one per run (logged, to replay it)
+simulation_seed=int(os.getenv("SIMULATION_SEED")) if os.getenv("SIMULATION_SEED") else None
+
+# History backfill jobs: cars computed at once, documents per /historic-batch write, "thread" or "process" workers
+history_max_concurrency=int(os.getenv("HISTORY_MAX_CONCURRENCY", "4"))
+history_write_batch_size=int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "2000"))
+history_executor=os.getenv("HISTORY_EXECUTOR", "process")
+# Finished history jobs stay listed under /history/jobs for this many seconds, and at most this many of them
+history_job_ttl_seconds=float(os.getenv("HISTORY_JOB_TTL_SECONDS", "3600"))
+history_jobs_kept=int(os.getenv("HISTORY_JOBS_KEPT", "100"))
+
+# Routes: a processed_routes.json file or a binary route store directory (python route_manager.py to convert)
+routes_path=os.getenv("ROUTES_PATH", "processed_routes_bin" if os.path.isdir("processed_routes_bin") else "processed_routes.json")
+
+# Where precomputed route data (geozone tables) is cached between restarts
+route_cache_dir=os.getenv("ROUTE_CACHE_DIR", "route_cache")
+
+# Telemetry pipeline: documents per /timeseries-batch write, max seconds a document waits, queue bound (0 = unbounded),
+# concurrent writes, what to do when the queue is full ("block", "drop_newest", "drop_oldest") and retries per batch
+telemetry_batch_size=int(os.getenv("TELEMETRY_BATCH_SIZE", "1000"))
+telemetry_flush_seconds=float(os.getenv("TELEMETRY_FLUSH_SECONDS", "10"))
+telemetry_max_queue=int(os.getenv("TELEMETRY_MAX_QUEUE", "100000"))
+telemetry_max_in_flight=int(os.getenv("TELEMETRY_MAX_IN_FLIGHT", "4"))
+telemetry_overflow_policy=os.getenv("TELEMETRY_OVERFLOW_POLICY", "block")
+telemetry_max_retries=int(os.getenv("TELEMETRY_MAX_RETRIES", "3"))
+# Batch body sent to timeSeriesPOST: "bson" (application/bson) or "json" for older timeSeriesPOST deployments
+telemetry_wire_format=os.getenv("TELEMETRY_WIRE_FORMAT", "bson")
+# Telemetry sink: "http" (timeSeriesPOST), "mongo" (direct insert into MONGODB_URI), "file" (JSON lines) or "null"
+telemetry_sink_kind=os.getenv("TELEMETRY_SINK", "http")
+telemetry_sink_path=os.getenv("TELEMETRY_SINK_PATH", "telemetry.jsonl")
+mongodb_uri=os.getenv("MONGODB_URI")
+
+# Spill log for batches the sink did not take: directory ("" disables it), segment size, disk budget, replay rate (docs/s)
+telemetry_spill_dir=os.getenv("TELEMETRY_SPILL_DIR", "telemetry_spill")
+telemetry_spill_segment_bytes=int(os.getenv("TELEMETRY_SPILL_SEGMENT_BYTES", str(64 << 20)))
+telemetry_spill_max_bytes=int(os.getenv("TELEMETRY_SPILL_MAX_BYTES", str(1 << 30)))
+telemetry_spill_replay_rate=float(os.getenv("TELEMETRY_SPILL_REPLAY_RATE", "2000"))
+
+# Fleet checkpoint (checkpoint.py): file ("" disables it) and wall seconds between checkpoints of a running simulation
+checkpoint_path=os.getenv("CHECKPOINT_PATH", "simulation_checkpoint.npz")
+checkpoint_interval_seconds=float(os.getenv("CHECKPOINT_INTERVAL_SECONDS", "300"))
 # Print to verify  
 #print(f"Timeseries Endpoint: {timeseries_post}")  
 #print(f"Geofences Endpoint: {geofences_service}")  
\ No newline at end of file
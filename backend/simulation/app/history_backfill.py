@@ -0,0 +1,267 @@
+"""
+Vectorized history backfill.
+
+Computes a car's whole history window at once from ROUTES with NumPy
+cumulative ops (fuel, oil, distance, run time, noisy speed, OEE) instead of
+stepping through it point by point, then emits the documents in column
+batches. The availability random walk, clipped at every step, is a running
+max / min over cumsums (_clipped_walk), so no step runs in Python. Follows the same rules as the step-by-step Car.run_history loop
+it replaces (history never simulates failures).
+"""
+import logging
+from datetime import datetime, timezone
+
+import numpy as np
+
+import route_manager
+from route_manager import ROUTES
+from global_context import constant_fuel_consumption_per_m, constant_oil_consumption_per_m
+
+logger = logging.getLogger(__name__)
+
+geofence_check_every_n_steps = 10
+
+# Document fields and the rounding applied by Car.to_document
+ROUNDED_FIELDS = {
+    "fuel_level": 1,
+    "engine_oil_level": 1,
+    "traveled_distance": 2,
+    "run_time": 2,
+    "performance_score": 2,
+    "quality_score": 2,
+    "availability_score": 2,
+    "max_fuel_level": 2,
+    "oee": 2,
+    "oil_temperature": 2,
+    "speed": 2,
+    "average_speed": 2,
+}
+
+clip_window_steps = 4096  # steps summed at once by _clipped_walk
+
+
+def _clipped_walk(start: float, deltas: np.ndarray, low: float, high: float) -> np.ndarray:
+    """
+    Random walk clipped to [low, high] at every step (x[i] = clip(x[i - 1] + deltas[i])).
+
+    While the walk only touches one bound, clipping is a running max (or min)
+    over the plain cumsum: x = S - max(0, running max of S - high). That
+    holds until the walk crosses to the other bound; the step that does is
+    clipped there and the sum restarts from it with the other bound. A
+    crossing takes hundreds of steps, so the per-step work stays in NumPy.
+    Matches a step loop up to float rounding.
+    """
+    walk = np.empty(len(deltas), dtype=np.float64)
+    value, i = start, 0
+    at_high = start >= (low + high) / 2
+    while i < len(deltas):
+        path = value + np.cumsum(deltas[i:i + clip_window_steps])
+        if at_high:
+            path -= np.maximum.accumulate(np.maximum(path - high, 0.0))
+            crossed = np.flatnonzero(path < low)
+        else:
+            path -= np.minimum.accumulate(np.minimum(path - low, 0.0))
+            crossed = np.flatnonzero(path > high)
+        end = crossed[0] if crossed.size else len(path)
+        walk[i:i + end] = path[:end]
+        if crossed.size:
+            walk[i + end] = low if at_high else high
+            at_high = not at_high
+            end += 1
+        value, i = walk[i + end - 1], i + end
+    return np.clip(walk, low, high, out=walk)
+
+
+def _route_segments(route_ids, start_ts: float, end_ts: float):
+    """
+    Walk the car's two routes (alternating, starting at the first one) until end_ts.
+
+    Returns a list of (route_id, steps, dist_per_step, time_per_step, n_steps, segment_start_ts).
+    """
+    segments = []
+    counter = start_ts
+    route_index = 0
+    while counter < end_ts:
+        route_id = route_ids[route_index]
+        if route_id not in ROUTES:
+            logger.warning(f"Route {route_id} not found in history, skipping")
+            break
+        steps, dist_per_step, time_per_step = ROUTES[route_id]
+        if len(steps) == 0 or time_per_step <= 0:
+            break
+        # A step is processed while the clock before it is still < end_ts
+        n_steps = min(len(steps), int(np.ceil((end_ts - counter) / time_per_step)))
+        segments.append((route_id, steps, dist_per_step, time_per_step, n_steps, counter))
+        counter += n_steps * time_per_step
+        route_index = 1 - route_index
+    return segments
+
+
+def compute_history_columns(car, start_ts: float, end_ts: float, quality_score: float,
+                            oee_not_zero_on_start: int, send_every_n_steps: int, rng=None):
+    """
+    Compute every history step of one car between start_ts and end_ts.
+
+    The car's dynamic state is advanced to the end of the window, like the
+    step-by-step loop would leave it.
+
+    Returns:
+        dict: column name -> np.ndarray, one row per document to emit.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    segments = _route_segments(car.route_ids, start_ts, end_ts)
+    if not segments:
+        return {}
+
+    positions, dist, step_time, step_index, route, steps_route, timestamps, zones = [], [], [], [], [], [], [], []
+    for route_id, steps, dist_per_step, time_per_step, n_steps, segment_start in segments:
+        route_zones = route_manager.ROUTE_GEOZONES.get(route_id)
+        if zones is not None and route_zones is not None and len(route_zones) == len(steps):
+            zones.append(route_zones[:n_steps])
+        else:
+            zones = None  # no precomputed table for this route, classify when building documents
+        positions.append(np.asarray(steps[:n_steps], dtype=np.float64))
+        dist.append(np.full(n_steps, dist_per_step))
+        step_time.append(np.full(n_steps, time_per_step))
+        step_index.append(np.arange(n_steps))
+        route.append(np.full(n_steps, route_id))
+        steps_route.append(np.full(n_steps, len(steps)))
+        timestamps.append(segment_start + time_per_step * np.arange(1, n_steps + 1))
+    positions = np.concatenate(positions)
+    dist = np.concatenate(dist)
+    step_time = np.concatenate(step_time)
+    step_index = np.concatenate(step_index)
+    route = np.concatenate(route)
+    steps_route = np.concatenate(steps_route)
+    timestamps = np.concatenate(timestamps)
+    total = len(dist)
+
+    # Same per-step arithmetic the history loop used, as cumulative sums
+    cumulative_distance = np.cumsum(dist)
+    real_step = car.real_step + np.arange(1, total + 1)
+    engine_oil_level = np.maximum(car.engine_oil_level - cumulative_distance * constant_oil_consumption_per_m, 0)
+    fuel_level = np.maximum(car.fuel_level - cumulative_distance * constant_fuel_consumption_per_m, 0)
+    traveled_distance = car.traveled_distance + cumulative_distance
+    run_time = car.run_time + np.cumsum(step_time)
+    speed = np.maximum((dist / 1000) / (step_time / 3600) + rng.uniform(-4.35, 4.25, total), 0)
+    speed_total = car.speed_total + np.cumsum(speed)
+    average_speed = speed_total / real_step
+    performance_score = np.where(
+        steps_route > 0,
+        np.minimum(1, (real_step + oee_not_zero_on_start) / (steps_route + oee_not_zero_on_start)),
+        0,
+    )
+    # Random walk clipped at every step: running max / min over cumsums between crossings of the range
+    availability_score = _clipped_walk(car.availability_score, rng.uniform(-0.02, 0.02, total), 0.6, 1.0)
+    oee = quality_score * availability_score * performance_score
+
+    # Leave the car where the loop would have left it
+    car.real_step = int(real_step[-1])
+    car.engine_oil_level = float(engine_oil_level[-1])
+    car.fuel_level = float(fuel_level[-1])
+    car.traveled_distance = float(traveled_distance[-1])
+    car.traveled_distance_since_start += float(cumulative_distance[-1])
+    car.run_time = float(run_time[-1])
+    car.speed = float(speed[-1])
+    car.speed_total = float(speed_total[-1])
+    car.average_speed = float(average_speed[-1])
+    car.is_moving = car.speed > 0
+    car.performance_score = float(performance_score[-1])
+    car.quality_score = quality_score
+    car.availability_score = float(availability_score[-1])
+    car.oee = float(oee[-1])
+    car.current_route = int(route[-1])
+    car.steps_route = int(steps_route[-1])
+    car.step_index = 0
+    car.latitude, car.longitude = (float(v) for v in positions[-1])
+
+    if not car.is_engine_running:
+        return {}
+    emit = np.flatnonzero(step_index % send_every_n_steps == 0)
+    columns = {
+        "timestamp": timestamps[emit],
+        "latitude": positions[emit, 0],
+        "longitude": positions[emit, 1],
+        "fuel_level": fuel_level[emit],
+        "engine_oil_level": engine_oil_level[emit],
+        "traveled_distance": traveled_distance[emit],
+        "run_time": run_time[emit],
+        "performance_score": performance_score[emit],
+        "quality_score": np.full(emit.size, quality_score),
+        "availability_score": availability_score[emit],
+        "max_fuel_level": np.full(emit.size, car.max_fuel_level),
+        "oee": oee[emit],
+        "oil_temperature": np.full(emit.size, car.oil_temperature),
+        "current_route": route[emit],
+        "speed": speed[emit],
+        "average_speed": average_speed[emit],
+        "is_moving": speed[emit] > 0,
+        "geofence_check": step_index[emit] % geofence_check_every_n_steps == 0,
+    }
+    if zones is not None:
+        columns["geozone"] = route_manager.GEOZONE_NAMES[np.concatenate(zones)[emit]]
+    return columns
+
+
+def iter_history_batches(columns: dict, batch_size: int):
+    """Yield the history columns in slices of at most batch_size rows."""
+    if not columns:
+        return
+    total = len(columns["timestamp"])
+    for start in range(0, total, batch_size):
+        yield {name: values[start:start + batch_size] for name, values in columns.items()}
+
+
+def _classify_checked_rows(car, columns: dict, geofence_check, geofence_manager):
+    """Classify every checked position of the batch in one call, None if the check fails."""
+    try:
+        return iter(geofence_manager.check_points_in_geofences(
+            columns["longitude"][geofence_check], columns["latitude"][geofence_check]).tolist())
+    except Exception as e:
+        logger.warning(f"Car {car.car_id}: Geofence check error in history: {e}")
+        return None
+
+
+def columns_to_documents(car, columns: dict, sessions: list, geofence_manager):
+    """Turn one column batch into timeseries documents (same shape as Car.to_document)."""
+    rows = len(columns["timestamp"])
+    if rows == 0:
+        return []
+    rounded = {name: np.round(columns[name], digits).tolist() for name, digits in ROUNDED_FIELDS.items()}
+    longitude = np.round(columns["longitude"], 7).tolist()
+    latitude = np.round(columns["latitude"], 7).tolist()
+    current_route = columns["current_route"].tolist()
+    is_moving = columns["is_moving"].tolist()
+    geofence_check = columns["geofence_check"]
+    if "geozone" in columns:
+        # Precomputed route geozone table, no point-in-polygon work at all
+        zones = iter(columns["geozone"][geofence_check].tolist())
+    else:
+        zones = _classify_checked_rows(car, columns, geofence_check, geofence_manager)
+    geofence_check = geofence_check.tolist()
+    timestamps = [datetime.fromtimestamp(ts, tz=timezone.utc).isoformat() for ts in columns["timestamp"].tolist()]
+
+    documents = []
+    for i in range(rows):
+        if geofence_check[i]:
+            car.current_geozone = next(zones) if zones is not None else "Error checking geofence"
+        doc = {name: values[i] for name, values in rounded.items()}
+        doc.update({
+            "car_id": car.car_id,
+            "is_oil_leak": car.is_oil_leak,
+            "is_engine_running": car.is_engine_running,
+            "is_crashed": car.is_crashed,
+            "current_route": current_route[i],
+            "is_moving": is_moving[i],
+            "current_geozone": car.current_geozone,
+            "coordinates": {
+                "type": "Point",
+                "coordinates": [longitude[i], latitude[i]]
+            },
+            "metadata": {
+                "sessions": list(sessions)
+            },
+            "timestamp": timestamps[i],
+        })
+        documents.append(doc)
+    return documents
@@ -0,0 +1,266 @@
+"""
+History backfill jobs.
+
+A job backfills the history window for a group of historic cars. Cars are
+computed by a bounded worker pool (processes by default, so the NumPy work
+and the bits of Python around it never hold the event loop's GIL; threads
+with HISTORY_EXECUTOR=thread) and the documents of all cars in the job are
+merged into large /historic-batch writes. Jobs can be inspected and
+cancelled through routes/history.py; finished ones are forgotten after
+HISTORY_JOB_TTL_SECONDS, or once more than HISTORY_JOBS_KEPT are finished.
+"""
+import asyncio
+import logging
+import types
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+import numpy as np
+
+import route_manager
+from global_context import history_max_concurrency, history_write_batch_size, history_executor, history_job_ttl_seconds, \
+    history_jobs_kept
+from metrics import sink_errors
+from history_backfill import compute_history_columns, iter_history_batches, columns_to_documents
+from simulation_random import simulation_random, STREAM_HISTORY
+from simulation_clock import simulation_clock
+from fleet_kpis import fleet_kpis
+
+logger = logging.getLogger(__name__)
+
+history_window_seconds = 3600  # 1 hour
+document_chunk_size = 250  # documents built per event loop slice
+
+# Car attributes read and advanced by compute_history_columns
+CAR_STATE_FIELDS = (
+    "car_id", "route_ids", "real_step", "engine_oil_level", "fuel_level", "traveled_distance",
+    "traveled_distance_since_start", "run_time", "speed", "speed_total", "average_speed", "is_moving",
+    "performance_score", "quality_score", "availability_score", "oee", "current_route", "steps_route",
+    "step_index", "latitude", "longitude", "is_engine_running", "max_fuel_level", "oil_temperature",
+)
+
+
+def resolve_history_window(latest_timestamp: Optional[datetime], now: datetime = None):
+    """Return (start, end) of the backfill: from the latest telemetry, but never more than one hour back."""
+    now = now or simulation_clock.now()
+    one_hour_ago = now - timedelta(seconds=history_window_seconds)
+    if latest_timestamp is None or latest_timestamp < one_hour_ago:
+        return one_hour_ago, now
+    return latest_timestamp, now
+
+
+def _init_process_worker(routes, route_geozones, geozone_names):
+    """Process pool initializer, workers get their own copy of ROUTES and the route geozone table."""
+    route_manager.ROUTES.update(routes)
+    route_manager.ROUTE_GEOZONES.update(route_geozones)
+    route_manager.GEOZONE_NAMES = geozone_names
+
+
+def _compute_car_history(state: dict, start_ts: float, end_ts: float, quality_score: float,
+                         oee_not_zero_on_start: int, send_every_n_steps: int, seed_sequence=None):
+    """Picklable wrapper around compute_history_columns, works on a plain dict of car state."""
+    car = types.SimpleNamespace(**state)
+    rng = np.random.default_rng(seed_sequence)
+    columns = compute_history_columns(car, start_ts, end_ts, quality_score, oee_not_zero_on_start, send_every_n_steps, rng)
+    return columns, {name: getattr(car, name) for name in CAR_STATE_FIELDS}
+
+
+@dataclass
+class HistoryJob:
+    job_id: str
+    session_id: str
+    cars_total: int
+    seq: int = 0  # submission order in the run, part of the job's random streams
+    cars_done: int = 0
+    documents_sent: int = 0
+    batches_sent: int = 0
+    documents_spilled: int = 0
+    status: str = "pending"  # pending, running, completed, cancelled, failed
+    error: Optional[str] = None
+    created_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+    task: Optional[asyncio.Task] = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "status": self.status,
+            "cars_total": self.cars_total,
+            "cars_done": self.cars_done,
+            "documents_sent": self.documents_sent,
+            "batches_sent": self.batches_sent,
+            "documents_spilled": self.documents_spilled,
+            "progress": round(self.cars_done / self.cars_total, 3) if self.cars_total else 1.0,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class HistoryJobManager:
+    """Runs history backfill jobs with a bounded number of cars computed at once."""
+
+    def __init__(self, max_concurrency: int = 4, write_batch_size: int = 2000, executor: str = "process",
+                 job_ttl: float = 3600.0, jobs_kept: int = 100):
+        self.max_concurrency = max(1, max_concurrency)
+        self.write_batch_size = max(1, write_batch_size)
+        self.executor_kind = executor
+        self.job_ttl = job_ttl
+        self.jobs_kept = max(0, jobs_kept)
+        self.jobs = {}
+        self.documents_sent_forgotten = 0  # by jobs pruned from self.jobs, so the total stays monotonic
+        self._submitted = 0
+        self._executor = None
+        self._semaphore = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    initializer=_init_process_worker,
+                    initargs=(dict(route_manager.ROUTES), dict(route_manager.ROUTE_GEOZONES), route_manager.GEOZONE_NAMES),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="history")
+        return self._executor
+
+    def submit(self, cars, session, latest_timestamp: Optional[datetime], session_id: str) -> HistoryJob:
+        """Start a backfill job for the given historic cars."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.prune()
+        self._submitted += 1
+        job = HistoryJob(job_id=uuid.uuid4().hex, session_id=session_id, cars_total=len(cars), seq=self._submitted)
+        self.jobs[job.job_id] = job
+        job.task = asyncio.create_task(self._run_job(job, cars, session, latest_timestamp))
+        logger.info(f"History job {job.job_id} submitted for {len(cars)} cars")
+        return job
+
+    def prune(self, now: datetime = None):
+        """Forget finished jobs older than job_ttl, and the oldest finished ones beyond jobs_kept."""
+        now = now or datetime.now(timezone.utc)
+        finished = sorted((job for job in self.jobs.values() if job.finished_at is not None),
+                          key=lambda job: job.finished_at)
+        over_cap = len(finished) - self.jobs_kept
+        for i, job in enumerate(finished):
+            if i < over_cap or (now - job.finished_at).total_seconds() > self.job_ttl:
+                self.documents_sent_forgotten += job.documents_sent
+                del self.jobs[job.job_id]
+
+    def documents_sent(self) -> int:
+        """History documents written by all jobs so far, pruned ones included."""
+        return self.documents_sent_forgotten + sum(job.documents_sent for job in self.jobs.values())
+
+    def get(self, job_id: str) -> Optional[HistoryJob]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if job is None or job.task is None or job.task.done():
+            return False
+        job.task.cancel()
+        return True
+
+    async def cancel_all(self):
+        """Cancel every unfinished job and wait for them to wind down (the simulation stopped, job numbering restarts)."""
+        self._submitted = 0
+        tasks = [job.task for job in self.jobs.values() if job.task and not job.task.done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_job(self, job: HistoryJob, cars, session, latest_timestamp):
+        from main import send_historic_batch, spill_log
+
+        job.status = "running"
+        start, end = resolve_history_window(latest_timestamp)
+        logger.info(f"History job {job.job_id}: backfilling {start} -> {end}")
+        pending = []
+        write_lock = asyncio.Lock()
+
+        async def flush(force: bool = False):
+            # One write in flight per job, documents of all cars are merged into it
+            async with write_lock:
+                while pending and (force or len(pending) >= self.write_batch_size):
+                    batch = pending[:self.write_batch_size]
+                    del pending[:self.write_batch_size]
+                    if await send_historic_batch(session, batch):
+                        job.documents_sent += len(batch)
+                        job.batches_sent += 1
+                        continue
+                    sink_errors.labels("historic").inc()
+                    if spill_log is not None and await spill_log.append(batch, historic=True):
+                        job.documents_spilled += len(batch)  # replayed later by the spill log
+                    else:
+                        raise RuntimeError(f"Failed to send history batch of {len(batch)} documents")
+
+        async def backfill_car(car):
+            async with self._semaphore:
+                pending.extend(await self._car_documents(car, start, end, job.seq))
+            job.cars_done += 1
+            await flush()
+
+        tasks = [asyncio.create_task(backfill_car(car)) for car in cars]
+        try:
+            await asyncio.gather(*tasks)
+            await flush(force=True)
+            job.status = "completed"
+            logger.info(f"History job {job.job_id}: sent {job.documents_sent} documents in {job.batches_sent} batches")
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            logger.info(f"History job {job.job_id} cancelled")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            logger.error(f"History job {job.job_id} failed: {e}")
+        finally:
+            # One car failing (or the job being cancelled) stops the others: they free their worker slots
+            # and send nothing more for a job that is already over
+            unfinished = [task for task in tasks if not task.done()]
+            for task in unfinished:
+                task.cancel()
+            if unfinished:
+                await asyncio.gather(*unfinished, return_exceptions=True)
+            job.finished_at = datetime.now(timezone.utc)
+
+    async def _car_documents(self, car, start: datetime, end: datetime, job_seq: int = 0):
+        """Compute one car in the worker pool, then build its documents on the loop in small slices."""
+        from main import oee_not_zero_on_start, timeseries_historic_send_every_n_steps, geofence_manager
+
+        state = {name: getattr(car, name) for name in CAR_STATE_FIELDS}
+        loop = asyncio.get_running_loop()
+        columns, final_state = await loop.run_in_executor(
+            self._get_executor(),
+            _compute_car_history,
+            state,
+            start.timestamp(),
+            end.timestamp(),
+            fleet_kpis.quality,
+            oee_not_zero_on_start,
+            timeseries_historic_send_every_n_steps,
+            simulation_random.seed_sequence(STREAM_HISTORY, job_seq, car.car_id),
+        )
+        for name, value in final_state.items():
+            setattr(car, name, value)
+
+        documents = []
+        for chunk in iter_history_batches(columns, document_chunk_size):
+            sessions = await car.get_sessions()
+            documents.extend(columns_to_documents(car, chunk, sessions, geofence_manager))
+            await asyncio.sleep(0)  # let the real-time simulation run between slices
+        return documents
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+history_job_manager = HistoryJobManager(history_max_concurrency, history_write_batch_size, history_executor,
+                                        history_job_ttl_seconds, history_jobs_kept)
@@ -1,24 +1,40 @@
 import numpy as np  
-import json  
-import random  
 import asyncio  
 import aiohttp  
 import logging  
 from dataclasses import dataclass
-from collections import deque  
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Optional
+from typing import Dict, Optional
 from fastapi.middleware.cors import CORSMiddleware  
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from pydantic_settings import BaseSettings  
+from fastapi import FastAPI, BackgroundTasks
 import uvicorn
 import state_manager 
 from geofence_manager import GeofenceManager  # geofence logic is here, avoiding gets to db throught the run
-from routes.simulation import stop_simulation_internal
+from routes.simulation import stop_simulation_internal, restore_simulation
 from routes.sessions import router as sessions_api  
 from routes.simulation import router as simulation_api
-from route_manager import load_routes, ROUTES  
-from global_context import  set_session,get_session, constant_fuel_consumption_per_m, constant_oil_consumption_per_m, geofences_service, timeseries_post, HTTP_SESSION
+from routes.history import router as history_api
+from routes.metrics import router as metrics_api
+from route_manager import load_routes, lookup_geozone, ROUTES  
+from history_jobs import history_job_manager
+from session_registry import session_registry, historic_session_registry
+from simulation_random import simulation_random, CarNoise, STREAM_CAR
+from simulation_clock import simulation_clock
+from simulation_logging import setup_logging, log_event
+from fleet_kpis import fleet_kpis, car_status, RUNNING
+from fleet_snapshot import fleet_snapshot
+from shared_fleet_state import shared_fleet_state
+from checkpoint import checkpoint_manager
+from telemetry_pipeline import TelemetryPipeline
+from telemetry_codec import encode_batch, BSON_CONTENT_TYPE, JSON_CONTENT_TYPE
+from telemetry_sinks import create_sink
+from spill_log import SpillLog
+from metrics import metrics, monitor_event_loop_lag
+from shard_coordinator import shard_coordinator
+from global_context import  set_session,get_session, constant_fuel_consumption_per_m, constant_oil_consumption_per_m, geofences_service, timeseries_post, HTTP_SESSION, routes_path, \
+    telemetry_batch_size, telemetry_flush_seconds, telemetry_max_queue, telemetry_max_in_flight, telemetry_overflow_policy, telemetry_max_retries, \
+    telemetry_wire_format, telemetry_sink_kind, telemetry_spill_dir, telemetry_spill_segment_bytes, telemetry_spill_max_bytes, \
+    telemetry_spill_replay_rate
 
 # FastAPI app
 app = FastAPI(title="Car Simulation Microservice", version="1.0.0")
@@ -38,27 +54,11 @@ app.add_middleware(
 geofence_manager = GeofenceManager()  
 # telemetry global time for history  
 
-batch_queue = deque()  # Global batch queue  
-batch_lock = asyncio.Lock()  # Lock for thread-safe batch operations  
-batch_task = None  # Background task for batch processing  
-
-# Logging setup  
-logging.basicConfig(  
-    level=logging.INFO,  
-    format='%(asctime)s - %(levelname)s - %(message)s',  
-    handlers=[  
-        logging.FileHandler("simulation.log"),  
-        logging.StreamHandler()  
-    ]  
-) 
-logger = logging.getLogger(__name__)  
 
+# Logging setup: stdout and LOG_FILE, written by a listener thread off the event loop  
+setup_logging()
+logger = logging.getLogger(__name__)  
 
-state_lock = asyncio.Lock()  
-  
-# Helpers for tracking simulation state  
-cars_correctly_running = 300  # Updated for 300 cars
-total_cars = 300  
 
 #variables for simulation, change performance and oee.
 
@@ -70,9 +70,8 @@ oee_not_zero_on_start = 1200
 timeseries_send_every_n_steps = 5  # Send every 5 steps for performance, so every 5-10 seconds per car.
 timeseries_historic_send_every_n_steps = 10  # Send every 10 steps for history, so every 20-40 simulated seconds, is sent in batches of 1000 for performance with bulk
 
-batch_size = 1000  #  batch for efficiency using write bulk API, can be adjusted based on performance needs
-batch_size_history=250
-batch_time=10  # 10 seconds for batch processing, can be adjusted based on performance needs
+batch_size = telemetry_batch_size  #  batch for efficiency using write bulk API, can be adjusted based on performance needs
+batch_time = telemetry_flush_seconds  # 10 seconds for batch processing, can be adjusted based on performance needs
 
 cdt = timezone(timedelta(hours=-5))
 
@@ -90,6 +89,13 @@ def convert_numpy_types(obj):
             return [convert_numpy_types(item) for item in obj]
         return obj
 
+def encode_payload(batch_data):
+    """Request body and headers for a batch in the configured wire format (TELEMETRY_WIRE_FORMAT)."""
+    if telemetry_wire_format == "bson":
+        return {"data": encode_batch(batch_data), "headers": {"Content-Type": BSON_CONTENT_TYPE}}
+    # Convert numpy types to regular Python types
+    return {"json": convert_numpy_types(batch_data), "headers": {"Content-Type": JSON_CONTENT_TYPE}}
+
 
 
 @dataclass
@@ -122,8 +128,6 @@ class Car:
     steps_route:int = 0  # Total steps in the current route 
     # Internal state
     performance_score: float =0 # From 0 to 1
-    sessions: list = None  # List of session IDs, can be used for tracking or logging
-    sessions_lock: asyncio.Lock = None  # Will be initialized in __post_init__
     step_index: int = 0
     real_step: int = 0
     route_index: int = 0  # 0 or 1
@@ -136,58 +140,67 @@ class Car:
     last_batch_send: datetime = None  
     def __post_init__(self):
         self.route_ids = [self.car_id, self.car_id + 1] if self.car_id % 2 == 1 else [self.car_id, self.car_id - 1]
-        # Initialize sessions list and lock properly
-        if self.sessions is None:
-            self.sessions = []
-        if self.sessions_lock is None:
-            self.sessions_lock = asyncio.Lock()
         if self.last_batch_send is None:  
             self.last_batch_send = datetime.now(timezone.utc)
+        self.noise = None  # per-car seeded noise stream, created on the first update
 
     async def update(self, move_distance_m: float, time_per_step: float):
+        if self.noise is None:
+            self.noise = CarNoise(simulation_random.generator(STREAM_CAR, self.car_id))
+        speed_noise, crash_draw, availability_delta = self.noise.step()
         self.real_step+=1
         self.engine_oil_level = max(self.engine_oil_level - move_distance_m * constant_oil_consumption_per_m, 0)
         self.traveled_distance += (move_distance_m ) # km 
         self.traveled_distance_since_start += move_distance_m  # m
         self.fuel_level = max(self.fuel_level - move_distance_m * constant_fuel_consumption_per_m, 0)
         self.run_time += time_per_step
-        self.speed = max(((move_distance_m / 1000) / (time_per_step / 3600)), 0) + random.uniform(-4.35, 4.25) #  speed variation km/h,  non-negative
+        self.speed = max(((move_distance_m / 1000) / (time_per_step / 3600)), 0) + speed_noise #  speed variation km/h,  non-negative
         self.speed = max(self.speed, 0)  # Ensure non-negative
         self.speed_total += self.speed
         self.average_speed = self.speed_total / self.real_step
         
         
-        if (random.random() < 0.001):  # 0.1% chance of crash
+        if (crash_draw < 0.001):  # 0.1% chance of crash
             self.is_crashed = True
             self.is_engine_running = False
-            logger.warning(f" Car {self.car_id} has crashed!")
+            log_event("car.crashed", logging.WARNING, car_id=self.car_id)
             self.speed = 0
-            await decrement_cars_correctly_running()  
         if self.fuel_level <= 0:
             self.is_engine_running = False
             self.speed = 0
-            logger.warning(f" Car {self.car_id} has run out of fuel!")
-            await decrement_cars_correctly_running()
+            log_event("car.out_of_fuel", logging.WARNING, car_id=self.car_id)
         if self.engine_oil_level <= 0:
             self.is_oil_leak = True
             self.is_engine_running = False
-            logger.warning(f" Car {self.car_id} has an oil leak!")
-            await decrement_cars_correctly_running()
+            log_event("car.oil_leak", logging.WARNING, car_id=self.car_id)
         self.is_moving = self.speed > 0
         #performance attributes
         self.performance_score = min(1,((self.real_step + oee_not_zero_on_start) /(self.steps_route + oee_not_zero_on_start))) if self.steps_route > 0 else 0
-        self.quality_score = cars_correctly_running/total_cars
-        self.availability_score = min(1, max(0.6, self.availability_score + (random.uniform(-0.02, 0.02))))
+        self.quality_score = fleet_kpis.quality  # share of the fleet running, last KPI tick
+        self.availability_score = min(1, max(0.6, self.availability_score + availability_delta))
         self.oee = self.quality_score * self.availability_score * self.performance_score
+        if not self.is_historic:
+            fleet_kpis.record(self.car_id, car_status(self.is_engine_running, self.is_crashed, self.fuel_level),
+                              self.oee, self.availability_score, self.performance_score)
+            fleet_snapshot.record(self.car_id, self.longitude, self.latitude, self.is_crashed, self.is_moving,
+                                  self.is_engine_running, self.is_oil_leak)
+
+    @property
+    def registry(self):
+        """Session registry of this car, live and historic cars are tracked separately."""
+        return historic_session_registry if self.is_historic else session_registry
+
+    @property
+    def sessions(self):
+        """Current sessions, an immutable tuple read without locking."""
+        return self.registry.sessions_of(self.car_id)
 
     async def get_sessions(self):
-        """Safely get a copy of current sessions."""
-        async with self.sessions_lock:
-            return self.sessions.copy() if self.sessions else []
+        """Get a copy of current sessions."""
+        return list(self.sessions)
 
     async def to_document(self):
-        # Get a safe copy of sessions
-        sessions_copy = await self.get_sessions()
+        sessions_copy = list(self.sessions)
         
         doc = {
             "car_id": self.car_id,
@@ -226,17 +239,17 @@ class Car:
                     raise RuntimeError("HTTP_SESSION is not initialized. Check startup_event.")  
 
                 if  state_manager.is_paused():  
-                    logger.info(f"Car {self.car_id}: Simulation paused.")  
-                    while  state_manager.is_paused():  
-                        await asyncio.sleep(5)  # Wait for the pause state to change 10 seconds, will stop completly after 15 minutes. 
+                    log_event("car.paused", car_id=self.car_id)  
+                    await state_manager.wait_while_paused()  # Woken up right away on resume or stop
+                    continue
                 elif  state_manager.is_stopped():  
-                    logger.info(f"Car {self.car_id}: Simulation stopped. Exiting.")  
+                    log_event("car.stopped", car_id=self.car_id)  
                     break  # Exit the simulation loop when stopped  
                 
                 self.current_route = self.route_ids[self.route_index]
                 if self.current_route not in ROUTES:
-                    logger.warning(f"Car {self.car_id}: Route {self.current_route} not found, skipping")
-                    await asyncio.sleep(10)
+                    log_event("car.route_missing", logging.WARNING, car_id=self.car_id, route=self.current_route)
+                    await simulation_clock.sleep(10)
                     continue
                     
                 steps, dist_per_step, time_per_step = ROUTES[self.current_route]
@@ -245,40 +258,41 @@ class Car:
                 while self.step_index < len(steps) and  state_manager.is_running():
                     self.latitude, self.longitude = steps[self.step_index]
                     await self.update(dist_per_step, time_per_step) # will always update, so its realistic.
-                    # Access sessions with proper locking (reduced logging frequency)
+                    # Sessions come from the registry, no locking (reduced logging frequency)
                     if self.step_index % 30 == 0:  # check every 30-60 seconds if new user joined.
                         current_sessions = await self.get_sessions()
                         if self.step_index % 60 == 0:  # Log every 2 checks, less IO (will delete this before production)
                             if current_sessions:  # Only log if there are sessions
-                                logger.info(f"Car {self.car_id} has {current_sessions}")
+                                log_event("car.sessions", logging.DEBUG, car_id=self.car_id, sessions=current_sessions)
                     if self.step_index % 10 == 0: #check geofence every 10 steps
                         try:
-                            self.current_geozone = geofence_manager.check_point_in_geofences(self.longitude, self.latitude)  
-                            logger.info(f"Car {self.car_id}: Current geozone: {self.current_geozone}")
+                            # Precomputed per-step table, point-in-polygon only if the route has no entry
+                            self.current_geozone = lookup_geozone(self.current_route, self.step_index) \
+                                or geofence_manager.check_point_in_geofences(self.longitude, self.latitude)
+                            log_event("car.geozone", logging.DEBUG, car_id=self.car_id, geozone=self.current_geozone)
                         except Exception as e:
-                            logger.warning(f" Geofence check error: {e}")
+                            log_event("car.geofence_error", logging.WARNING, car_id=self.car_id, error=e)
                             self.current_geozone = "Error checking geofence"
 
                     # Send timeseries data every step
                     if self.step_index % timeseries_send_every_n_steps == 0 and self.is_engine_running:  # Send every 5 steps, so once per 5-10 seconds for performance, but not if crashed or not running (log those)
                         try:  
                             document = await self.to_document()  
-                            # Add current timestamp  
-                            document["timestamp"] = datetime.now(timezone.utc).isoformat()  
+                            # Add current (simulated) timestamp  
+                            document["timestamp"] = simulation_clock.now().isoformat()  
                               
                             # Add to global batch queue  
                             await add_to_batch(document)  
                               
                         except Exception as e:  
-                            logger.warning(f"Error creating document for batch for Car {self.car_id}: {e}")
+                            log_event("car.document_error", logging.WARNING, car_id=self.car_id, error=e)
                     
                     self.step_index += 1
 
                     # Handle car failures
                     if self.is_engine_running==False:
-                        logger.warning(f" Car {self.car_id} is not running, skipping step {self.step_index}")
-                        await asyncio.sleep(60) # Wait for a minute before next step
-                        await increment_cars_correctly_running()  
+                        log_event("car.failure_wait", logging.WARNING, car_id=self.car_id, step=self.step_index)
+                        await simulation_clock.sleep(60) # Wait for a minute before next step
                         if self.is_crashed:
                             self.is_crashed = False  # Reset crash state after some time
                             self.is_engine_running = True  # Restart the engine after a crash
@@ -289,306 +303,34 @@ class Car:
                             self.engine_oil_level = 1000  # Reset oil level after a leak
                             self.is_oil_leak = False  
                         continue
-                    await asyncio.sleep(time_per_step)
+                    await simulation_clock.sleep(time_per_step)
                 
                 # Finished route, switch to next one
-                await asyncio.sleep(10)
+                await simulation_clock.sleep(10)
                 self.route_index = 1 - self.route_index
                 self.step_index = 0
         except asyncio.CancelledError:  
-            logger.info(f"Car {self.car_id} simulation task cancelled.")
+            log_event("car.cancelled", car_id=self.car_id)
         except Exception as e:  
             logger.error(f"Car {self.car_id}: Unexpected error occurred: {e}") 
 
-    async def update_history(self, move_distance_m: float, time_per_step: float):
-        self.real_step+=1
-        self.engine_oil_level = max(self.engine_oil_level - move_distance_m * constant_oil_consumption_per_m, 0)
-        self.traveled_distance += (move_distance_m ) # km 
-        self.traveled_distance_since_start += move_distance_m  # m
-        self.fuel_level = max(self.fuel_level - move_distance_m * constant_fuel_consumption_per_m, 0)
-        self.run_time += time_per_step
-        self.speed = max(((move_distance_m / 1000) / (time_per_step / 3600)), 0) + random.uniform(-4.35, 4.25) #  speed variation km/h,  non-negative
-        self.speed = max(self.speed, 0)  # Ensure non-negative
-        self.speed_total += self.speed
-        self.average_speed = self.speed_total / self.real_step
-        self.is_moving = self.speed > 0
-        self.performance_score = min(1,((self.real_step + oee_not_zero_on_start) /(self.steps_route + oee_not_zero_on_start))) if self.steps_route > 0 else 0
-        self.quality_score = cars_correctly_running/total_cars
-        self.availability_score = min(1, max(0.6, self.availability_score + (random.uniform(-0.02, 0.02))))
-        self.oee = self.quality_score * self.availability_score * self.performance_score
-
-    
-    async def run_history(self, session, latest_timestamp: datetime):
-        """Run historic simulation for this car - emulates run() logic but for past data."""
-        logger.info(f"Car {self.car_id}: Starting history simulation")
-        
-        try:
-            # Calculate target steps for 1 hour of simulation
-            target_duration_seconds = 3600  # 1 hour
-            total_steps_processed = 0
-            batch_data = []
-
-            start_time = datetime.now(timezone.utc)
-            logger.info(f"Car {self.car_id}: Current time: {start_time}")  
-
-              
-            if latest_timestamp is None:  
-                latest_timestamp = start_time - timedelta(seconds=target_duration_seconds)  
-                logger.info(f"Car {self.car_id}: Using default latest telemetry timestamp: {latest_timestamp}")  
-            else:  
-                logger.info(f"Car {self.car_id}: Using latest telemetry timestamp? {latest_timestamp}")  
-                
-                # Calculate one hour ago as a datetime  
-                one_hour_ago = start_time - timedelta(seconds=target_duration_seconds)  
-                
-                logger.info(f"api time: {latest_timestamp}")    
-                logger.info(f"1 hour ago: {one_hour_ago}")    
-                
-                # Compare datetimes, not timestamps  
-                if latest_timestamp < one_hour_ago:  
-                    logger.info(f"Latest telemetry is older than 1 hour ago, using 1 hour ago")  
-                    latest_timestamp = one_hour_ago  
-                else:  
-                    logger.info(f"Latest telemetry is newer than 1 hour ago, using it")  
-                
-                # Calculate time difference in seconds for logging  
-                time_diff = (start_time - latest_timestamp).total_seconds()  
-                logger.info(f"Time difference from now: {time_diff} seconds")  
-            
-            # Convert to timestamp for the counter  
-            counter = latest_timestamp.timestamp()  
-
-            # Initialize route switching variables (same as run function)
-            self.step_index = 0
-            route_index = 0  # Start with first route (0 or 1)
-            
-            while counter < start_time.timestamp():
-                # Get current route (same logic as run function)
-                self.current_route = self.route_ids[route_index]
-                
-                if self.current_route not in ROUTES:
-                    logger.warning(f"Car {self.car_id}: Route {self.current_route} not found in history, skipping")
-                    break
-                    
-                steps, dist_per_step, time_per_step = ROUTES[self.current_route]
-                self.steps_route = len(steps)  # Update for performance calculation
-                logger.info(f"Car {self.car_id}: Processing route {self.current_route} with {len(steps)} steps every {time_per_step} seconds")
-                
-                #logger.info(f"Car {self.car_id}: History processing route {self.current_route} with {len(steps)} steps")
-                
-                # Process steps in current route (same logic as run function)
-                while self.step_index < len(steps) and counter < start_time.timestamp():
-                    try:
-                        # Update position (same as run function)
-                        self.latitude, self.longitude = steps[self.step_index]
-                        
-                        # Update car state using history method
-                        await self.update_history(dist_per_step, time_per_step)
-                        
-                        # Check geofence every 10 steps (same as run function)
-                        if self.step_index % 10 == 0:
-                            try:
-                                self.current_geozone = geofence_manager.check_point_in_geofences(self.longitude, self.latitude)  
-                            except Exception as e:
-                                logger.warning(f"Car {self.car_id}: Geofence check error in history: {e}")
-                                self.current_geozone = "Error checking geofence"
-                        
-                        # Create document with historical timestamp
-                        
-                        counter+=time_per_step
-                        # Set timestamp to simulate past data (going backwards from current time)
-                        historical_timestamp = counter
-                        
-
-                        if self.step_index % timeseries_historic_send_every_n_steps == 0 and self.is_engine_running: 
-                            data_point = await self.to_document()
-                            local_dt = datetime.fromtimestamp(historical_timestamp, tz=cdt)
-                            utc_dt = local_dt.astimezone(timezone.utc)
-                            data_point["timestamp"] = utc_dt.isoformat()
-                            batch_data.append(data_point)
-                        self.step_index += 1
-                        total_steps_processed += 1
-                        
-                        # Send batch when full (optimized for history)
-                        if len(batch_data) >= batch_size_history:
-                            success = await self._send_historic_batch(session, batch_data)
-                            if success:
-                                logger.info(f"Car {self.car_id}: Sent history batch of {len(batch_data)} records")
-                                batch_data = []
-                            else:
-                                logger.error(f"Car {self.car_id}: Failed to send history batch - stopping history simulation")
-                                return  # Exit gracefully instead of breaking inner loop
-                            await asyncio.sleep(1)  # Small delay to avoid overwhelming the API
-                        
-                        # Handle car failures in history (same logic as run function, but no sleep)
-                        if not self.is_engine_running:
-                            logger.info(f"Car {self.car_id}: Engine stopped in history at step {self.step_index}")
-                            # Reset conditions immediately in history (no waiting)
-                            if self.is_crashed:
-                                self.is_crashed = False
-                                self.is_engine_running = True
-                            if self.fuel_level <= 0:
-                                self.fuel_level = self.max_fuel_level
-                                self.is_engine_running = True
-                            if self.engine_oil_level <= 0:
-                                self.engine_oil_level = 1000
-                                self.is_oil_leak = False
-                                self.is_engine_running = True
-                            
-                    except Exception as e:
-                        logger.error(f"Car {self.car_id}: Error processing history step {self.step_index}: {e}")
-                        continue
-                
-                # Finished current route - switch to next route (same as run function)
-                route_index = 1 - route_index  # Switch between 0 and 1
-                self.step_index = 0  # Reset step index for new route
-                
-                logger.info(f"Car {self.car_id}: Switched to route {self.route_ids[route_index]} for history")
-            
-            # Send remaining batch data
-            if batch_data:
-                success = await self._send_historic_batch(session, batch_data)
-                if success:
-                    logger.info(f"Car {self.car_id}: Sent final history batch of {len(batch_data)} records")
-                else:
-                    logger.warning(f"Car {self.car_id}: Failed to send final history batch - simulation may have been stopped")
-            
-            elapsed_time = (datetime.now(cdt) - start_time).total_seconds()
-            logger.info(f"Car {self.car_id}: Completed history simulation - {total_steps_processed} steps in {elapsed_time:.2f}s")
-            
-        except Exception as e:
-            logger.error(f"Car {self.car_id}: Unexpected error during history simulation: {e}")
-            import traceback
-            logger.error(f"Car {self.car_id}: History traceback: {traceback.format_exc()}")
-    
-    async def _send_historic_batch(self, session, batch_data):
-        """Send batch data to historic API endpoint."""
-        try:
-            # Check if session is closed before attempting request
-            if session.closed:
-                logger.warning(f"Car {self.car_id}: Session is closed, cannot send batch")
-                return False
-                
-            # Debug: Log the request details
-            logger.info(f"Car {self.car_id}: Preparing to send {len(batch_data)} records to /historic-batch")
-            
-            # Convert numpy types to regular Python types
-            formatted_data = convert_numpy_types(batch_data)
-            
-            # Debug: Log first item to check format
-            if formatted_data:
-                logger.debug(f"Car {self.car_id}: Sample coordinates: {formatted_data[0].get('coordinates', 'None')}")
-            
-            # Make the API call
-            response = await session.post(
-                f"{timeseries_post}:9002/historic-batch",
-                json=formatted_data,
-                headers={"Content-Type": "application/json"}
-            )
-            # Debug: Log response details            
-            if response.status == 201:
-                response_text = await response.text()
-                logger.info(f"Car {self.car_id}: API success: {response_text}")
-                return True
-            else:
-                response_text = await response.text()
-                logger.error(f"Car {self.car_id}: API error {response.status}: {response_text}")
-                return False
-                
-        except RuntimeError as e:
-            if "Session is closed" in str(e):
-                logger.warning(f"Car {self.car_id}: HTTP session was closed - simulation likely stopped")
-                return False
-            else:
-                logger.error(f"Car {self.car_id}: Runtime error sending batch: {e}")
-                return False
-        except Exception as e:
-            logger.error(f"Car {self.car_id}: Error sending batch to API: {e}")
-            import traceback
-            logger.error(f"Car {self.car_id}: API call traceback: {traceback.format_exc()}")
-            return False
-    
     async def add_session(self, session_id: str):  
-        async with self.sessions_lock:
-            """Append a new session ID to metadata['sessions']."""      
-            if not self.sessions:      
-                self.sessions = [] 
-            if session_id not in self.sessions:  
-                self.sessions.append(session_id)     
-                #logger.info(f"Added session {session_id} to car {self.car_id}. Current sessions: {self.sessions}")  else logger alreeady has this session, so no need to add it again
+        """Append a new session ID to metadata['sessions'] (no-op if the car already has it)."""      
+        self.registry.add(session_id, [self.car_id])
 
     async def clear_sessions(self): 
-        async with self.sessions_lock: 
-            """Clear all session IDs."""  
-            if self.sessions:
-                self.sessions.clear()  
-            #logger.info(f"Cleared all sessions for car {self.car_id}")  
+        """Clear all session IDs."""  
+        self.registry.remove_car(self.car_id)
 
 # State tracking functions
-async def decrement_cars_correctly_running():  
-    async with state_lock:  
-        global cars_correctly_running  
-        cars_correctly_running -= 1  
-
-async def increment_cars_correctly_running():  
-    async with state_lock:  
-        global cars_correctly_running  
-        cars_correctly_running += 1  
+async def add_to_batch(document):  
+    """Queue a document for the next /timeseries-batch write (waits or drops when the queue is full)."""  
+    await telemetry_pipeline.put(document)  
 
+async def add_many_to_batch(documents):  
+    """Queue several documents at once, e.g. one fleet engine tick."""  
+    await telemetry_pipeline.put_many(documents)  
 
-async def add_to_batch(document):  
-    """Add document to batch queue in a thread-safe manner."""  
-    async with batch_lock:  
-        batch_queue.append(document)  
-        logger.debug(f"Added document to batch. Queue size: {len(batch_queue)}")  
-  
-#this function only uses timeseries normal inserts
-async def batch_processor():  
-    """Background task that processes batches when they reach target size or timeout."""  
-    logger.info("Batch processor started")  
-    last_send_time = datetime.now(timezone.utc)  
-      
-    while True:  
-        try:  
-            current_time = datetime.now(timezone.utc)  
-            time_since_last_send = (current_time - last_send_time).total_seconds()  
-              
-            # Check if we should send batch (either size limit or time limit)  
-            should_send = False  
-            batch_data = []  
-              
-            async with batch_lock:  
-                queue_size = len(batch_queue)  
-                  
-                # Send if batch is full OR if 10 seconds have passed and we have data  
-                if queue_size >= batch_size or (time_since_last_send >= batch_time and queue_size > 0):  
-                    should_send = True  
-                    # Extract up to batch_size items  
-                    items_to_send = min(batch_size, queue_size)  
-                    batch_data = [batch_queue.popleft() for _ in range(items_to_send)]  
-                    logger.info(f"Preparing to send batch of {len(batch_data)} items (queue had {queue_size})")  
-              
-            if should_send and batch_data:  
-                success = await send_batch_to_api(batch_data)  
-                if success:  
-                    last_send_time = current_time  
-                    logger.info(f"Successfully sent batch of {len(batch_data)} items")  
-                else:  
-                    # If failed, put items back at front of queue  
-                    async with batch_lock:  
-                        batch_queue.extendleft(reversed(batch_data))  
-                    logger.error(f"Failed to send batch, items returned to queue")  
-              
-            # Small sleep to prevent busy waiting  
-            await asyncio.sleep(1)  
-              
-        except asyncio.CancelledError:  
-            logger.info("Batch processor cancelled")  
-            break  
-        except Exception as e:  
-            logger.error(f"Error in batch processor: {e}")  
-            await asyncio.sleep(5)  # Wait before retrying  
-  
 async def send_batch_to_api(batch_data):  
     """Send batch data to the timeseries API."""  
     try:  
@@ -597,13 +339,9 @@ async def send_batch_to_api(batch_data):
             logger.error("HTTP session not available for batch send")  
             return False  
           
-        # Convert numpy types to regular Python types  
-        formatted_data = convert_numpy_types(batch_data)  
-          
         response = await session.post(  
             f"{timeseries_post}:9002/timeseries-batch",  # Assuming you have a batch endpoint  
-            json=formatted_data,  
-            headers={"Content-Type": "application/json"}  
+            **encode_payload(batch_data)  
         )  
           
         if response.status in [200, 201]:  
@@ -617,14 +355,105 @@ async def send_batch_to_api(batch_data):
         logger.error(f"Error sending batch to API: {e}")  
         return False  
   
-async def flush_remaining_batch():  
-    """Send any remaining items in batch queue (called during shutdown)."""  
-    async with batch_lock:  
-        if batch_queue:  
-            remaining_data = list(batch_queue)  
-            batch_queue.clear()  
-            logger.info(f"Flushing {len(remaining_data)} remaining items from batch queue")  
-            await send_batch_to_api(remaining_data)  
+async def send_historic_batch(session, batch_data):
+    """Write history documents (merged across cars by the history jobs) through the configured telemetry sink."""
+    return await telemetry_sink.write_historic(batch_data, session)
+
+async def post_historic_batch(session, batch_data):
+    """Send history documents to the historic API endpoint (http sink)."""
+    try:
+        # Check if session is closed before attempting request
+        if session.closed:
+            logger.warning("Session is closed, cannot send history batch")
+            return False
+
+        log_event("history.batch_sending", logging.DEBUG, documents=len(batch_data))
+
+        response = await session.post(
+            f"{timeseries_post}:9002/historic-batch",
+            **encode_payload(batch_data)
+        )
+        response_text = await response.text()
+        if response.status == 201:
+            log_event("history.batch_sent", documents=len(batch_data), response=response_text)
+            return True
+        logger.error(f"History API error {response.status}: {response_text}")
+        return False
+
+    except RuntimeError as e:
+        if "Session is closed" in str(e):
+            logger.warning("HTTP session was closed - simulation likely stopped")
+        else:
+            logger.error(f"Runtime error sending history batch: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"Error sending history batch to API: {e}")
+        return False
+
+# Where batches end up: timeSeriesPOST (http), MongoDB directly (mongo), a file or nowhere (null)
+telemetry_sink = create_sink(telemetry_sink_kind)
+
+# Batches the sink did not take are kept on disk and replayed in order once it recovers
+spill_log = SpillLog(telemetry_spill_dir, telemetry_spill_segment_bytes, telemetry_spill_max_bytes) if telemetry_spill_dir else None
+spill_replay_task = None
+
+# this pipeline only uses timeseries normal inserts, history goes through send_historic_batch
+telemetry_pipeline = TelemetryPipeline(
+    telemetry_sink.write,
+    batch_size=batch_size,
+    flush_interval=batch_time,
+    max_queue=telemetry_max_queue,
+    max_in_flight=telemetry_max_in_flight,
+    overflow_policy=telemetry_overflow_policy,
+    max_retries=telemetry_max_retries,
+    spill_log=spill_log,
+)
+lag_monitor_task = None
+
+
+def _active_car_tasks():
+    from routes.simulation import SIMULATION_TASKS
+    return sum(not task.done() for task in SIMULATION_TASKS)
+
+def _history_jobs_by_status():
+    counts = {}
+    for job in history_job_manager.jobs.values():
+        counts[job.status] = counts.get(job.status, 0) + 1
+    return [({"status": status}, count) for status, count in counts.items()]
+
+def _unfinished_history_jobs():
+    return [job for job in history_job_manager.jobs.values() if job.status in ("pending", "running")]
+
+# Read from the objects that already keep them, only when /metrics is scraped
+metrics.gauge_function("simulation_car_tasks_active", "Running simulation tasks (one per car, or one fleet engine task).", _active_car_tasks)
+metrics.gauge_function("simulation_shards_alive", "Running shard worker processes (0 when not sharded).",
+                       lambda: sum(shard.process.is_alive() for shard in shard_coordinator.shards))
+metrics.gauge_function("simulation_cars_correctly_running", "Cars with the engine running.", lambda: int(fleet_kpis.counts[0, RUNNING]))
+metrics.gauge_function("simulation_fleet_oee", "Average OEE of the cars of every fleet (fleet 0: all cars), last KPI tick.", lambda: [
+    ({"fleet": str(group)}, float(oee_sum / cars))
+    for group, (oee_sum, cars) in enumerate(zip(fleet_kpis.sums[:, 0], fleet_kpis.counts.sum(axis=1))) if cars
+])
+metrics.gauge_function("simulation_telemetry_queue_depth", "Documents waiting in the telemetry queue.",
+                       lambda: telemetry_pipeline.queue.qsize() if telemetry_pipeline.queue is not None else 0)
+metrics.gauge_function("simulation_telemetry_batches_in_flight", "Telemetry batches being written.", lambda: telemetry_pipeline.in_flight)
+metrics.counter_function("simulation_telemetry_documents_total", "Telemetry documents by outcome.", lambda: [
+    ({"outcome": outcome}, getattr(telemetry_pipeline, f"documents_{outcome}"))
+    for outcome in ("queued", "sent", "dropped", "failed", "spilled")
+])
+metrics.counter_function("simulation_telemetry_sink_documents_written_total", "Documents written by the telemetry sink, live and history.",
+                         lambda: [({"sink": telemetry_sink.name}, telemetry_sink.documents_written)])
+metrics.gauge_function("simulation_spill_bytes", "Bytes of telemetry waiting in the spill log.",
+                       lambda: spill_log.disk_bytes() if spill_log is not None else 0)
+metrics.gauge_function("simulation_history_jobs", "History backfill jobs by status.", _history_jobs_by_status)
+metrics.gauge_function("simulation_history_cars_pending", "Cars still to backfill in unfinished history jobs.",
+                       lambda: sum(job.cars_total - job.cars_done for job in _unfinished_history_jobs()))
+metrics.counter_function("simulation_history_documents_sent_total", "History documents written by backfill jobs.",
+                         history_job_manager.documents_sent)
+metrics.gauge_function("simulation_clock_timestamp_seconds", "Simulated time as a Unix timestamp.", simulation_clock.timestamp)
+
+# Fast clock mode holds simulated time while a blocking telemetry queue is full, instead of letting blocked cars fall behind
+simulation_clock.backpressure = lambda: telemetry_pipeline.overflow_policy == "block" and telemetry_pipeline.queue is not None \
+    and telemetry_pipeline.queue.full()
 
 
 
@@ -634,12 +463,11 @@ async def flush_remaining_batch():
 @app.on_event("startup")
 async def startup_event():
     """Initialize the microservice."""
-    global batch_task
+    global spill_replay_task, lag_monitor_task
     session = aiohttp.ClientSession()  
     set_session(session)
     global latest_telemetry 
     latest_telemetry= datetime.now(cdt).timestamp()-3600
-    load_routes("processed_routes.json") # if want to try with 10 cars, use smaller_sim_routes/processed_routes_10.json
     try:  
         
         await geofence_manager.load_geofences(f"{geofences_service}:9004/geofences",session) 
@@ -647,9 +475,28 @@ async def startup_event():
   # Load geofences from an API  
     except Exception as e:  
         logger.error(f"Failed to load geofences from API during startup: {str(e)}")
-
-    batch_task = asyncio.create_task(batch_processor())  
-    logger.info("Batch processor started")  
+    # Routes after geofences, so the per-step geozone table can be built (or read from cache)
+    load_routes(routes_path, geofence_manager) # if want to try with 10 cars, use smaller_sim_routes/processed_routes_10.json
+    if shard_coordinator.enabled:
+        # After the routes, so the workers read the geozone table from the cache instead of building it again
+        await shard_coordinator.start()
+
+    telemetry_pipeline.start()  
+    if spill_log is not None:  
+        spill_replay_task = asyncio.create_task(spill_log.replay(telemetry_sink, telemetry_spill_replay_rate))  
+    logger.info(f"Telemetry sink: {telemetry_sink.name}")  
+    lag_monitor_task = asyncio.create_task(monitor_event_loop_lag())
+    fleet_kpis.start()
+    if not shard_coordinator.enabled:
+        shared_fleet_state.start()  # sharded, every worker publishes its own segment
+        await restore_simulation()  # sharded, every worker restores its own checkpoint when it starts
+        checkpoint_manager.start()
+    else:
+        restored = [shard.restored for shard in shard_coordinator.shards if shard.restored]
+        if restored:
+            state_manager.set_state(restored[0]["state"])
+            if restored[0]["clock_mode"] == "fast":
+                shard_coordinator.start_clock_sync()
 
     logger.info("Car Simulation Microservice started")
 
@@ -657,25 +504,37 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up resources on shutdown."""
-    global batch_task  
-      
-    # Stop batch processor and flush remaining data  
-    if batch_task:  
-        batch_task.cancel()  
-        try:  
-            await batch_task  
-        except asyncio.CancelledError:  
-            pass  
-      
-    # Flush any remaining batch data  
-    await flush_remaining_batch()  
-    
-    # Stop simulation first (this will handle task cleanup)
+    # Checkpoint first, while the cars are still there
+    await checkpoint_manager.stop()
     try:
-        await stop_simulation_internal()
+        await checkpoint_manager.save()
+    except Exception as e:
+        logger.error(f"Error writing checkpoint on shutdown: {e}")
+
+    # Stop simulation first (this will handle task cleanup), so nothing puts documents into a stopping pipeline
+    try:
+        await stop_simulation_internal(keep_checkpoint=True)
     except Exception as e:
         logger.error(f"Error during simulation cleanup: {e}")
+
+    # Stop the telemetry pipeline, flushing remaining data and waiting for in-flight sends  
+    await telemetry_pipeline.stop()  
+    if spill_replay_task:  
+        spill_replay_task.cancel()  
+        try:  
+            await spill_replay_task  
+        except asyncio.CancelledError:  
+            pass  
     
+    history_job_manager.shutdown()
+    if shard_coordinator.enabled:
+        await shard_coordinator.shutdown()
+    await telemetry_sink.close()
+    if lag_monitor_task:
+        lag_monitor_task.cancel()
+    await fleet_kpis.stop()
+    await shared_fleet_state.stop()
+
     # Close session after all tasks are done
     session = get_session()  
     if session and not session.closed:
@@ -686,6 +545,8 @@ async def shutdown_event():
 
 app.include_router(sessions_api, prefix="")  
 app.include_router(simulation_api, prefix="/simulation")  
+app.include_router(history_api, prefix="/history")
+app.include_router(metrics_api, prefix="")
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=9006)
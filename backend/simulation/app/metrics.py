@@ -0,0 +1,188 @@
+"""
+Prometheus metrics of the simulation service (GET /metrics).
+
+Counters and histograms are plain numbers updated in place from the event
+loop thread, with no locks: a counter increment is one addition, a
+histogram observation one bisect into the bucket bounds. Values that are
+already kept elsewhere (queue depth, running car tasks, history job
+progress) are not duplicated; they are registered as callbacks and read
+only when /metrics is scraped.
+
+render() produces the Prometheus text exposition format (version 0.0.4).
+"""
+import asyncio
+import bisect
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from sub-millisecond geofence lookups to multi-second sink writes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2000, 5000, 10000)
+
+lag_probe_interval = 0.5  # seconds between event loop lag samples
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "+Inf" if value > 0 else "-Inf"
+        if math.isnan(value):
+            return "NaN"
+        return repr(value)
+    return str(int(value))
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Counter:
+    """Monotonic counter, optionally with labels: counter.inc() or counter.labels("live").inc()."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.value = 0
+        self._children = {}
+
+    def labels(self, *values) -> "Counter":
+        child = self._children.get(values)
+        if child is None:
+            child = Counter(self.name, self.documentation)
+            self._children[values] = child
+        return child
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self):
+        if not self.labelnames:
+            yield self.name, {}, self.value
+        for values, child in list(self._children.items()):
+            yield self.name, dict(zip(self.labelnames, values)), child.value
+
+
+class Histogram:
+    """Fixed-bucket histogram, observe() is a bisect and three additions."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        counts = list(self.counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            yield f"{self.name}_bucket", {"le": _format_value(float(bound))}, cumulative
+        yield f"{self.name}_sum", {}, self.sum
+        yield f"{self.name}_count", {}, cumulative
+
+
+class CallbackMetric:
+    """
+    Metric read at scrape time. The callback returns a number, or a list of
+    (labels dict, number) pairs for a labelled metric.
+    """
+
+    def __init__(self, name: str, documentation: str, callback, kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self):
+        value = self.callback()
+        if isinstance(value, (list, tuple)):
+            for labels, sample in value:
+                yield self.name, labels, sample
+        else:
+            yield self.name, {}, value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        # Registering a name again replaces it (main can be imported twice, as a script and as a module)
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, buckets))
+
+    def gauge_function(self, name: str, documentation: str, callback) -> CallbackMetric:
+        return self._register(CallbackMetric(name, documentation, callback, "gauge"))
+
+    def counter_function(self, name: str, documentation: str, callback) -> CallbackMetric:
+        """A counter kept by another object (e.g. the pipeline's documents_sent), read at scrape time."""
+        return self._register(CallbackMetric(name, documentation, callback, "counter"))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.warning(f"Metric {metric.name} could not be collected: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# Hot-path metrics, updated where the work happens
+event_loop_lag = metrics.histogram(
+    "simulation_event_loop_lag_seconds", "How late the event loop wakes up a sleeping task.")
+telemetry_flush_duration = metrics.histogram(
+    "simulation_telemetry_flush_duration_seconds", "Duration of one telemetry batch write attempt.")
+telemetry_flush_size = metrics.histogram(
+    "simulation_telemetry_flush_batch_size", "Documents per telemetry batch write attempt.", SIZE_BUCKETS)
+sink_errors = metrics.counter(
+    "simulation_telemetry_sink_errors_total", "Batch writes the telemetry sink did not accept.", ("stream",))
+geofence_check_duration = metrics.histogram(
+    "simulation_geofence_check_duration_seconds", "Duration of one point-in-geofence check (single point or batch).")
+geofence_points_checked = metrics.counter(
+    "simulation_geofence_points_checked_total", "Points classified with point-in-polygon tests.")
+
+
+async def monitor_event_loop_lag(interval: float = lag_probe_interval):
+    """Sample event loop lag forever (run it as a task): the delay past the requested wake-up time."""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            event_loop_lag.observe(max(loop.time() - start - interval, 0.0))
+        except asyncio.CancelledError:
+            break
@@ -1,34 +1,239 @@
-import numpy as np  
-import json  
-import logging  
-
-logger = logging.getLogger(__name__)  
-ROUTES = {}  # Global dictionary for routes  
-  
-def load_routes(filepath: str):  
-    """  
-    Load routes into memory from a JSON file.  
-    Structure:  
-    ROUTES = {  
-        route_id: (  
-            np.array([(lat1, lng1), (lat2, lng2), ...]),  
-            distancePerStep,  
-            timePerStep  
-        )  
-    }  
-    """  
-    global ROUTES  
-    try:  
-        with open(filepath, "r") as f:  
-            raw = json.load(f)  
-        for key, val in raw.items():  
-            ROUTES[int(key)] = (  
-                np.array([(s["lat"], s["lng"]) for s in val["steps"]], dtype=np.float32),  
-                float(val["distancePerStep"]),  
-                float(val["timePerStep"]),  
-            )  
-        logger.info(f"Loaded {len(ROUTES)} routes.")  
-    except FileNotFoundError:  
-        logger.error(f"Routes file '{filepath}' not found.")  
-    except Exception as e:  
-        logger.error(f"Error loading routes: {e}")  
+import numpy as np
+import json
+import hashlib
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+ROUTES = {}  # Global dictionary for routes
+ROUTE_GEOZONES = {}  # route_id -> np.int32 array, geofence index for every step (-1 outside all geofences)
+GEOZONE_NAMES = np.array([], dtype=object)  # geofence names, with "No active geofence" last so index -1 maps to it
+ROUTE_DISTANCES = {}  # route_id -> np.float64 array, distance along the route at every step (m), see build_route_distances
+
+EARTH_RADIUS_M = 6371000.0
+
+# Binary route store: a directory with one contiguous float32 (lat, lng) array and an index of routes
+ROUTE_STORE_COORDS = "coords.npy"
+ROUTE_STORE_INDEX = "index.npy"
+ROUTE_STORE_DIGEST = "digest.txt"  # sha256 of the two arrays, written with the store so startup never hashes coords
+ROUTE_INDEX_DTYPE = np.dtype([
+    ("route_id", np.int64),
+    ("offset", np.int64),
+    ("length", np.int64),
+    ("distance_per_step", np.float64),
+    ("time_per_step", np.float64),
+])
+
+def load_routes(filepath: str, geofence_manager=None, cache_dir: str = None):
+    """
+    Load routes into memory from a JSON file or a binary route store directory.
+    Structure:
+    ROUTES = {
+        route_id: (
+            np.array([(lat1, lng1), (lat2, lng2), ...]),
+            distancePerStep,
+            timePerStep
+        )
+    }
+    With a binary store (see convert_routes_to_binary) the coordinate arrays
+    are read-only views into one memory-mapped file, so startup does no parsing
+    and processes share the same page cache.
+    If a geofence_manager with loaded geofences is given, the geozone of
+    every route step is precomputed too (see build_geozone_table).
+    """
+    global ROUTES
+    try:
+        if os.path.isdir(filepath):
+            _load_binary_routes(filepath)
+        else:
+            with open(filepath, "r") as f:
+                raw = json.load(f)
+            for key, val in raw.items():
+                ROUTES[int(key)] = (
+                    np.array([(s["lat"], s["lng"]) for s in val["steps"]], dtype=np.float32),
+                    float(val["distancePerStep"]),
+                    float(val["timePerStep"]),
+                )
+        build_route_distances()
+        logger.info(f"Loaded {len(ROUTES)} routes.")
+    except FileNotFoundError:
+        logger.error(f"Routes file '{filepath}' not found.")
+        return
+    except Exception as e:
+        logger.error(f"Error loading routes: {e}")
+        return
+
+    if geofence_manager is not None and geofence_manager.geofences:
+        try:
+            build_geozone_table(filepath, geofence_manager, cache_dir)
+        except Exception as e:
+            logger.error(f"Error building route geozone table: {e}")
+
+def _load_binary_routes(store_dir: str):
+    """Map the binary route store, ROUTES entries are slices of the shared coordinate array."""
+    coords = np.load(os.path.join(store_dir, ROUTE_STORE_COORDS), mmap_mode="r")
+    index = np.load(os.path.join(store_dir, ROUTE_STORE_INDEX))
+    for route_id, offset, length, distance_per_step, time_per_step in index.tolist():
+        ROUTES[route_id] = (coords[offset:offset + length], distance_per_step, time_per_step)
+
+def convert_routes_to_binary(json_path: str, store_dir: str):
+    """
+    Convert a processed_routes.json file into a binary route store directory.
+
+    Writes coords.npy (every route's (lat, lng) steps back to back, float32),
+    index.npy (route id, offset, length, distancePerStep, timePerStep) and
+    digest.txt (content hash of both, the geozone cache key).
+    """
+    with open(json_path, "r") as f:
+        raw = json.load(f)
+    route_ids = sorted(int(key) for key in raw)
+    index = np.zeros(len(route_ids), dtype=ROUTE_INDEX_DTYPE)
+    coords, offset = [], 0
+    for i, route_id in enumerate(route_ids):
+        val = raw[str(route_id)]
+        steps = np.array([(s["lat"], s["lng"]) for s in val["steps"]], dtype=np.float32).reshape(-1, 2)
+        index[i] = (route_id, offset, len(steps), float(val["distancePerStep"]), float(val["timePerStep"]))
+        coords.append(steps)
+        offset += len(steps)
+
+    os.makedirs(store_dir, exist_ok=True)
+    all_coords = np.concatenate(coords) if coords else np.zeros((0, 2), dtype=np.float32)
+    np.save(os.path.join(store_dir, ROUTE_STORE_COORDS), all_coords)
+    np.save(os.path.join(store_dir, ROUTE_STORE_INDEX), index)
+    with open(os.path.join(store_dir, ROUTE_STORE_DIGEST), "w") as f:
+        f.write(_hash_files([os.path.join(store_dir, ROUTE_STORE_INDEX), os.path.join(store_dir, ROUTE_STORE_COORDS)]))
+    logger.info(f"Converted {len(route_ids)} routes ({offset} steps) from {json_path} to {store_dir}")
+
+def cumulative_distances(steps, distance_per_step: float) -> np.ndarray:
+    """
+    Distance along a route at every step (m), from 0 at the first step.
+
+    Polyline vertices are not evenly spaced: the haversine length of every
+    segment is measured and scaled so the route keeps its total distance
+    (distancePerStep per segment, the Google route distance).
+    """
+    steps = np.asarray(steps, dtype=np.float64).reshape(-1, 2)
+    if len(steps) < 2:
+        return np.zeros(len(steps), dtype=np.float64)
+    lat, lng = np.radians(steps[:, 0]), np.radians(steps[:, 1])
+    a = np.sin(np.diff(lat) / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lng) / 2) ** 2
+    segments = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    total = distance_per_step * len(segments)
+    measured = segments.sum()
+    if measured > 0 and total > 0:
+        segments *= total / measured
+    elif total > 0:
+        segments[:] = distance_per_step  # all steps on one point, spread the distance evenly
+    return np.concatenate(([0.0], np.cumsum(segments)))
+
+def build_route_distances():
+    """Cumulative distances of every loaded route, one vectorized pass per route."""
+    ROUTE_DISTANCES.clear()
+    for route_id, (steps, distance_per_step, _) in ROUTES.items():
+        ROUTE_DISTANCES[route_id] = cumulative_distances(steps, distance_per_step)
+
+def interpolate_positions(coords: np.ndarray, distances: np.ndarray, first: np.ndarray, last: np.ndarray, at: np.ndarray):
+    """
+    Positions at distances along routes, for many lookups at once.
+
+    Args:
+        coords: (lat, lng) of the steps of every route, back to back.
+        distances: cumulative distance of every row of coords, increasing over the whole table
+            (each route's distances offset by the total of the routes before it).
+        first, last: row of the first and last step of the route of every lookup.
+        at: distance of every lookup on the same scale as distances.
+    Returns:
+        (latitude, longitude, row of the step the segment starts at) arrays.
+    """
+    end = np.clip(np.searchsorted(distances, at, side="right"), first + 1, last)
+    start = end - 1
+    segment = distances[end] - distances[start]
+    fraction = np.divide(at - distances[start], segment, out=np.zeros_like(at, dtype=np.float64), where=segment > 0)
+    fraction = np.clip(fraction, 0.0, 1.0)[:, None]
+    position = coords[start] + (coords[end] - coords[start]) * fraction
+    return position[:, 0], position[:, 1], start
+
+def _hash_files(paths) -> str:
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def _file_digest(filepath: str) -> str:
+    """
+    Cache key of the routes: the content hash of a routes JSON file (parsed whole anyway),
+    or the digest stored with a binary route store. A store converted before digest.txt existed
+    is keyed on its index contents plus the size and mtime of coords.npy, never by reading coords.
+    """
+    if not os.path.isdir(filepath):
+        return _hash_files([filepath])
+    try:
+        with open(os.path.join(filepath, ROUTE_STORE_DIGEST)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        stat = os.stat(os.path.join(filepath, ROUTE_STORE_COORDS))
+        return hashlib.sha256(bytes.fromhex(_hash_files([os.path.join(filepath, ROUTE_STORE_INDEX)]))
+                              + f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+
+def build_geozone_table(filepath: str, geofence_manager, cache_dir: str = None):
+    """
+    Precompute the geozone of every step of every route.
+
+    Routes are static and geofences rarely change, so the table is cached on
+    disk, keyed by a hash of the routes file plus the geofence set, and only
+    recomputed when either of them changes.
+    """
+    global GEOZONE_NAMES
+    from global_context import route_cache_dir
+
+    cache_dir = cache_dir or route_cache_dir
+    key = hashlib.sha256((_file_digest(filepath) + geofence_manager.fingerprint()).encode()).hexdigest()[:32]
+    cache_path = os.path.join(cache_dir, f"geozones_{key}.npz")
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path, allow_pickle=False) as cached:
+            route_ids, offsets, zones, names = cached["route_ids"], cached["offsets"], cached["zones"], cached["names"]
+        logger.info(f"Loaded route geozone table from cache {cache_path}")
+    else:
+        route_ids = np.array(sorted(ROUTES), dtype=np.int64)
+        lengths = np.array([len(ROUTES[r][0]) for r in route_ids], dtype=np.int64)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        coords = np.concatenate([ROUTES[r][0] for r in route_ids]) if len(route_ids) else np.zeros((0, 2))
+        # One batched point-in-polygon pass over every step of every route
+        zones = geofence_manager.classify_points(coords[:, 1], coords[:, 0]).astype(np.int32)
+        names = np.array([g["name"] for g in geofence_manager.geofences], dtype=str)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = cache_path + ".tmp.npz"
+            np.savez_compressed(tmp_path, route_ids=route_ids, offsets=offsets, zones=zones, names=names)
+            os.replace(tmp_path, cache_path)
+            logger.info(f"Saved route geozone table to {cache_path}")
+        except OSError as e:
+            logger.warning(f"Could not cache route geozone table: {e}")
+
+    from geofence_manager import NO_GEOFENCE
+    ROUTE_GEOZONES.clear()
+    for i, route_id in enumerate(route_ids.tolist()):
+        ROUTE_GEOZONES[route_id] = zones[offsets[i]:offsets[i + 1]]
+    GEOZONE_NAMES = np.array(names.tolist() + [NO_GEOFENCE], dtype=object)
+    logger.info(f"Route geozone table ready for {len(ROUTE_GEOZONES)} routes, {int(offsets[-1])} steps.")
+
+def lookup_geozone(route_id: int, step_index: int):
+    """Geozone name of a route step from the precomputed table, None if the table has no entry."""
+    zones = ROUTE_GEOZONES.get(route_id)
+    if zones is None or step_index >= len(zones):
+        return None
+    return GEOZONE_NAMES[zones[step_index]]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert processed_routes.json into a binary route store.")
+    parser.add_argument("json_path", nargs="?", default="processed_routes.json")
+    parser.add_argument("store_dir", nargs="?", default="processed_routes_bin")
+    args = parser.parse_args()
+    convert_routes_to_binary(args.json_path, args.store_dir)
@@ -0,0 +1,33 @@
+from fastapi import APIRouter, HTTPException
+from history_jobs import history_job_manager
+import logging
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+@router.get("/jobs")
+async def list_history_jobs():
+    """List all history backfill jobs and their progress."""
+    return {"jobs": [job.to_dict() for job in history_job_manager.jobs.values()]}
+
+
+@router.get("/jobs/{job_id}")
+async def get_history_job(job_id: str):
+    """Get the progress of one history backfill job."""
+    job = history_job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"History job {job_id} not found")
+    return job.to_dict()
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_history_job(job_id: str):
+    """Cancel a running history backfill job."""
+    job = history_job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"History job {job_id} not found")
+    if not history_job_manager.cancel(job_id):
+        raise HTTPException(status_code=400, detail=f"History job {job_id} is already {job.status}")
+    logger.info(f"History job {job_id} cancellation requested")
+    return {"message": f"History job {job_id} cancelling", "job_id": job_id}
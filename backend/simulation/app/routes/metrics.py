@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from metrics import metrics, CONTENT_TYPE
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus metrics: event loop lag, car tasks, telemetry queue and flushes, sink errors, geofences, history jobs."""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
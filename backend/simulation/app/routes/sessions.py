@@ -1,21 +1,30 @@
 from fastapi import APIRouter, HTTPException, BackgroundTasks  
 from state_manager import is_running , set_state,is_paused,is_stopped 
 import logging
-from car_manager import get_car_by_id, get_all_cars
-from car_history_manager import get_h_car_by_id, get_h_all_cars, create_hist_cars
+from car_manager import get_car_by_id, get_all_cars, get_car_ids
+from car_history_manager import get_h_car_by_id, get_h_all_cars, get_h_car_ids, create_hist_cars
+from session_registry import session_registry, historic_session_registry
+import numpy as np
 from pydantic import BaseModel
-from .simulation import HISTORY_TASKS
-from global_context import get_session,timeseries_get  # Import HTTP_SESSION management functions 
+from typing import List, Optional
+from history_jobs import history_job_manager
+from global_context import get_session,timeseries_get, fleet_registry  # Import HTTP_SESSION management functions 
 from datetime import datetime , timedelta, timezone
 import asyncio
-from .simulation import increment_active_users
+from shard_coordinator import shard_coordinator, ShardError
+from simulation_clock import simulation_clock
+from .simulation import increment_active_users, set_simulation_state
 
 # Pydantic models for API
 class SessionRequest(BaseModel):
     session_id: str
-    range1: int  # 0-100: cars 1 to range1
-    range2: int  # 0-100: cars 101 to 101+range2-1  
-    range3: int  # 0-100: cars 201 to 201+range3-1
+    range1: int = 0  # cars of fleet 1: its first range1 car ids (1 to range1 with the default fleets)
+    range2: int = 0  # cars of fleet 2 (101 to 100+range2 with the default fleets)
+    range3: int = 0  # cars of fleet 3 (201 to 200+range3 with the default fleets)
+    fleet_counts: Optional[List[int]] = None  # cars per fleet for any number of fleets, replaces range1..3
+
+    def counts(self) -> List[int]:
+        return self.fleet_counts if self.fleet_counts is not None else [self.range1, self.range2, self.range3]
 
 
 logger = logging.getLogger(__name__)  
@@ -23,71 +32,62 @@ router = APIRouter()
 
 @router.post("/sessions")
 async def add_sessions(request: SessionRequest):
-    """Add session to cars based on three ranges: 1-x1, 101-x2, 201-x3."""
+    """Add session to the first N cars of every fleet (range1..3, or fleet_counts), fleets from fleet_registry."""
     if is_stopped():
         raise HTTPException(status_code=400, detail="Simulation is not running")
     
-    # Validate ranges
-    if not all(0 <= x <= 100 for x in [request.range1, request.range2, request.range3]):
-        raise HTTPException(status_code=400, detail="All ranges must be between 0 and 100")
-    
-    # Generate car ID lists based on ranges
-    car_ids = []
-    
-    # Range 1: cars 1 to range1 (if range1 > 0)
-    if request.range1 > 0:
-        car_ids.extend(list(range(1, request.range1 + 1)))
+    # Validate counts against the fleet sizes
+    counts = request.counts()
+    fleets = fleet_registry.fleets
+    if any(count for count in counts[len(fleets):]):
+        raise HTTPException(status_code=400, detail=f"There are only {len(fleets)} fleets")
+    if not all(0 <= count <= fleet.size for fleet, count in zip(fleets, counts)):
+        sizes = ", ".join(str(fleet.size) for fleet in fleets)
+        raise HTTPException(status_code=400, detail=f"Fleet counts must be between 0 and the fleet size ({sizes})")
     
-    # Range 2: cars 101 to 101+range2-1 (if range2 > 0)  
-    if request.range2 > 0:
-        car_ids.extend(list(range(101, 101 + request.range2)))
+    # Car ids: the first count ids of every fleet
+    selections = [fleet_registry.selection(fleet.number, count) for fleet, count in zip(fleets, counts)]
+    ranges = {f"range{fleet.number}": f"{selection[0]}-{selection[1]}" if selection else "none"
+              for fleet, selection in zip(fleets, selections)}
+    requested = np.concatenate([np.arange(first, last + 1, dtype=np.int64) for first, last in filter(None, selections)]
+                               or [np.empty(0, dtype=np.int64)])
     
-    # Range 3: cars 201 to 201+range3-1 (if range3 > 0)
-    if request.range3 > 0:
-        car_ids.extend(list(range(201, 201 + request.range3)))
-    
-    if not car_ids:
+    if requested.size == 0:
         return {
             "message": "No cars selected (all ranges are 0)",
             "session_id": request.session_id,
             "cars_updated": 0,
-            "ranges": {
-                "range1": f"1-{request.range1}" if request.range1 > 0 else "none",
-                "range2": f"101-{100 + request.range2}" if request.range2 > 0 else "none", 
-                "range3": f"201-{200 + request.range3}" if request.range3 > 0 else "none"
-            }
+            "ranges": ranges
         }
-    # Add sessions to cars
+    # Add sessions to cars, one registry update for the whole selection
     cars_updated = 0
     cars_not_found = []
     if is_running() or is_paused():
-        for car_id in car_ids:
-            car = await get_car_by_id(car_id)
-            hc = await get_h_car_by_id(car_id)
-            if car:
-                await car.add_session(request.session_id)
-                cars_updated += 1
-                if hc:
-                    await hc.add_session(request.session_id)
-            else:
-                cars_not_found.append(car_id)
+        if shard_coordinator.enabled:
+            # The cars live in the shard workers, each adds the session to the ones it runs
+            try:
+                found = np.isin(requested, await shard_coordinator.add_sessions(request.session_id, requested))
+            except ShardError as e:
+                raise HTTPException(status_code=503, detail=str(e))
+        else:
+            found = np.isin(requested, await get_car_ids())
+            session_registry.add(request.session_id, requested[found])
+        historic_ids = requested[found & np.isin(requested, await get_h_car_ids())]
+        historic_session_registry.add(request.session_id, historic_ids)
+        cars_updated = int(found.sum())
+        cars_not_found = requested[~found].tolist()
     
     result = {
         "message": f"Session {request.session_id} added to {cars_updated} cars",
         "session_id": request.session_id,
         "cars_updated": cars_updated,
-        "total_cars_requested": len(car_ids),
-        "ranges": {
-            "range1": f"1-{request.range1}" if request.range1 > 0 else "none",
-            "range2": f"101-{100 + request.range2}" if request.range2 > 0 else "none",
-            "range3": f"201-{200 + request.range3}" if request.range3 > 0 else "none"
-        }
+        "total_cars_requested": int(requested.size),
+        "ranges": ranges
     }
     increment_active_users()
     if is_paused():
-        global HISTORY_TASKS        
         session = get_session()
-        hc = await create_hist_cars(request.range1, request.range2, request.range3, request.session_id)
+        hc = await create_hist_cars(counts, request.session_id)
         
         if not hc:
             logger.error("No historic cars were created")
@@ -119,8 +119,8 @@ async def add_sessions(request: SessionRequest):
             # Log the exact timestamp received from API          
             logger.info(f"Parsed API timestamp (UTC): {timestamp_data}")          
                     
-            # Use UTC consistently for one_hour_ago          
-            one_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)          
+            # Simulated time (UTC), the backfill ends where the live documents are          
+            one_hour_ago = simulation_clock.now() - timedelta(hours=1)          
             logger.info(f"One hour ago (UTC): {one_hour_ago}")         
                     
             if timestamp_data:          
@@ -143,29 +143,37 @@ async def add_sessions(request: SessionRequest):
         except Exception as e:          
             logger.error(f"Error fetching timestamp data: {e}")          
             # Ensure timezone awareness in the fallback case      
-            latest_timestamp = datetime.now(timezone.utc) - timedelta(hours=1)      
+            latest_timestamp = simulation_clock.now() - timedelta(hours=1)      
             logger.error(f"Using default timestamp (1 hour ago) due to error: {latest_timestamp}")   
-        HISTORY_TASKS = []
-        for car in hc:
-            try:
-                task = asyncio.create_task(car.run_history(session, latest_timestamp))
-                HISTORY_TASKS.append(task)
-                logger.info(f"Created task for car {car.car_id}")
-            except Exception as e:
-                logger.error(f"Failed to create task for car {car.car_id}: {e}")
-        
-        logger.info(f"Spawned {len(HISTORY_TASKS)} simulation tasks.")
-        set_state("running")
+        # Backfill runs as a job with bounded concurrency, progress at /history/jobs/{job_id}
+        job = history_job_manager.submit(hc, session, latest_timestamp, request.session_id)
+        result["history_job_id"] = job.job_id
+        logger.info(f"Submitted history job {job.job_id} for {len(hc)} cars.")
+        await set_simulation_state("running")
     if cars_not_found:
         result["cars_not_found"] = cars_not_found
     return result
 
+@router.get("/fleets")
+async def get_fleets():
+    """Fleet layout: car-id range of every fleet (FLEET_SIZES)."""
+    return fleet_registry.to_dict()
+
 @router.delete("/sessions/{car_id}")
 async def clear_car_sessions(car_id: int):
     """Clear all sessions from a specific car."""
     if not is_running():
         raise HTTPException(status_code=400, detail="Simulation is not running")
     
+    if shard_coordinator.enabled:
+        try:
+            found = await shard_coordinator.clear_sessions(car_id)
+        except ShardError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        if not found:
+            raise HTTPException(status_code=404, detail=f"Car {car_id} not found")
+        return {"message": f"Sessions cleared for car {car_id}"}
+
     car = await get_car_by_id(car_id)
     if not car:
         raise HTTPException(status_code=404, detail=f"Car {car_id} not found")
@@ -1,9 +1,20 @@
 import asyncio  
-from fastapi import APIRouter, HTTPException, BackgroundTasks  
-from car_manager import create_cars, get_all_cars, clear_all_cars  
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request, Response  
+from fastapi.responses import JSONResponse  
+from typing import Optional
+from car_manager import create_cars, get_all_cars, clear_all_cars, register_car, get_car_ids
 from car_history_manager import clear_h_all_cars
-from state_manager import is_running, is_stopped, is_paused, set_state  
-from global_context import get_session, timeseries_get , latest_telemetry # Import HTTP_SESSION management functions  
+from state_manager import is_running, is_stopped, is_paused, set_state, get_state  
+from global_context import get_session, timeseries_get , latest_telemetry, simulation_engine, engine_tick_seconds, engine_motion, simulation_seed # Import HTTP_SESSION management functions  
+from fleet_engine import FleetEngine
+from history_jobs import history_job_manager
+from simulation_random import simulation_random, CarNoise, STREAM_FLEET_ENGINE, STREAM_CAR
+from simulation_clock import simulation_clock, CLOCK_MODES
+from fleet_kpis import fleet_kpis, merge_raw, status_codes
+from fleet_snapshot import fleet_snapshot, merge_views
+from checkpoint import checkpoint_manager, checkpoint_sessions, checkpoint_noise, CAR_COLUMNS, ENGINE_ARRAYS
+from session_registry import session_registry
+from shard_coordinator import shard_coordinator, ShardError
 import logging  
 import datetime
 
@@ -12,7 +23,7 @@ router = APIRouter()
   
 # Global simulation tasks list  
 SIMULATION_TASKS = []  
-HISTORY_TASKS = []
+FLEET_ENGINE = None  # Set when the simulation runs with the vectorized engine
 ACTIVE_USERS = 0  
 
 # Track last time /start was called  
@@ -99,11 +110,16 @@ async def stop_simulation():
   
   
 
-async def stop_simulation_internal():  
-    """Internal function to stop simulation and clean up tasks."""  
+async def stop_simulation_internal(keep_checkpoint: bool = False):  
+    """
+    Internal function to stop simulation and clean up tasks.
+    Args:
+        keep_checkpoint (bool): shutting down, keep the checkpoint for the next startup (shard workers keep theirs
+            when they shut down themselves).
+    """  
     global SIMULATION_TASKS  
-    global HISTORY_TASKS
     global ACTIVE_USERS
+    global FLEET_ENGINE
     global last_start_time
     
     # Stop timeout monitor  
@@ -115,9 +131,17 @@ async def stop_simulation_internal():
     ACTIVE_USERS = 0
     # Update simulation state first
     set_state("stopped")  
+    if not keep_checkpoint:
+        checkpoint_manager.discard()
+    if shard_coordinator.enabled and not keep_checkpoint:
+        try:
+            await shard_coordinator.set_state("stopped")
+        except ShardError as e:
+            logger.error(f"Error stopping shards: {e}")
     
-    # Cancel all running tasks first
-    all_tasks = SIMULATION_TASKS + HISTORY_TASKS
+    # Cancel history backfill jobs and all running tasks first
+    await history_job_manager.cancel_all()
+    all_tasks = list(SIMULATION_TASKS)
     for task in all_tasks:  
         if not task.done():  
             task.cancel()  
@@ -137,20 +161,138 @@ async def stop_simulation_internal():
   
     # Clear task lists
     SIMULATION_TASKS.clear()  
-    HISTORY_TASKS.clear()
+    FLEET_ENGINE = None
     
     # Clear cars after tasks are done
     await clear_h_all_cars()
     await clear_all_cars()
+    fleet_kpis.forget()
+    fleet_snapshot.forget()
     
     logger.info("Simulation cleanup completed")
+
+async def set_simulation_state(state: str):
+    """Set the simulation state, on the shard workers too when the simulation is sharded."""
+    set_state(state)
+    if shard_coordinator.enabled:
+        try:
+            await shard_coordinator.set_state(state)
+        except ShardError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+
+async def spawn_simulation(num_cars: int, engine: str, first_car_id: int = 1, engine_key: tuple = (), cars=None,
+                           motion: str = None, engine_state: dict = None):
+    """
+    Create cars first_car_id .. first_car_id+num_cars-1 and their simulation task(s) in this process.
+    Args:
+        num_cars (int): Number of cars to create.
+        engine (str): "tasks" (one task per car) or "vectorized" (one fleet engine task).
+        first_car_id (int): id of the first car, shard workers start at their range.
+        engine_key (tuple): extra key of the fleet engine random stream (the shard index).
+        cars (list, optional): registered cars to run instead of creating them (checkpoint restore).
+        motion (str, optional): vectorized engine motion, defaults to ENGINE_MOTION.
+        engine_state (dict, optional): fleet engine arrays and counters to resume from (checkpoint restore).
+    """
+    global SIMULATION_TASKS  
+    global FLEET_ENGINE
+    session = get_session()  # Safely retrieve HTTP_SESSION  
+    if cars is None:
+        cars = await create_cars(num_cars, first_car_id)  # Pass session explicitly to car creation  
+  
+    logger.info(f"HTTP_SESSION started")  # Confirm HTTP_SESSION existence  
+  
+    if engine == "vectorized":
+        # One task advances the whole fleet, cars in the registry become views over the engine arrays
+        FLEET_ENGINE = FleetEngine(cars, tick_seconds=engine_tick_seconds, motion=motion or engine_motion,
+                                   seed=simulation_random.seed_sequence(STREAM_FLEET_ENGINE, *engine_key))
+        if engine_state:
+            FLEET_ENGINE.load_state(engine_state)
+        for view in FLEET_ENGINE.views:
+            await register_car(view)
+        SIMULATION_TASKS = [simulation_clock.track(asyncio.create_task(FLEET_ENGINE.run(session)))]
+        logger.info(f"Spawned fleet engine task for {FLEET_ENGINE.size} cars.")
+    else:
+        # Spawn asynchronous tasks for each car  
+        SIMULATION_TASKS = [simulation_clock.track(asyncio.create_task(car.run(session))) for car in cars]  
+        logger.info(f"Spawned {len(SIMULATION_TASKS)} simulation tasks.")  
+    return cars
+
+async def restore_simulation():
+    """
+    Bring back the simulation of this process from its checkpoint (startup), in the state it was saved in.
+    Returns the checkpoint's car range and state, None when there was nothing to restore.
+    """
+    global last_start_time
+    from main import Car
+
+    checkpoint = checkpoint_manager.load()
+    if checkpoint is None:
+        return None
+    meta = checkpoint["meta"]
+    simulation_random.reset(meta["seed"])
+    clock = meta["clock"]
+    # Realtime follows the wall clock, the other modes carry on from the saved simulated time
+    simulation_clock.reset(clock["mode"], clock["speed"], None if clock["mode"] == "realtime" else clock["now"])
+
+    columns = {name: checkpoint[f"car.{name}"].tolist() for name in CAR_COLUMNS + ("current_geozone",)}
+    cars = []
+    for i in range(len(columns["car_id"])):
+        car = Car(is_historic=False, **{name: values[i] for name, values in columns.items()})
+        await register_car(car)
+        cars.append(car)
+    # The cars' noise carries on instead of replaying what it produced before the checkpoint
+    cars_by_id = {car.car_id: car for car in cars}
+    for car_id, state, pos in checkpoint_noise(checkpoint):
+        car = cars_by_id.get(car_id)
+        if car is not None:
+            car.noise = CarNoise(simulation_random.generator(STREAM_CAR, car_id))
+            car.noise.restore(state, pos)
+    for session_id, car_ids in checkpoint_sessions(checkpoint):
+        session_registry.add(session_id, car_ids)
+    # The cars only write their rows when they step: a paused restore serves the saved ones until resumed
+    saved = {name: checkpoint[f"car.{name}"] for name in CAR_COLUMNS}
+    fleet_snapshot.record_many(saved["car_id"], saved["longitude"], saved["latitude"], saved["is_crashed"],
+                               saved["is_moving"], saved["is_engine_running"], saved["is_oil_leak"])
+    fleet_kpis.record_many(saved["car_id"], status_codes(saved["is_engine_running"], saved["is_crashed"], saved["fuel_level"]),
+                           saved["oee"], saved["availability_score"], saved["performance_score"])
+    fleet_kpis.update()
+
+    engine_state = None
+    if meta["engine"] == "vectorized":
+        engine_state = {name: checkpoint[f"engine.{name}"] for name in ENGINE_ARRAYS}
+        engine_state.update(time=meta["engine_time"], tick_count=meta["engine_tick_count"], rng=meta["engine_rng"])
+    await spawn_simulation(len(cars), meta["engine"], cars=cars, motion=meta["motion"], engine_state=engine_state)
+    set_state(meta["state"])
+    last_start_time = datetime.datetime.utcnow()  # the inactivity timeout starts over
+    start_timeout_monitor()
+    checkpoint_manager.restored = {"first_car_id": meta["first_car_id"], "num_cars": len(cars), "state": meta["state"],
+                                   "clock_mode": clock["mode"]}
+    logger.info(f"Restored {len(cars)} cars ({meta['engine']}, {meta['state']}) from checkpoint {checkpoint_manager.path}")
+    return checkpoint_manager.restored
+
+
+async def local_status() -> dict:
+    """Status of the simulation running in this process."""
+    from main import telemetry_pipeline
+    return {
+        "state": get_state(),
+        "cars": len(await get_car_ids()),
+        "car_tasks_active": sum(not task.done() for task in SIMULATION_TASKS),
+        "queue_depth": telemetry_pipeline.queue.qsize() if telemetry_pipeline.queue is not None else 0,
+        "documents_queued": telemetry_pipeline.documents_queued,
+        "documents_sent": telemetry_pipeline.documents_sent,
+        "documents_dropped": telemetry_pipeline.documents_dropped,
+        "documents_failed": telemetry_pipeline.documents_failed,
+        "documents_spilled": telemetry_pipeline.documents_spilled,
+        "clock": simulation_clock.info(),
+    }
   
 async def pause_simulation():  
     """Pause the simulation."""  
     if not is_running():  
         raise HTTPException(status_code=400, detail="Simulation is not running")  
   
-    set_state("paused")  
+    await set_simulation_state("paused")  
     logger.info("Simulation paused")  
   
   
@@ -159,7 +301,7 @@ async def resume_simulation():
     if not is_paused():  
         raise HTTPException(status_code=400, detail="Simulation is not paused")  
   
-    set_state("running")  
+    await set_simulation_state("running")  
     logger.info("Simulation resumed")  
 
 @router.post("/reduce-users")
@@ -169,14 +311,29 @@ async def reduce_users():
     return {"active_users": get_active_users()}
   
 @router.post("/start/{num_cars}")  
-async def start_simulation_endpoint(num_cars: int):  
+async def start_simulation_endpoint(num_cars: int, engine: Optional[str] = None, seed: Optional[int] = None,
+                                    clock: Optional[str] = None, speed: Optional[float] = None,
+                                    clock_start: Optional[datetime.datetime] = None):  
     """  
     Start the simulation with a given number of cars.  
     Args:  
         num_cars (int): Number of cars to create.  
+        engine (str, optional): "tasks" or "vectorized", defaults to SIMULATION_ENGINE.  
+        seed (int, optional): random seed of the run, defaults to SIMULATION_SEED (fresh entropy if unset).  
+        clock (str, optional): "realtime", "scaled" or "fast", defaults to SIMULATION_CLOCK.  
+        speed (float, optional): simulated seconds per wall second in scaled mode, defaults to SIMULATION_SPEED.  
+        clock_start (datetime, optional): simulated start of the run, defaults to SIMULATION_CLOCK_START (now if unset).  
     """  
     if num_cars <= 0:  
         raise HTTPException(status_code=400, detail="Number of cars must be greater than 0")  
+
+    engine = engine or simulation_engine
+    if engine not in ("tasks", "vectorized"):
+        raise HTTPException(status_code=400, detail="Engine must be 'tasks' or 'vectorized'")
+    if clock is not None and clock not in CLOCK_MODES:
+        raise HTTPException(status_code=400, detail=f"Clock must be one of {', '.join(CLOCK_MODES)}")
+    if speed is not None and speed <= 0:
+        raise HTTPException(status_code=400, detail="Speed must be greater than 0")
   
     if is_running() or is_paused():  
         raise HTTPException(status_code=400, detail="Simulation is already running")  
@@ -193,18 +350,21 @@ async def start_simulation_endpoint(num_cars: int):
     # Start timeout monitor if not already running  
     start_timeout_monitor()  
   
-    global SIMULATION_TASKS  
-    session = get_session()  # Safely retrieve HTTP_SESSION  
-    cars = await create_cars(num_cars)  # Pass session explicitly to car creation  
-  
-    logger.info(f"HTTP_SESSION started")  # Confirm HTTP_SESSION existence  
-  
-    # Spawn asynchronous tasks for each car  
-    SIMULATION_TASKS = [asyncio.create_task(car.run(session)) for car in cars]  
-    logger.info(f"Spawned {len(SIMULATION_TASKS)} simulation tasks.")  
+    simulation_random.reset(seed if seed is not None else simulation_seed)  # same seed, same run
+    simulation_clock.reset(clock, speed, clock_start)
+    if shard_coordinator.enabled:
+        # Car ranges are split across the shard worker processes, each runs its cars on its own loop
+        try:
+            cars_started = await shard_coordinator.start_simulation(num_cars, engine, simulation_random.seed, {
+                "mode": simulation_clock.mode, "speed": simulation_clock.speed, "start": simulation_clock.start.isoformat()})
+        except ShardError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    else:
+        cars_started = len(await spawn_simulation(num_cars, engine))
   
     set_state("paused")      
-    return {"message": f"Started simulation with {len(cars)} cars."}  
+    return {"message": f"Started simulation with {cars_started} cars.", "seed": simulation_random.seed,
+            "clock": simulation_clock.info()}  
   
   
 @router.post("/stop")  
@@ -237,6 +397,62 @@ async def resume_simulation_endpoint():
     return {"message": "Simulation resumed"}  
   
   
+@router.get("/telemetry")  
+async def telemetry_stats():  
+    """Telemetry pipeline stats: queue depth, sent/dropped/failed counters and flush latency."""  
+    from main import telemetry_pipeline, telemetry_sink  
+    return {  
+        **telemetry_pipeline.stats(),  
+        "sink": telemetry_sink.name,  
+        "sink_documents_written": telemetry_sink.documents_written,  
+        "sink_batches_written": telemetry_sink.batches_written,  
+    }  
+  
+  
+@router.get("/status")  
+async def simulation_status():  
+    """Simulation state, cars and telemetry counters, summed over the shard workers when sharded."""  
+    if not shard_coordinator.enabled:  
+        return await local_status()  
+    status = await shard_coordinator.status()
+    # The shards' clocks, the coordinator's own one only moves in realtime and scaled mode
+    status["clock"] = status["clock"] or simulation_clock.info()
+    return {"state": get_state(), **status}  
+  
+  
+@router.get("/kpis")  
+async def simulation_kpis():  
+    """Fleet and per-fleet counters, quality, OEE, availability and performance (last KPI tick and rolling window)."""  
+    if not shard_coordinator.enabled:  
+        return fleet_kpis.render(fleet_kpis.raw())  
+    try:  
+        return fleet_kpis.render(merge_raw(await shard_coordinator.kpis()))  
+    except ShardError as e:  
+        raise HTTPException(status_code=503, detail=str(e))  
+  
+  
+@router.get("/snapshot")  
+async def simulation_snapshot(request: Request, session_id: str, since: Optional[int] = None):  
+    """Position and status of the session's cars from memory, all of them or only the ones changed after the tick since."""  
+    if_none_match = request.headers.get("if-none-match")  
+    if shard_coordinator.enabled:  
+        try:  
+            views = await shard_coordinator.snapshot(session_id, since)  
+        except ShardError as e:  
+            raise HTTPException(status_code=503, detail=str(e))  
+        etag = '"' + ".".join(str(view["tick"]) for view in views) + '"'  
+        if if_none_match == etag:  
+            return Response(status_code=304, headers={"ETag": etag})  
+        snapshot = merge_views(views)  
+    else:  
+        fleet_snapshot.publish(session_registry.version)  
+        etag = fleet_snapshot.etag()  
+        if if_none_match == etag:  
+            return Response(status_code=304, headers={"ETag": etag})  
+        snapshot = fleet_snapshot.view(session_registry.cars_of(session_id), since)  
+    return JSONResponse(content={"session_id": session_id, **snapshot}, headers={"ETag": etag})  
+  
+  
 @router.get("/")  
 async def health_check():  
     """Health check endpoint."""  
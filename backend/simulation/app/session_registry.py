@@ -0,0 +1,95 @@
+"""
+Central session membership registry.
+
+Replaces the per-car sessions lists and their locks. Membership is kept two ways:
+- session_id -> boolean bitset indexed by car_id, so adding a session to a
+  range of cars is one vectorized operation;
+- car_id -> immutable tuple of session ids, replaced (never mutated) on every
+  change, so the telemetry encoders read a car's sessions without any lock.
+
+Live cars and historic (backfill) cars have separate registries.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class SessionRegistry:
+    def __init__(self, name: str):
+        self.name = name
+        self._members = {}  # session_id -> np.ndarray[bool], True at the car ids in the session
+        self._car_sessions = {}  # car_id -> tuple of session ids
+        self.version = 0  # bumped on every membership change (live snapshot)
+
+    def _bitset(self, session_id: str, size: int) -> np.ndarray:
+        bits = self._members.get(session_id)
+        if bits is None:
+            bits = np.zeros(size, dtype=bool)
+        elif bits.size < size:
+            bits = np.concatenate((bits, np.zeros(size - bits.size, dtype=bool)))
+        self._members[session_id] = bits
+        return bits
+
+    def add(self, session_id: str, car_ids) -> np.ndarray:
+        """Add a session to every car in car_ids, returns the car ids that were not in it yet."""
+        car_ids = np.unique(np.asarray(car_ids, dtype=np.int64))
+        if car_ids.size == 0:
+            return car_ids
+        bits = self._bitset(session_id, int(car_ids[-1]) + 1)
+        new = car_ids[~bits[car_ids]]
+        bits[new] = True
+        if new.size:
+            self.version += 1
+        for car_id in new.tolist():
+            self._car_sessions[car_id] = self._car_sessions.get(car_id, ()) + (session_id,)
+        return new
+
+    def remove_car(self, car_id: int):
+        """Drop a car from every session."""
+        for bits in self._members.values():
+            if car_id < bits.size:
+                bits[car_id] = False
+        self._car_sessions.pop(car_id, None)
+        self.version += 1
+
+    def remove_session(self, session_id: str):
+        """Drop a session from every car."""
+        bits = self._members.pop(session_id, None)
+        if bits is None:
+            return
+        self.version += 1
+        for car_id in np.flatnonzero(bits).tolist():
+            remaining = tuple(s for s in self._car_sessions.get(car_id, ()) if s != session_id)
+            if remaining:
+                self._car_sessions[car_id] = remaining
+            else:
+                self._car_sessions.pop(car_id, None)
+
+    def sessions_of(self, car_id: int) -> tuple:
+        """Sessions of one car, a tuple that is never modified afterwards."""
+        return self._car_sessions.get(car_id, ())
+
+    def sessions_for(self, car_ids) -> list:
+        """Sessions tuple of every car in car_ids, in order."""
+        get = self._car_sessions.get
+        return [get(car_id, ()) for car_id in car_ids]
+
+    def cars_of(self, session_id: str) -> np.ndarray:
+        """Car ids in a session."""
+        bits = self._members.get(session_id)
+        return np.flatnonzero(bits) if bits is not None else np.array([], dtype=np.int64)
+
+    def sessions(self) -> list:
+        return list(self._members)
+
+    def clear(self):
+        self._members.clear()
+        self._car_sessions.clear()
+        self.version += 1
+        logger.info(f"Cleared {self.name} session registry")
+
+
+session_registry = SessionRegistry("live")
+historic_session_registry = SessionRegistry("historic")
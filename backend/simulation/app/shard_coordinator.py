@@ -0,0 +1,273 @@
+"""
+Sharded simulation coordinator.
+
+With SIMULATION_SHARDS > 1 the cars are not simulated in the API process.
+The car-id range of a run is split into contiguous blocks, one per worker
+process (shard_worker.py), so the simulation uses as many cores as there are
+shards and the control endpoints never wait behind car updates. The
+coordinator lives in the FastAPI app: it fans start, pause, resume, stop and
+session calls out to the shards that own the cars, and aggregates their
+status. History backfills still run in the API process.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+
+from global_context import simulation_shards, telemetry_spill_dir, shared_state_name, checkpoint_path, \
+    shard_clock_window_seconds
+
+logger = logging.getLogger(__name__)
+
+shard_start_timeout = 120.0  # seconds a worker gets to load geofences and routes
+shard_call_timeout = 60.0
+shard_join_timeout = 15.0
+clock_sync_interval = 0.1  # wall seconds between fast-mode horizon updates
+
+# Summed over the shards by status()
+STATUS_TOTALS = ("cars", "car_tasks_active", "queue_depth", "documents_queued", "documents_sent",
+                 "documents_dropped", "documents_failed", "documents_spilled")
+
+
+def merge_clocks(clocks: list):
+    """One clock of the shards' simulation_clock.info(): the slowest shard's now, and how far the fastest is ahead."""
+    if not clocks:
+        return None
+    nows = [datetime.fromisoformat(clock["now"]) for clock in clocks]
+    slowest = clocks[nows.index(min(nows))]
+    return {**slowest, "skew_seconds": round((max(nows) - min(nows)).total_seconds(), 3)}
+
+
+class ShardError(RuntimeError):
+    """A shard worker failed a command, did not answer in time or is gone."""
+
+
+def split_car_ids(num_cars: int, num_shards: int) -> list:
+    """(first_car_id, num_cars) of every shard, contiguous blocks of car ids 1..num_cars."""
+    bounds = np.linspace(0, num_cars, num_shards + 1).round().astype(int)
+    return [(int(bounds[i]) + 1, int(bounds[i + 1] - bounds[i])) for i in range(num_shards)]
+
+
+@contextmanager
+def _environment(overrides: dict):
+    """Environment a spawned worker starts with (its settings are read from it at import)."""
+    saved = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _receive(conn, timeout: float):
+    if not conn.poll(timeout):
+        raise TimeoutError
+    return conn.recv()
+
+
+class Shard:
+    def __init__(self, index: int, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.lock = asyncio.Lock()  # one command in flight per pipe
+        self.seq = 0
+        self.first_car_id = 0
+        self.num_cars = 0
+        self.restored = None  # car range and state the worker restored from its checkpoint
+
+    def owns(self, car_ids: np.ndarray) -> np.ndarray:
+        return (car_ids >= self.first_car_id) & (car_ids < self.first_car_id + self.num_cars)
+
+
+class ShardCoordinator:
+    def __init__(self, num_shards: int):
+        self.num_shards = num_shards
+        self.shards = []
+        self._clock_task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.num_shards > 1
+
+    async def start(self):
+        """Spawn the workers and wait until every one of them is ready."""
+        from shard_worker import run_shard, READY_SEQ
+
+        context = multiprocessing.get_context("spawn")
+        checkpoint_root, checkpoint_ext = os.path.splitext(checkpoint_path)
+        for index in range(self.num_shards):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=run_shard, args=(index, child_conn), name=f"simulation-shard-{index}", daemon=True)
+            with _environment({
+                "SIMULATION_SHARDS": "0",  # a worker runs its cars itself
+                "TELEMETRY_SPILL_DIR": os.path.join(telemetry_spill_dir, f"shard_{index}") if telemetry_spill_dir else "",
+                "SHARED_STATE_NAME": f"{shared_state_name}_{index}" if shared_state_name else "",
+                "CHECKPOINT_PATH": f"{checkpoint_root}_shard_{index}{checkpoint_ext}" if checkpoint_path else "",
+            }):
+                process.start()
+            child_conn.close()
+            self.shards.append(Shard(index, process, parent_conn))
+
+        for shard in self.shards:
+            try:
+                seq, ok, result = await asyncio.to_thread(_receive, shard.conn, shard_start_timeout)
+            except (TimeoutError, EOFError):
+                raise ShardError(f"Shard {shard.index} did not start")
+            shard.restored = result.get("restored")
+            if shard.restored:
+                shard.first_car_id, shard.num_cars = shard.restored["first_car_id"], shard.restored["num_cars"]
+            logger.info(f"Shard {shard.index} started (pid {result['pid']})")
+        logger.info(f"Shard coordinator started with {self.num_shards} workers")
+
+    async def _call(self, shard: Shard, command: str, **kwargs):
+        async with shard.lock:
+            if not shard.process.is_alive():
+                raise ShardError(f"Shard {shard.index} is not running (exit code {shard.process.exitcode})")
+            shard.seq += 1
+            shard.conn.send((shard.seq, command, kwargs))
+            while True:
+                try:
+                    seq, ok, result = await asyncio.to_thread(_receive, shard.conn, shard_call_timeout)
+                except TimeoutError:
+                    raise ShardError(f"Shard {shard.index} did not answer {command} within {shard_call_timeout}s")
+                except EOFError:
+                    raise ShardError(f"Shard {shard.index} exited during {command}")
+                if seq == shard.seq:
+                    break
+                # Late answer to a call that timed out before, drop it
+            if not ok:
+                raise ShardError(f"Shard {shard.index} {command} failed: {result}")
+            return result
+
+    async def _broadcast(self, command: str, shards=None, **kwargs) -> list:
+        shards = self.shards if shards is None else shards
+        return await asyncio.gather(*(self._call(shard, command, **kwargs) for shard in shards))
+
+    async def start_simulation(self, num_cars: int, engine: str, seed: int, clock: dict) -> int:
+        """
+        Split the cars across the shards and start them (paused, like a single-process start). Returns the car count.
+        clock is the reset of the simulation clock (mode, speed, start), the same start on every shard.
+        """
+        for shard, (first_car_id, count) in zip(self.shards, split_car_ids(num_cars, self.num_shards)):
+            shard.first_car_id, shard.num_cars = first_car_id, count
+        running = [shard for shard in self.shards if shard.num_cars]
+        replies = await asyncio.gather(*(
+            self._call(shard, "start", first_car_id=shard.first_car_id, num_cars=shard.num_cars,
+                       engine=engine, seed=seed, clock=clock, shard_index=shard.index)
+            for shard in running
+        ))
+        cars = sum(reply["cars"] for reply in replies)
+        logger.info(f"Started {cars} cars on {len(running)} shards")
+        if clock["mode"] == "fast":
+            self.start_clock_sync()
+        return cars
+
+    async def _sync_clocks(self):
+        """Fast mode: hold every shard's clock to SHARD_CLOCK_WINDOW_SECONDS past the slowest one."""
+        shards = [shard for shard in self.shards if shard.num_cars]
+        horizon = None  # first round only reads the clocks
+        while shards:
+            try:
+                replies = await self._broadcast("clock_sync", shards=shards, horizon=horizon)
+                horizon = min(reply["timestamp"] for reply in replies) + shard_clock_window_seconds
+                await asyncio.sleep(clock_sync_interval)
+            except asyncio.CancelledError:
+                break
+            except ShardError as e:
+                logger.warning(f"Shard clock sync failed: {e}")
+                await asyncio.sleep(1)
+
+    def start_clock_sync(self):
+        if self._clock_task is None or self._clock_task.done():
+            self._clock_task = asyncio.create_task(self._sync_clocks())
+
+    async def stop_clock_sync(self):
+        if self._clock_task is not None:
+            self._clock_task.cancel()
+            try:
+                await self._clock_task
+            except asyncio.CancelledError:
+                pass
+            self._clock_task = None
+
+    async def set_state(self, state: str):
+        """"running", "paused" or "stopped" (stop also cancels the shard's cars)."""
+        if state == "stopped":
+            await self.stop_clock_sync()
+        await self._broadcast("set_state", state=state)
+        if state == "stopped":
+            for shard in self.shards:
+                shard.first_car_id, shard.num_cars = 0, 0
+
+    async def add_sessions(self, session_id: str, car_ids) -> list:
+        """Add a session to the cars of every shard that owns some of car_ids, returns the car ids found."""
+        car_ids = np.asarray(car_ids, dtype=np.int64)
+        calls = []
+        for shard in self.shards:
+            owned = car_ids[shard.owns(car_ids)]
+            if owned.size:
+                calls.append(self._call(shard, "add_sessions", session_id=session_id, car_ids=owned.tolist()))
+        replies = await asyncio.gather(*calls)
+        return [car_id for reply in replies for car_id in reply["car_ids"]]
+
+    async def clear_sessions(self, car_id: int) -> bool:
+        """Clear the sessions of one car, False when no shard runs it."""
+        for shard in self.shards:
+            if shard.owns(np.array([car_id]))[0]:
+                return (await self._call(shard, "clear_sessions", car_id=car_id))["found"]
+        return False
+
+    async def status(self) -> dict:
+        """Status of every shard and the totals over all of them."""
+        async def shard_status(shard):
+            status = {"shard": shard.index, "pid": shard.process.pid, "alive": shard.process.is_alive(),
+                      "first_car_id": shard.first_car_id, "num_cars": shard.num_cars}
+            try:
+                status.update(await self._call(shard, "status"))
+            except ShardError as e:
+                status["error"] = str(e)
+            return status
+
+        shards = await asyncio.gather(*(shard_status(shard) for shard in self.shards))
+        totals = {name: sum(shard.get(name, 0) for shard in shards) for name in STATUS_TOTALS}
+        return {**totals, "clock": merge_clocks([shard["clock"] for shard in shards if shard.get("num_cars") and "clock" in shard]),
+                "shards_alive": sum(shard["alive"] for shard in shards), "shards": shards}
+
+    async def kpis(self) -> list:
+        """Raw fleet KPIs (fleet_kpis.FleetKpis.raw) of every shard, to be merged."""
+        return await self._broadcast("kpis")
+
+    async def snapshot(self, session_id: str, since: int = None) -> list:
+        """fleet_snapshot view of the session's cars on every shard, all full when one of them has to be."""
+        views = await self._broadcast("snapshot", session_id=session_id, since=since)
+        if since is not None and any(view["full"] for view in views) and not all(view["full"] for view in views):
+            views = await self._broadcast("snapshot", session_id=session_id)
+        return views
+
+    async def shutdown(self):
+        """Stop every worker (they flush their telemetry on the way out)."""
+        await self.stop_clock_sync()
+        for shard in self.shards:
+            try:
+                await self._call(shard, "shutdown")
+            except ShardError as e:
+                logger.warning(f"{e}, terminating it")
+        for shard in self.shards:
+            await asyncio.to_thread(shard.process.join, shard_join_timeout)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.conn.close()
+        self.shards = []
+        logger.info("Shard coordinator stopped")
+
+
+shard_coordinator = ShardCoordinator(simulation_shards)
@@ -0,0 +1,141 @@
+"""
+Shard worker process.
+
+A shard runs the simulation for one contiguous car-id range in its own
+process: its own event loop, HTTP session, telemetry pipeline, sink and
+spill log, set up and torn down by main's startup and shutdown events. It
+takes commands from the coordinator (shard_coordinator.py) over a pipe, one
+at a time, and answers every one of them:
+
+    request:  (seq, command, kwargs)
+    reply:    (seq, ok, result or error message)
+
+The simulation state is kept in memory only; the coordinator owns the
+persisted state file. A worker checkpoints its own cars
+(CHECKPOINT_PATH with a _shard_N suffix) and restores them when it starts.
+"""
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+READY_SEQ = 0  # seq of the message a worker sends once it is started
+
+
+async def _start(first_car_id: int, num_cars: int, engine: str, seed: int, clock: dict, shard_index: int):
+    from routes.simulation import spawn_simulation, stop_simulation_internal
+    from simulation_clock import simulation_clock
+    from simulation_random import simulation_random
+    from state_manager import set_state
+
+    await stop_simulation_internal()
+    simulation_random.reset(seed)  # same seed as the other shards, streams are keyed by car id
+    simulation_clock.reset(clock["mode"], clock["speed"], clock["start"])  # same start as the other shards
+    cars = await spawn_simulation(num_cars, engine, first_car_id, engine_key=(shard_index,))
+    set_state("paused")
+    return {"cars": len(cars)}
+
+
+async def _set_state(state: str):
+    from routes.simulation import stop_simulation_internal
+    from state_manager import set_state
+
+    if state == "stopped":
+        await stop_simulation_internal()
+    else:
+        set_state(state)
+    return {"state": state}
+
+
+async def _add_sessions(session_id: str, car_ids: list):
+    import numpy as np
+    from car_manager import get_car_ids
+    from session_registry import session_registry
+
+    requested = np.asarray(car_ids, dtype=np.int64)
+    found = requested[np.isin(requested, await get_car_ids())]
+    session_registry.add(session_id, found)
+    return {"car_ids": found.tolist()}
+
+
+async def _clear_sessions(car_id: int):
+    from car_manager import get_car_by_id
+
+    car = await get_car_by_id(car_id)
+    if car is None:
+        return {"found": False}
+    await car.clear_sessions()
+    return {"found": True}
+
+
+async def _status():
+    from routes.simulation import local_status
+    return await local_status()
+
+
+async def _clock_sync(horizon=None):
+    from simulation_clock import simulation_clock
+
+    simulation_clock.horizon = horizon
+    return {"timestamp": simulation_clock.timestamp()}
+
+
+async def _kpis():
+    from fleet_kpis import fleet_kpis
+
+    return fleet_kpis.raw()
+
+
+async def _snapshot(session_id: str, since=None):
+    from fleet_snapshot import fleet_snapshot
+    from session_registry import session_registry
+
+    fleet_snapshot.publish(session_registry.version)
+    return fleet_snapshot.view(session_registry.cars_of(session_id), since)
+
+
+COMMANDS = {
+    "start": _start,
+    "set_state": _set_state,
+    "add_sessions": _add_sessions,
+    "clear_sessions": _clear_sessions,
+    "status": _status,
+    "kpis": _kpis,
+    "clock_sync": _clock_sync,
+    "snapshot": _snapshot,
+}
+
+
+async def _serve(shard_index: int, conn):
+    import main
+    import state_manager
+
+    state_manager.STATE_FILE = None
+    await main.startup_event()
+    from checkpoint import checkpoint_manager
+
+    conn.send((READY_SEQ, True, {"pid": os.getpid(), "restored": checkpoint_manager.restored}))
+    logger.info(f"Shard {shard_index} ready (pid {os.getpid()})")
+    try:
+        while True:
+            try:
+                seq, command, kwargs = await asyncio.to_thread(conn.recv)
+            except EOFError:
+                logger.warning(f"Shard {shard_index}: coordinator went away, shutting down")
+                break
+            if command == "shutdown":
+                conn.send((seq, True, {}))
+                break
+            try:
+                conn.send((seq, True, await COMMANDS[command](**kwargs)))
+            except Exception as e:
+                logger.error(f"Shard {shard_index}: {command} failed: {e}")
+                conn.send((seq, False, f"{type(e).__name__}: {e}"))
+    finally:
+        await main.shutdown_event()
+
+
+def run_shard(shard_index: int, conn):
+    """Process entry point."""
+    asyncio.run(_serve(shard_index, conn))
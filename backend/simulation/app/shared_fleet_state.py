@@ -0,0 +1,227 @@
+"""
+Shared-memory fleet state.
+
+The process that simulates the cars (the API process, or every shard worker)
+publishes the rows of fleet_snapshot and fleet_kpis into a
+multiprocessing.shared_memory segment every SHARED_STATE_INTERVAL_SECONDS.
+Any local process (other API workers, exporters, notebooks) can then read
+them with FleetStateReader: no IPC round-trip, no pickling.
+
+The segment is a header and a ring of SHARED_STATE_SLOTS slots of
+fixed-layout arrays indexed by car id (0..capacity-1):
+
+    tracked   bool          car is simulated
+    status    int8          fleet_kpis status code
+    flags     bool[4]       is_crashed, is_moving, is_engine_running, is_oil_leak
+    position  float64[2]    longitude, latitude
+    scores    float64[3]    oee, availability, performance
+
+Publish n goes to slot n % slots under a seqlock. The slot sequence is odd
+while the writer copies and 2n once it is done; the header then points to n.
+A reader takes the slot of the latest publish and checks the sequence before
+and after reading. With copy=False it gets views straight into the slot; they
+stay valid (FleetStateReader.valid) until the writer comes round the ring
+again, slots - 1 publishes later.
+
+Sharded, every worker writes its own segment, "<SHARED_STATE_NAME>_<shard>".
+
+The seqlock has no memory barriers: the sequence and the payload are plain
+NumPy stores and loads, each its own C call. That is only ordered on x86-64
+(TSO: stores are seen in program order, loads are not reordered with other
+loads), which is what the service is deployed on. On a weakly ordered CPU
+(ARM) a torn slot can pass the sequence check; the writer logs a warning
+there. A lock can't be used instead: readers attach by name and share no
+synchronization primitive with the writer.
+"""
+import asyncio
+import logging
+import platform
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from global_context import fleet_registry, shared_state_name, shared_state_slots, shared_state_interval_seconds, \
+    shared_state_capacity
+from fleet_kpis import fleet_kpis
+from fleet_snapshot import fleet_snapshot, FLAG_NAMES
+
+logger = logging.getLogger(__name__)
+
+MAGIC = 0x4C46_5354  # "LFST"
+LAYOUT_VERSION = 1
+HEADER_FIELDS = ("magic", "layout_version", "slots", "capacity", "latest")
+HEADER_BYTES = 64
+# Column name, shape of one car's value, dtype
+COLUMNS = (
+    ("tracked", (), np.bool_),
+    ("status", (), np.int8),
+    ("flags", (len(FLAG_NAMES),), np.bool_),
+    ("position", (2,), np.float64),
+    ("scores", (3,), np.float64),
+)
+read_retries = 100
+ORDERED_MACHINES = ("x86_64", "amd64", "i386", "i686", "x86")  # total store order, the seqlock needs no barriers
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _layout(buffer, slots: int, capacity: int):
+    """(header, {name: array} of the slot fields and COLUMNS, size in bytes) over a buffer, None to only get the size."""
+    arrays = {}
+    offset = HEADER_BYTES
+    meta = (("seq", (), np.uint64), ("generation", (), np.uint64), ("timestamp", (), np.float64))
+    for name, shape, dtype in meta + tuple((name, (capacity,) + shape, dtype) for name, shape, dtype in COLUMNS):
+        shape = (slots,) + shape
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if buffer is not None:
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offset)
+        offset = _align(offset + size)
+    header = np.ndarray((len(HEADER_FIELDS),), dtype=np.uint64, buffer=buffer) if buffer is not None else None
+    return header, arrays, offset
+
+
+class SharedFleetState:
+    """Writer side, run by the process that simulates the cars."""
+
+    def __init__(self, name: str = "", slots: int = 4, capacity: int = 0):
+        self.name = name
+        self.slots = max(int(slots), 2)
+        self.capacity = capacity or fleet_registry.total_cars + 1
+        self.shm = None
+        self._task = None
+        self._header = None
+        self._arrays = None
+        self._warned_capacity = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.name)
+
+    def open(self):
+        """Create the segment (or take over a stale one of the same name)."""
+        _, _, size = _layout(None, self.slots, self.capacity)
+        try:
+            self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=self.name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        self._header, self._arrays, _ = _layout(self.shm.buf, self.slots, self.capacity)
+        self._header[:] = (MAGIC, LAYOUT_VERSION, self.slots, self.capacity, 0)
+        if platform.machine().lower() not in ORDERED_MACHINES:
+            logger.warning(f"Shared fleet state '{self.name}': the seqlock assumes x86-64 memory ordering, readers on "
+                           f"{platform.machine()} may see torn publishes")
+        logger.info(f"Shared fleet state '{self.name}': {self.slots} slots of {self.capacity} cars ({size} bytes)")
+
+    def publish(self, timestamp: float = None):
+        """Copy the current car rows into the next slot of the ring."""
+        header, arrays = self._header, self._arrays
+        generation = int(header[4]) + 1
+        slot = generation % self.slots
+        rows = min(self.capacity, len(fleet_snapshot.tracked), len(fleet_kpis.status))
+        if rows < len(fleet_snapshot.tracked) and fleet_snapshot.tracked[rows:].any() and not self._warned_capacity:
+            logger.warning(f"Shared fleet state '{self.name}': car ids from {self.capacity} on are not published")
+            self._warned_capacity = True
+
+        arrays["seq"][slot] = 2 * generation - 1  # odd: being written
+        for name, source in (("tracked", fleet_snapshot.tracked), ("flags", fleet_snapshot.flags),
+                             ("position", fleet_snapshot.position), ("status", fleet_kpis.status),
+                             ("scores", fleet_kpis.scores)):
+            arrays[name][slot, :rows] = source[:rows]
+            arrays[name][slot, rows:] = 0
+        arrays["generation"][slot] = generation
+        arrays["timestamp"][slot] = timestamp if timestamp is not None else 0.0
+        arrays["seq"][slot] = 2 * generation
+        header[4] = generation
+
+    async def run(self, interval: float):
+        """Publish every interval (wall) seconds until cancelled."""
+        from simulation_clock import simulation_clock
+
+        while True:
+            try:
+                self.publish(simulation_clock.timestamp())
+                await asyncio.sleep(interval)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Error publishing shared fleet state: {e}")
+                await asyncio.sleep(interval)
+
+    def start(self, interval: float = None):
+        if not self.enabled:
+            return
+        if self.shm is None:
+            self.open()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run(interval or shared_state_interval_seconds))
+
+    async def stop(self):
+        """Stop publishing and remove the segment."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.shm is not None:
+            self._header = self._arrays = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class FleetStateReader:
+    """Reader side, attaches to a segment written by SharedFleetState."""
+
+    def __init__(self, name: str):
+        self.shm = shared_memory.SharedMemory(name=name)
+        # The writer owns the segment, this process must not remove it when it exits (unless it is the writer)
+        if shared_fleet_state.shm is None or shared_fleet_state.name != name:
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        header = np.ndarray((len(HEADER_FIELDS),), dtype=np.uint64, buffer=self.shm.buf)
+        if int(header[0]) != MAGIC or int(header[1]) != LAYOUT_VERSION:
+            del header
+            self.shm.close()
+            raise ValueError(f"'{name}' is not a shared fleet state segment (layout {LAYOUT_VERSION})")
+        self.slots, self.capacity = int(header[2]), int(header[3])
+        self._header, self._arrays, _ = _layout(self.shm.buf, self.slots, self.capacity)
+
+    def read(self, copy: bool = True) -> dict:
+        """
+        Latest consistent publish.
+        Args:
+            copy (bool): copy the arrays out of the segment; False returns views into it, check valid() after using them.
+        Returns:
+            dict: generation, timestamp (simulated, Unix seconds) and the COLUMNS arrays indexed by car id.
+        """
+        arrays = self._arrays
+        for _ in range(read_retries):
+            generation = int(self._header[4])
+            if generation == 0:
+                return None  # nothing published yet
+            slot = generation % self.slots
+            seq = int(arrays["seq"][slot])
+            if seq != 2 * generation:
+                continue  # the writer has moved on to this slot again
+            state = {name: arrays[name][slot].copy() if copy else arrays[name][slot] for name, _, _ in COLUMNS}
+            state["timestamp"] = float(arrays["timestamp"][slot])
+            state["generation"] = generation
+            if int(arrays["seq"][slot]) == seq:
+                return state
+        raise TimeoutError(f"No consistent shared fleet state after {read_retries} tries")
+
+    def valid(self, state: dict) -> bool:
+        """Whether the views of a read(copy=False) still hold that publish."""
+        return int(self._arrays["seq"][state["generation"] % self.slots]) == 2 * state["generation"]
+
+    def close(self):
+        self._header = self._arrays = None
+        self.shm.close()
+
+
+shared_fleet_state = SharedFleetState(shared_state_name, shared_state_slots, shared_state_capacity)
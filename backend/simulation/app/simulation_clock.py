@@ -0,0 +1,185 @@
+"""
+Simulated time.
+
+Everything in the simulation that waits for or stamps time goes through one
+SimulationClock: the car loops and the fleet engine sleep on it, and live
+and history documents take their timestamps from it. Three modes:
+
+    realtime  simulated time is wall time (the original behaviour)
+    scaled    simulated time runs SIMULATION_SPEED times faster than wall time
+    fast      as fast as possible: nothing really sleeps, the clock jumps to
+              the next wake-up once every simulation task is asleep on it
+              (discrete-event)
+
+In fast mode the tasks that move the simulation (car loops, the fleet
+engine) are registered with track(). The clock only jumps when every one
+of them waits in sleep(): a task still busy, or waiting on I/O such as a
+sink write or a full telemetry queue, holds simulated time until it sleeps
+again. Other callers of sleep() (a benchmark waiting for its duration) are
+woken in order but never hold the clock.
+
+Fast-mode shard workers each run their own clock; the coordinator holds
+them to a common horizon (SHARD_CLOCK_WINDOW_SECONDS past the slowest one),
+so their document timestamps stay within that window of each other.
+
+A run starts at SIMULATION_CLOCK_START (ISO 8601, e.g. a few months back to
+generate history up to today) or at the current wall time. With a blocking
+telemetry queue, fast mode does not move the clock while the queue is full,
+so the cars stay in step with what the sink can take.
+
+Admin timers (inactivity timeout, telemetry flush interval, retries) stay on
+wall time.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timezone, timedelta
+from typing import Callable, Optional
+
+from global_context import simulation_clock_mode, simulation_speed, simulation_clock_start
+
+logger = logging.getLogger(__name__)
+
+CLOCK_MODES = ("realtime", "scaled", "fast")
+
+backpressure_poll_seconds = 0.01
+
+
+def parse_clock_start(value) -> Optional[datetime]:
+    """UTC datetime from an ISO 8601 string (naive means UTC), None for empty."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class SimulationClock:
+    def __init__(self, mode: str = None, speed: float = None, start=None):
+        self.backpressure: Optional[Callable[[], bool]] = None  # fast mode holds the clock while this is true
+        self._driver = None
+        self._participants = set()  # tasks the fast clock waits for (track)
+        self._asleep = 0  # participants waiting in sleep()
+        self.reset(mode, speed, start)
+
+    def reset(self, mode: str = None, speed: float = None, start=None):
+        """Start a new run. Mode and speed default to the settings, start to SIMULATION_CLOCK_START or now."""
+        mode = mode or simulation_clock_mode
+        speed = float(speed if speed is not None else simulation_speed)
+        start = start or simulation_clock_start
+        if mode not in CLOCK_MODES:
+            raise ValueError(f"Unknown clock mode '{mode}', expected one of {CLOCK_MODES}")
+        if speed <= 0:
+            raise ValueError(f"Clock speed must be positive, got {speed}")
+        self.mode = mode
+        self.speed = speed if mode == "scaled" else 1.0
+        self.start = parse_clock_start(start) or datetime.now(timezone.utc)
+        self._wall_origin = time.monotonic()
+        self._virtual = 0.0  # simulated seconds since start, fast mode
+        self._sleepers = []  # (wake-up, order, future, participant) heap, fast mode
+        self._order = itertools.count()
+        self._asleep = 0
+        self._ready = asyncio.Event()  # set when every participant is asleep and there is a sleeper to wake
+        self.horizon = None  # fast mode: Unix timestamp the clock may not pass (set by the shard coordinator)
+        if self._driver is not None and not self._driver.done():
+            self._driver.cancel()
+        self._driver = None
+        logger.info(f"Simulation clock: {self.mode}" + (f" x{self.speed:g}" if self.mode == "scaled" else "")
+                    + f", starting at {self.start.isoformat()}")
+
+    def elapsed(self) -> float:
+        """Simulated seconds since the start of the run."""
+        if self.mode == "fast":
+            return self._virtual
+        return (time.monotonic() - self._wall_origin) * self.speed
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self.elapsed())
+
+    def timestamp(self) -> float:
+        """now() as a Unix timestamp."""
+        return self.start.timestamp() + self.elapsed()
+
+    def wall_seconds(self, seconds: float) -> float:
+        """Wall seconds a sleep of that many simulated seconds takes (0 in fast mode)."""
+        return 0.0 if self.mode == "fast" else seconds / self.speed
+
+    def track(self, task: asyncio.Task) -> asyncio.Task:
+        """Make the fast clock wait for this task: it only jumps while the task sleeps on it (or once it is done)."""
+        self._participants.add(task)
+        task.add_done_callback(self._untrack)
+        return task
+
+    def _untrack(self, task: asyncio.Task):
+        self._participants.discard(task)
+        self._check_ready()
+
+    def _check_ready(self):
+        if self._sleepers and self._asleep >= len(self._participants):
+            self._ready.set()
+
+    async def sleep(self, seconds: float, spent: float = 0.0):
+        """
+        Sleep for simulated seconds.
+        Args:
+            seconds (float): simulated seconds.
+            spent (float): wall seconds already used since the last sleep (a tick's own work), taken off a real sleep.
+        """
+        if self.mode != "fast":
+            await asyncio.sleep(max(seconds / self.speed - spent, 0))
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        participant = asyncio.current_task() in self._participants
+        heapq.heappush(self._sleepers, (self._virtual + max(seconds, 0), next(self._order), future, participant))
+        if participant:
+            self._asleep += 1
+        if self._driver is None or self._driver.done():
+            self._driver = loop.create_task(self._drive())
+        self._check_ready()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if participant and future.cancelled():  # not woken by the driver, which counts the ones it wakes
+                self._asleep -= 1
+                self._check_ready()
+            raise
+
+    async def _drive(self):
+        """Fast mode: wake the next sleepers each time every participant is asleep."""
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                if not self._sleepers or self._asleep < len(self._participants):
+                    continue
+                if self.backpressure is not None and self.backpressure():
+                    await asyncio.sleep(backpressure_poll_seconds)
+                    self._check_ready()
+                    continue
+                limit = self.horizon - self.start.timestamp() if self.horizon is not None else None
+                if limit is not None and self._sleepers[0][0] > limit:
+                    # Wait for the other shards, up to the horizon so the slowest shard always moves it on
+                    self._virtual = max(self._virtual, limit)
+                    await asyncio.sleep(backpressure_poll_seconds)
+                    self._check_ready()
+                    continue
+                self._virtual = max(self._virtual, self._sleepers[0][0])
+                while self._sleepers and self._sleepers[0][0] <= self._virtual:
+                    _, _, future, participant = heapq.heappop(self._sleepers)
+                    if future.done():  # cancelled sleepers stay in the heap until their turn
+                        continue
+                    future.set_result(None)
+                    if participant:
+                        self._asleep -= 1
+                self._check_ready()  # only observers were woken, or nobody holds the clock
+        except asyncio.CancelledError:
+            pass
+
+    def info(self) -> dict:
+        return {"mode": self.mode, "speed": self.speed, "start": self.start.isoformat(), "now": self.now().isoformat()}
+
+
+simulation_clock = SimulationClock()
@@ -0,0 +1,158 @@
+"""
+Logging for the simulation service.
+
+Records are formatted and written off the event loop: the root logger only
+has a QueueHandler, and a QueueListener thread runs the real handlers
+(stdout and LOG_FILE). Callers only pay for building the record.
+
+Hot-path events (per car or per batch) go through log_event() instead of
+free-text logger calls. Every event has a dotted name ("car.crashed",
+"telemetry.batch_sent") and key=value fields, and is logged on the
+"events.<name>" logger, so events can be turned down per name or per group
+without code edits:
+
+    LOG_EVENT_LEVELS=car=WARNING,telemetry.batch_sent=OFF
+
+Each event name is sampled by a token bucket (LOG_EVENT_RATE records per
+second, LOG_EVENT_BURST at once). The next record that gets through carries
+how many were suppressed in between. LOG_FORMAT=json writes one JSON object
+per line with the event fields as keys.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from global_context import log_level, log_file, log_format, log_event_levels, log_event_rate, log_event_burst
+
+EVENT_LOGGER = "events"
+OFF = logging.CRITICAL + 10
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+_listener = None
+_event_loggers = {}
+
+
+class EventSampler(logging.Filter):
+    """Token bucket of one event name: rate records per second, burst at once."""
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._suppressed = 0
+        self._lock = threading.Lock()  # shared by the loop and executor threads
+
+    def filter(self, record) -> bool:
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens < 1:
+                self._suppressed += 1
+                return False
+            self._tokens -= 1
+            record.suppressed, self._suppressed = self._suppressed, 0
+        return True
+
+
+class EventTextFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} (+{suppressed} suppressed)" if suppressed else text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        event = getattr(record, "event", None)
+        if event is not None:
+            entry["event"] = event
+            entry.update(record.fields)
+            if getattr(record, "suppressed", 0):
+                entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def parse_levels(value: str) -> dict:
+    """{"car": WARNING, ...} from "car=WARNING,telemetry.batch_sent=OFF"."""
+    levels = {}
+    for part in value.split(","):
+        if "=" not in part:
+            continue
+        name, level = (item.strip() for item in part.split("=", 1))
+        levels[name] = OFF if level.upper() == "OFF" else logging.getLevelName(level.upper())
+    return levels
+
+
+def setup_logging():
+    """Route all records through a queue to a listener thread. Safe to call more than once."""
+    global _listener
+    if _listener is not None:
+        return
+    formatter = JsonFormatter() if log_format == "json" else EventTextFormatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(log_level)
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    for name, level in parse_levels(log_event_levels).items():
+        logging.getLogger(f"{EVENT_LOGGER}.{name}").setLevel(level)
+
+
+def stop_logging():
+    """Write out the queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def event_logger(event: str) -> logging.Logger:
+    logger = _event_loggers.get(event)
+    if logger is None:
+        logger = logging.getLogger(f"{EVENT_LOGGER}.{event}")
+        logger.addFilter(EventSampler(log_event_rate, log_event_burst))
+        _event_loggers[event] = logger
+    return logger
+
+
+def log_event(event: str, level: int = logging.INFO, **fields):
+    """
+    Log a structured, sampled hot-path event.
+    Args:
+        event (str): dotted event name, e.g. "car.crashed".
+        level (int): logging level of the event.
+        **fields: key=value data of the event.
+    """
+    logger = event_logger(event)
+    if not logger.isEnabledFor(level):
+        return
+    message = " ".join([event] + [f"{key}={value}" for key, value in fields.items()])
+    logger.log(level, message, extra={"event": event, "fields": fields})
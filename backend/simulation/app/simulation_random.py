@@ -0,0 +1,88 @@
+"""
+Seeded random number generation for the simulation.
+
+Every run has one seed (SIMULATION_SEED, or fresh entropy that is logged so
+the run can be replayed). Independent NumPy Generator streams are derived
+from it by a fixed key instead of call order: one for the initial fleet
+state, one for the vectorized engine, one per car for the tasks engine and
+one per (history job, car) for backfills. The same seed therefore gives the
+same run, even though asyncio interleaves the cars differently every time.
+
+Per-car noise is drawn in blocks (CarNoise) instead of one random call per
+field per step.
+"""
+import logging
+
+import numpy as np
+
+from global_context import simulation_seed
+
+logger = logging.getLogger(__name__)
+
+# Stream keys, part of the seed derivation, don't renumber
+STREAM_FLEET_INIT = 0
+STREAM_FLEET_ENGINE = 1
+STREAM_CAR = 2
+STREAM_HISTORIC_CAR_INIT = 3
+STREAM_HISTORY = 4
+
+noise_block_size = 1024  # per-car draws per refill
+
+
+class SimulationRandom:
+    def __init__(self, seed=None):
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        """Start a new run. Without a seed fresh entropy is used (and logged, to replay the run)."""
+        self.seed = int(seed) if seed is not None else int(np.random.SeedSequence().entropy)
+        logger.info(f"Simulation seed: {self.seed}")
+
+    def seed_sequence(self, *key) -> np.random.SeedSequence:
+        """Seed of the stream identified by key, e.g. (STREAM_CAR, car_id). Picklable, for worker processes."""
+        return np.random.SeedSequence(self.seed, spawn_key=tuple(int(k) for k in key))
+
+    def generator(self, *key) -> np.random.Generator:
+        return np.random.default_rng(self.seed_sequence(*key))
+
+
+class CarNoise:
+    """Block-drawn noise of one car for the per-car update loop."""
+
+    def __init__(self, rng: np.random.Generator, block_size: int = noise_block_size):
+        self.rng = rng
+        self.block_size = block_size
+        self._pos = block_size  # refill on first use
+        self._block_state = None  # bit generator state the current block was drawn from
+
+    def _refill(self):
+        self._block_state = self.rng.bit_generator.state
+        self._speed = self.rng.uniform(-4.35, 4.25, self.block_size).tolist()
+        self._crash = self.rng.random(self.block_size).tolist()
+        self._availability = self.rng.uniform(-0.02, 0.02, self.block_size).tolist()
+        self._pos = 0
+
+    def step(self):
+        """(speed noise km/h, crash draw in [0, 1), availability delta) for one step."""
+        if self._pos >= self.block_size:
+            self._refill()
+        i = self._pos
+        self._pos += 1
+        return self._speed[i], self._crash[i], self._availability[i]
+
+    def state(self):
+        """(bit generator state, position in the block) to carry the stream on with restore() (checkpoints)."""
+        if self._pos >= self.block_size:  # the next step draws a new block from where the generator is
+            return self.rng.bit_generator.state, self.block_size
+        return self._block_state, self._pos
+
+    def restore(self, bit_generator_state: dict, pos: int):
+        """Continue the stream where state() was taken: redraw that block and skip what was used of it."""
+        self.rng.bit_generator.state = bit_generator_state
+        self._pos = self.block_size
+        if pos < self.block_size:
+            self._refill()
+            self._pos = pos
+
+
+simulation_random = SimulationRandom(simulation_seed)
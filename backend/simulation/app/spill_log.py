@@ -0,0 +1,250 @@
+"""
+Durable spill log for telemetry batches that could not be delivered.
+
+Batches that still fail after the pipeline's retries (or that overflow the
+queue with TELEMETRY_OVERFLOW_POLICY=spill) are appended to segment files on
+local disk instead of being kept in memory or dropped. A background replayer
+drains the log in order, rate limited, once the sink accepts writes again,
+and picks up where it left off after a restart.
+
+Segment files are append-only. Each record is framed as
+    kind (1 byte) | payload length (4 bytes) | crc32 (4 bytes) | payload
+where the payload is the batch as concatenated BSON documents and kind tells
+real-time from history batches. A torn record at the end of a segment (crash
+mid-append) is ignored; the read position is kept in a small cursor file.
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import zlib
+from datetime import datetime
+
+import bson
+
+from telemetry_codec import encode_batch
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct("<BII")
+KIND_LIVE = 0
+KIND_HISTORIC = 1
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".log"
+CURSOR_FILE = "cursor.json"
+
+
+def _record_crc(kind: int, payload: bytes) -> int:
+    return zlib.crc32(payload, zlib.crc32(bytes([kind])))
+
+
+def _decode_payload(payload: bytes) -> list:
+    """Back to the documents the pipeline queued (timestamps as ISO strings again)."""
+    documents = bson.decode_all(payload)
+    for document in documents:
+        if isinstance(document.get("timestamp"), datetime):
+            document["timestamp"] = document["timestamp"].isoformat()
+    return documents
+
+
+class SpillLog:
+    def __init__(self, directory: str, segment_max_bytes: int = 64 << 20, max_bytes: int = 1 << 30, fsync: bool = True):
+        """
+        Args:
+            directory (str): where segments and the cursor are kept.
+            segment_max_bytes (int): size after which a new segment is started.
+            max_bytes (int): disk budget for all segments, batches beyond it are dropped (and counted).
+            fsync (bool): fsync every append.
+        """
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self._lock = asyncio.Lock()
+        self._appended = asyncio.Event()
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = self._list_segments()
+        self.cursor_segment, self.cursor_offset = self._load_cursor()
+        # Never append to a segment left by a previous run, it may end in a torn record
+        self._start_new_segment = True
+        self.documents_spilled = 0
+        self.documents_replayed = 0
+        self.documents_dropped = 0
+        self.corrupt_records = 0
+
+    # Layout -------------------------------------------------------------------
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _list_segments(self) -> list:
+        seqs = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                seqs.append(int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]))
+        return sorted(seqs)
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), "r") as f:
+                cursor = json.load(f)
+            return int(cursor["segment"]), int(cursor["offset"])
+        except (FileNotFoundError, KeyError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning(f"Spill log cursor unreadable ({e}), replaying from the first segment")
+            return (self.segments[0] if self.segments else 0), 0
+
+    def _save_cursor(self):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"segment": self.cursor_segment, "offset": self.cursor_offset}, f)
+        os.replace(tmp_path, path)
+
+    def disk_bytes(self) -> int:
+        total = 0
+        for seq in self.segments:
+            try:
+                total += os.path.getsize(self._segment_path(seq))
+            except FileNotFoundError:
+                pass
+        return total
+
+    # Writing ------------------------------------------------------------------
+
+    def _append_record(self, kind: int, payload: bytes) -> bool:
+        record = RECORD_HEADER.pack(kind, len(payload), _record_crc(kind, payload)) + payload
+        if self.disk_bytes() + len(record) > self.max_bytes:
+            return False
+        if self._start_new_segment or not self.segments or \
+                os.path.getsize(self._segment_path(self.segments[-1])) + len(record) > self.segment_max_bytes:
+            self.segments.append(self.segments[-1] + 1 if self.segments else max(self.cursor_segment, 0))
+            self._start_new_segment = False
+        with open(self._segment_path(self.segments[-1]), "ab") as f:
+            f.write(record)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        return True
+
+    async def append(self, batch, historic: bool = False) -> bool:
+        """Spill one batch, False when the disk budget is exhausted and the batch had to be dropped."""
+        if not batch:
+            return True
+        payload = encode_batch(batch)
+        kind = KIND_HISTORIC if historic else KIND_LIVE
+        async with self._lock:
+            written = await asyncio.to_thread(self._append_record, kind, payload)
+        if not written:
+            self.documents_dropped += len(batch)
+            logger.error(f"Spill log full ({self.max_bytes} bytes), dropping batch of {len(batch)} documents")
+            return False
+        self.documents_spilled += len(batch)
+        self._appended.set()
+        logger.warning(f"Spilled batch of {len(batch)} documents to {self.directory}")
+        return True
+
+    # Reading ------------------------------------------------------------------
+
+    def _read_next(self):
+        """
+        Read the record at the cursor: (kind, documents, next_segment, next_offset),
+        or None when there is nothing complete left to read.
+        """
+        while self.segments:
+            if self.cursor_segment not in self.segments:
+                self.cursor_segment, self.cursor_offset = self.segments[0], 0
+            path = self._segment_path(self.cursor_segment)
+            with open(path, "rb") as f:
+                f.seek(self.cursor_offset)
+                header = f.read(RECORD_HEADER.size)
+                if len(header) == RECORD_HEADER.size:
+                    kind, length, crc = RECORD_HEADER.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) == length:
+                        next_offset = self.cursor_offset + RECORD_HEADER.size + length
+                        if _record_crc(kind, payload) == crc:
+                            return kind, _decode_payload(payload), self.cursor_segment, next_offset
+                        self.corrupt_records += 1
+                        logger.error(f"Corrupt record in {path} at offset {self.cursor_offset}, skipping it")
+                        self.cursor_offset = next_offset
+                        continue
+            # End of this segment (or a torn tail): move on if a newer segment exists
+            if self.cursor_segment == self.segments[-1]:
+                return None
+            self._drop_segment(self.cursor_segment)
+            self.cursor_segment, self.cursor_offset = self.segments[0], 0
+            self._save_cursor()
+        return None
+
+    def _drop_segment(self, seq: int):
+        self.segments.remove(seq)
+        try:
+            os.remove(self._segment_path(seq))
+        except FileNotFoundError:
+            pass
+
+    def _commit(self, segment: int, offset: int):
+        self.cursor_segment, self.cursor_offset = segment, offset
+        # A fully replayed last segment is removed too, the next append starts a new one
+        if segment == self.segments[-1] and offset >= os.path.getsize(self._segment_path(segment)):
+            self._drop_segment(segment)
+            self.cursor_segment, self.cursor_offset = segment + 1, 0
+        self._save_cursor()
+
+    def pending(self) -> bool:
+        return bool(self.segments)
+
+    # Replay -------------------------------------------------------------------
+
+    async def replay(self, sink, rate: float = 2000.0, retry_interval: float = 5.0):
+        """
+        Drain the log into the sink in order, forever (run it as a task).
+
+        Args:
+            sink: a telemetry sink (write / write_historic).
+            rate (float): max documents per second replayed, so a recovering sink isn't flooded.
+            retry_interval (float): seconds to wait after a failed write before trying again.
+        """
+        logger.info(f"Spill log replayer started ({self.directory})")
+        while True:
+            try:
+                async with self._lock:
+                    record = await asyncio.to_thread(self._read_next)
+                if record is None:
+                    self._appended.clear()
+                    try:
+                        await asyncio.wait_for(self._appended.wait(), retry_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                kind, documents, segment, offset = record
+                success = await (sink.write_historic(documents) if kind == KIND_HISTORIC else sink.write(documents))
+                if not success:
+                    await asyncio.sleep(retry_interval)  # sink still down, keep the cursor and try again
+                    continue
+                async with self._lock:
+                    await asyncio.to_thread(self._commit, segment, offset)
+                self.documents_replayed += len(documents)
+                logger.info(f"Replayed {len(documents)} spilled documents")
+                if rate > 0:
+                    await asyncio.sleep(len(documents) / rate)
+            except asyncio.CancelledError:
+                logger.info("Spill log replayer cancelled")
+                break
+            except Exception as e:
+                logger.error(f"Error in spill log replayer: {e}")
+                await asyncio.sleep(retry_interval)
+
+    def stats(self) -> dict:
+        return {
+            "spill_segments": len(self.segments),
+            "spill_bytes": self.disk_bytes(),
+            "spill_documents_spilled": self.documents_spilled,
+            "spill_documents_replayed": self.documents_replayed,
+            "spill_documents_dropped": self.documents_dropped,
+            "spill_corrupt_records": self.corrupt_records,
+        }
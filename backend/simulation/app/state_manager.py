@@ -1,27 +1,64 @@
-import os  
-import json  
-import logging  
-  
-STATE_FILE = "simulation_state.json"  
-logger = logging.getLogger(__name__)  
-  
-def get_state():  
-    """Retrieve simulation state from state file."""  
-    if not os.path.exists(STATE_FILE):  
-        set_state("stopped")  # Default state is stopped  
-    with open(STATE_FILE, "r") as f:  
-        return json.load(f).get("state", "stopped")  
-  
-def set_state(state):  
-    """Update simulation state in state file."""  
-    with open(STATE_FILE, "w") as f:  
-        json.dump({"state": state}, f)  
-  
-def is_running():  
-    return get_state() == "running"  
-  
-def is_paused():  
-    return get_state() == "paused"  
-  
-def is_stopped():  
-    return get_state() == "stopped"  
+import os
+import json
+import asyncio
+import logging
+
+STATE_FILE = "simulation_state.json"  # None keeps the state in memory only (shard workers)
+logger = logging.getLogger(__name__)
+
+# State lives in memory, the file is only written on transitions so a restart knows the last state.
+_state = None
+_not_paused = asyncio.Event()  # Set while running or stopped, cleared while paused
+
+def _load_state():
+    """Read the persisted state once, default is stopped."""
+    if STATE_FILE is None or not os.path.exists(STATE_FILE):
+        return "stopped"
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f).get("state", "stopped")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read {STATE_FILE}, defaulting to stopped: {e}")
+        return "stopped"
+
+def get_state():
+    """Retrieve simulation state from memory."""
+    global _state
+    if _state is None:
+        _state = _load_state()
+        _update_events()
+    return _state
+
+def set_state(state):
+    """Update simulation state, persist it and wake waiting cars if it changed."""
+    global _state
+    if state == get_state():
+        return
+    _state = state
+    if STATE_FILE is not None:
+        try:
+            with open(STATE_FILE, "w") as f:
+                json.dump({"state": state}, f)
+        except OSError as e:
+            logger.error(f"Could not persist simulation state to {STATE_FILE}: {e}")
+    _update_events()
+
+def _update_events():
+    if _state == "paused":
+        _not_paused.clear()
+    else:
+        _not_paused.set()
+
+def is_running():
+    return get_state() == "running"
+
+def is_paused():
+    return get_state() == "paused"
+
+def is_stopped():
+    return get_state() == "stopped"
+
+async def wait_while_paused():
+    """Return as soon as the simulation leaves the paused state (resume or stop)."""
+    get_state()
+    await _not_paused.wait()
@@ -0,0 +1,56 @@
+"""
+Wire format for telemetry batches sent to timeSeriesPOST.
+
+"bson" sends the batch as concatenated BSON documents (application/bson),
+which timeSeriesPOST hands to the driver without re-encoding. Timestamps are
+sent as BSON dates and NumPy scalars are converted only when the encoder
+meets one, instead of walking every document up front. "json" is the
+original format, kept for older timeSeriesPOST deployments.
+"""
+from datetime import datetime
+
+import bson
+import numpy as np
+from bson.codec_options import CodecOptions, TypeRegistry
+from bson.raw_bson import RawBSONDocument
+
+BSON_CONTENT_TYPE = "application/bson"
+JSON_CONTENT_TYPE = "application/json"
+WIRE_FORMATS = ("bson", "json")
+
+
+def _numpy_fallback(value):
+    """Called by the BSON encoder only for values it can't encode natively."""
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+_codec_options = CodecOptions(type_registry=TypeRegistry(fallback_encoder=_numpy_fallback), tz_aware=True)
+
+
+def encode_document(document) -> bytes:
+    """Encode one document as BSON, with an ISO timestamp string sent as a BSON date."""
+    if isinstance(document, RawBSONDocument):
+        return document.raw  # already encoded (fleet_encoder)
+    timestamp = document.get("timestamp")
+    if isinstance(timestamp, str):
+        document = {**document, "timestamp": datetime.fromisoformat(timestamp.replace("Z", "+00:00"))}
+    return bson.encode(document, codec_options=_codec_options)
+
+
+def encode_batch(documents) -> bytes:
+    """Encode documents as concatenated BSON (the application/bson batch body)."""
+    return b"".join(encode_document(document) for document in documents)
+
+
+def to_raw_documents(documents) -> list:
+    """Encode documents once as RawBSONDocument, which the driver writes without re-encoding."""
+    return [document if isinstance(document, RawBSONDocument) else RawBSONDocument(encode_document(document))
+            for document in documents]
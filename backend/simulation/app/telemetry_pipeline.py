@@ -0,0 +1,251 @@
+"""
+Telemetry batch pipeline.
+
+Documents go into a bounded asyncio.Queue. A flusher task waits on the queue
+(no polling) and cuts a batch when batch_size documents are available or
+flush_interval seconds have passed since the first one arrived. Up to
+max_in_flight batches are sent concurrently; when all slots are busy the
+flusher waits, which pushes back on producers once the queue is full.
+"""
+import asyncio
+import logging
+import time
+
+from metrics import telemetry_flush_duration, telemetry_flush_size, sink_errors
+from simulation_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest", "spill")
+
+
+class TelemetryPipeline:
+    def __init__(self, send, batch_size: int = 1000, flush_interval: float = 10.0, max_queue: int = 100000,
+                 max_in_flight: int = 4, overflow_policy: str = "block", max_retries: int = 3,
+                 retry_backoff: float = 1.0, spill_log=None):
+        """
+        Args:
+            send: async callable(batch: list) -> bool, True when the batch was written.
+            batch_size (int): documents per batch.
+            flush_interval (float): max seconds a document waits for its batch to fill.
+            max_queue (int): max queued documents, 0 for unbounded.
+            max_in_flight (int): concurrent batch sends.
+            overflow_policy (str): what put does on a full queue, "block", "drop_newest", "drop_oldest"
+                or "spill" (move the oldest batch_size documents to the spill log).
+            max_retries (int): send attempts after the first one before a batch is given up.
+            retry_backoff (float): seconds before the first retry, doubled on every attempt.
+            spill_log (SpillLog): where batches that are given up go instead of being dropped, optional.
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+        if overflow_policy == "spill" and spill_log is None:
+            raise ValueError("The spill overflow policy needs a spill log")
+        self.send = send
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_in_flight = max(1, max_in_flight)
+        self.overflow_policy = overflow_policy
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.spill_log = spill_log
+
+        self.queue = None
+        self._batch_ready = None
+        self._wake_threshold = self.batch_size
+        self._partial = []  # batch of the flusher until a send owns it, sent by stop() if the flusher is cancelled
+        self._in_flight = None
+        self._send_tasks = set()
+        self._flusher = None
+        self._running = False  # between start() and stop(), put only queues while it is set
+
+        self.documents_queued = 0
+        self.documents_sent = 0
+        self.documents_dropped = 0
+        self.documents_failed = 0
+        self.documents_spilled = 0
+        self.batches_sent = 0
+        self.batches_failed = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._total_flush_seconds = 0.0
+        self._flushes = 0
+
+    def start(self):
+        """Create the queue and start the flusher on the running loop."""
+        if self._flusher and not self._flusher.done():
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._batch_ready = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        self._flusher = asyncio.create_task(self._flush_loop())
+        self._running = True
+        logger.info(f"Telemetry pipeline started (batch {self.batch_size}, every {self.flush_interval}s, "
+                    f"{self.max_in_flight} in flight, queue {self.max_queue or 'unbounded'}, {self.overflow_policy})")
+
+    async def put(self, document):
+        """Queue one document, applying the overflow policy when the queue is full."""
+        if not self._running:
+            await self._put_not_running([document])
+            return
+        if self.queue.full():
+            if self.overflow_policy == "drop_newest":
+                self.documents_dropped += 1
+                return
+            if self.overflow_policy == "drop_oldest":
+                self.queue.get_nowait()
+                self.documents_dropped += 1
+            if self.overflow_policy == "spill":
+                oldest = [self.queue.get_nowait() for _ in range(min(self.batch_size, self.queue.qsize()))]
+                await self._spill(oldest)
+        if self.overflow_policy == "block":
+            await self.queue.put(document)
+        else:
+            self.queue.put_nowait(document)
+        self.documents_queued += 1
+        if self.queue.qsize() >= self._wake_threshold:
+            self._batch_ready.set()
+
+    async def put_many(self, documents):
+        if not self._running:
+            await self._put_not_running(list(documents))
+            return
+        for document in documents:
+            await self.put(document)
+
+    async def _put_not_running(self, documents):
+        """Nothing would send documents put before start() or after stop(): spill them, or fail loudly."""
+        if self.spill_log is None:
+            raise RuntimeError(f"Telemetry pipeline is not running, {len(documents)} documents not queued")
+        logger.warning(f"Telemetry pipeline is not running, spilling {len(documents)} documents")
+        await self._spill(documents)
+
+    async def _next_batch(self):
+        """Wait for the first document, then fill the batch until it is full or the deadline passes."""
+        loop = asyncio.get_running_loop()
+        batch = self._partial
+        batch.append(await self.queue.get())
+        deadline = loop.time() + self.flush_interval
+        while True:
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            remaining = deadline - loop.time()
+            if len(batch) >= self.batch_size or remaining <= 0:
+                return batch
+            self._wake_threshold = self.batch_size - len(batch)
+            self._batch_ready.clear()
+            # asyncio.wait, not wait_for: wait_for can swallow a cancel that lands as the event fires
+            waiter = asyncio.ensure_future(self._batch_ready.wait())
+            try:
+                await asyncio.wait((waiter,), timeout=remaining)
+            finally:
+                waiter.cancel()
+                self._wake_threshold = self.batch_size
+
+    async def _flush_loop(self):
+        logger.info("Batch processor started")
+        while True:
+            try:
+                batch = await self._next_batch()
+                await self._in_flight.acquire()  # backpressure: wait for a free send slot
+                task = asyncio.create_task(self._send_batch(batch))
+                self._partial = []
+                self._send_tasks.add(task)
+                task.add_done_callback(self._send_tasks.discard)
+            except asyncio.CancelledError:
+                logger.info("Batch processor cancelled")
+                break
+            except Exception as e:
+                logger.error(f"Error in batch processor: {e}")
+                await asyncio.sleep(1)
+
+    async def _send_batch(self, batch):
+        try:
+            delay = self.retry_backoff
+            for attempt in range(self.max_retries + 1):
+                start = time.perf_counter()
+                success = await self.send(batch)
+                self._record_flush(time.perf_counter() - start, len(batch))
+                if success:
+                    self.batches_sent += 1
+                    self.documents_sent += len(batch)
+                    log_event("telemetry.batch_sent", documents=len(batch), seconds=round(time.perf_counter() - start, 4))
+                    return True
+                sink_errors.labels("live").inc()
+                if attempt < self.max_retries:
+                    log_event("telemetry.batch_retry", logging.WARNING, documents=len(batch), attempt=attempt + 1, retry_in=round(delay, 1))
+                    await asyncio.sleep(delay)
+                    delay *= 2
+            self.batches_failed += 1
+            if self.spill_log is not None:
+                logger.error(f"Failed to send batch of {len(batch)} items after {self.max_retries + 1} attempts, spilling it")
+                await self._spill(batch)
+            else:
+                self.documents_failed += len(batch)
+                logger.error(f"Failed to send batch of {len(batch)} items after {self.max_retries + 1} attempts, dropping it")
+            return False
+        finally:
+            self._in_flight.release()
+
+    async def _spill(self, batch):
+        if await self.spill_log.append(batch):
+            self.documents_spilled += len(batch)
+        else:
+            self.documents_failed += len(batch)
+
+    def _record_flush(self, seconds: float, size: int):
+        telemetry_flush_duration.observe(seconds)
+        telemetry_flush_size.observe(size)
+        self.last_flush_seconds = seconds
+        self.max_flush_seconds = max(self.max_flush_seconds, seconds)
+        self._total_flush_seconds += seconds
+        self._flushes += 1
+
+    async def stop(self, flush: bool = True):
+        """Stop the flusher, send whatever is still queued and wait for in-flight sends."""
+        self._running = False
+        if self._flusher:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if flush and self.queue is not None and (self._partial or not self.queue.empty()):
+            remaining, self._partial = self._partial, []
+            while not self.queue.empty():
+                remaining.append(self.queue.get_nowait())
+            logger.info(f"Flushing {len(remaining)} remaining items from batch queue")
+            for start in range(0, len(remaining), self.batch_size):
+                await self._in_flight.acquire()
+                task = asyncio.create_task(self._send_batch(remaining[start:start + self.batch_size]))
+                self._send_tasks.add(task)
+                task.add_done_callback(self._send_tasks.discard)
+        if self._send_tasks:
+            await asyncio.gather(*self._send_tasks, return_exceptions=True)
+
+    @property
+    def in_flight(self) -> int:
+        """Batches being sent right now."""
+        return len(self._send_tasks)
+
+    def stats(self) -> dict:
+        """Queue depth, throughput counters and flush latency (per send attempt)."""
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "documents_queued": self.documents_queued,
+            "documents_sent": self.documents_sent,
+            "documents_dropped": self.documents_dropped,
+            "documents_failed": self.documents_failed,
+            "documents_spilled": self.documents_spilled,
+            "batches_sent": self.batches_sent,
+            "batches_failed": self.batches_failed,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+            "avg_flush_seconds": round(self._total_flush_seconds / self._flushes, 4) if self._flushes else 0.0,
+            "max_flush_seconds": round(self.max_flush_seconds, 4),
+            **(self.spill_log.stats() if self.spill_log is not None else {}),
+        }
@@ -0,0 +1,182 @@
+"""
+Telemetry sinks: where the simulation writes its telemetry batches.
+
+- http:  POST to timeSeriesPOST (/timeseries-batch and /historic-batch), the default.
+- mongo: bulk insert straight into the vehicleTelemetry collection with motor,
+         skipping the timeSeriesPOST hop (single-host deployments).
+- file:  append the documents as JSON lines to a local file.
+- null:  count and discard (benchmarks).
+- memory: keep the documents in a list (benchmarks, debugging).
+
+Selected with TELEMETRY_SINK; every sink returns True when the batch was written.
+"""
+import asyncio
+import json
+import logging
+
+import numpy as np
+
+from telemetry_codec import to_raw_documents
+
+logger = logging.getLogger(__name__)
+
+SINK_KINDS = ("http", "mongo", "file", "null", "memory")
+DATABASE_NAME = "leafy_fleet"
+TIMESERIES_COLLECTION = "vehicleTelemetry"
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+class TelemetrySink:
+    """Base sink, write() takes real-time batches and write_historic() history backfill batches."""
+    name = "base"
+    raw_bson = False  # whether the sink takes RawBSONDocument batches (see fleet_encoder)
+
+    def __init__(self):
+        self.documents_written = 0
+        self.batches_written = 0
+
+    async def write(self, batch) -> bool:
+        raise NotImplementedError
+
+    async def write_historic(self, batch, session=None) -> bool:
+        return await self.write(batch)
+
+    def _count(self, batch):
+        self.documents_written += len(batch)
+        self.batches_written += 1
+
+    async def close(self):
+        pass
+
+
+class HttpSink(TelemetrySink):
+    """The timeSeriesPOST microservice."""
+    name = "http"
+
+    @property
+    def raw_bson(self):
+        from global_context import telemetry_wire_format
+        return telemetry_wire_format == "bson"
+
+    async def write(self, batch) -> bool:
+        from main import send_batch_to_api
+        success = await send_batch_to_api(batch)
+        if success:
+            self._count(batch)
+        return success
+
+    async def write_historic(self, batch, session=None) -> bool:
+        from main import post_historic_batch
+        from global_context import get_session
+        success = await post_historic_batch(session or get_session(), batch)
+        if success:
+            self._count(batch)
+        return success
+
+
+class MongoSink(TelemetrySink):
+    """Direct async bulk insert into the telemetry time series collection."""
+    name = "mongo"
+    raw_bson = True
+
+    def __init__(self, uri: str, database: str = DATABASE_NAME, collection: str = TIMESERIES_COLLECTION):
+        super().__init__()
+        if not uri:
+            raise ValueError("MONGODB_URI is required for the mongo telemetry sink")
+        from motor.motor_asyncio import AsyncIOMotorClient
+        self.client = AsyncIOMotorClient(uri)
+        self.collection = self.client[database][collection]
+
+    async def write(self, batch) -> bool:
+        from pymongo.errors import BulkWriteError
+        try:
+            # Encoded once as raw BSON (timestamps as dates), the driver sends the bytes as they are.
+            # It gives no inserted_ids back for raw documents, so the batch itself is counted.
+            await self.collection.insert_many(to_raw_documents(batch), ordered=False)
+            self._count(batch)
+            return True
+        except BulkWriteError as e:
+            inserted = e.details.get("nInserted", 0)
+            self.documents_written += inserted
+            logger.error(f"Inserted {inserted} of {len(batch)} documents into MongoDB: {e}")
+            return False
+        except Exception as e:
+            logger.error(f"Error inserting batch of {len(batch)} documents into MongoDB: {e}")
+            return False
+
+    async def close(self):
+        self.client.close()
+
+
+class FileSink(TelemetrySink):
+    """Append every document as one JSON line."""
+    name = "file"
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock = asyncio.Lock()
+
+    def _append(self, lines: str):
+        with open(self.path, "a") as f:
+            f.write(lines)
+
+    async def write(self, batch) -> bool:
+        try:
+            lines = "".join(json.dumps(document, default=_json_default) + "\n" for document in batch)
+            async with self._lock:  # keep concurrent batches from interleaving
+                await asyncio.to_thread(self._append, lines)
+            self._count(batch)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing batch to {self.path}: {e}")
+            return False
+
+
+class NullSink(TelemetrySink):
+    """Discard everything, only count it."""
+    name = "null"
+    raw_bson = True
+
+    async def write(self, batch) -> bool:
+        self._count(batch)
+        return True
+
+
+class MemorySink(TelemetrySink):
+    """Keep every document in memory."""
+    name = "memory"
+    raw_bson = True
+
+    def __init__(self):
+        super().__init__()
+        self.documents = []
+
+    async def write(self, batch) -> bool:
+        self.documents.extend(batch)
+        self._count(batch)
+        return True
+
+
+def create_sink(kind: str) -> TelemetrySink:
+    """Build the sink selected by TELEMETRY_SINK."""
+    from global_context import mongodb_uri, telemetry_sink_path
+
+    if kind == "http":
+        return HttpSink()
+    if kind == "mongo":
+        return MongoSink(mongodb_uri)
+    if kind == "file":
+        return FileSink(telemetry_sink_path)
+    if kind == "null":
+        return NullSink()
+    if kind == "memory":
+        return MemorySink()
+    raise ValueError(f"Unknown telemetry sink '{kind}', expected one of {SINK_KINDS}")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The service modules import each other flat from app/ (as they do when run from there)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
@@ -0,0 +1,87 @@
+import types
+
+import numpy as np
+import pytest
+
+from checkpoint import CAR_COLUMNS, COLUMN_DTYPES, capture, checkpoint_noise, checkpoint_sessions, read_checkpoint, \
+    write_checkpoint
+from fleet_engine import ENGINE_ARRAYS
+from session_registry import session_registry
+from simulation_random import STREAM_CAR, CarNoise, SimulationRandom
+
+
+def make_car(random: SimulationRandom, car_id: int, steps: int):
+    car = types.SimpleNamespace(**{name: COLUMN_DTYPES[name](0) for name in CAR_COLUMNS})
+    car.car_id = car_id
+    car.fuel_level = 10.5 * car_id
+    car.is_moving = car_id % 2 == 0
+    car.current_geozone = f"zone {car_id}"
+    car.noise = None
+    if steps:
+        car.noise = CarNoise(random.generator(STREAM_CAR, car_id), block_size=8)
+        for _ in range(steps):
+            car.noise.step()
+    return car
+
+
+@pytest.fixture
+def sessions():
+    session_registry.clear()
+    yield session_registry
+    session_registry.clear()
+
+
+def test_capture_write_read_restore(tmp_path, sessions):
+    random = SimulationRandom(42)
+    cars = [make_car(random, 1, 3), make_car(random, 2, 8), make_car(random, 3, 0)]
+    sessions.add("s1", [1, 3])
+    path = str(tmp_path / "checkpoints" / "fleet.npz")
+
+    write_checkpoint(path, capture(cars, meta={"seed": random.seed, "engine": "tasks"}))
+    checkpoint = read_checkpoint(path)
+
+    assert checkpoint["meta"]["seed"] == 42 and checkpoint["meta"]["engine"] == "tasks"
+    assert checkpoint["car.car_id"].tolist() == [1, 2, 3]
+    assert checkpoint["car.fuel_level"].tolist() == [10.5, 21.0, 31.5]
+    assert checkpoint["car.is_moving"].tolist() == [False, True, False]
+    assert checkpoint["car.current_geozone"].tolist() == ["zone 1", "zone 2", "zone 3"]
+    assert [(session_id, car_ids.tolist()) for session_id, car_ids in checkpoint_sessions(checkpoint)] == [("s1", [1, 3])]
+
+    # Restored streams carry on exactly where the saved cars' streams are, mid-block and at a block end
+    replay = SimulationRandom(checkpoint["meta"]["seed"])
+    restored = {}
+    for car_id, state, pos in checkpoint_noise(checkpoint):
+        restored[car_id] = CarNoise(replay.generator(STREAM_CAR, car_id), block_size=8)
+        restored[car_id].restore(state, pos)
+    assert sorted(restored) == [1, 2]  # car 3 never stepped, it starts from its seed
+    for car in cars[:2]:
+        assert [restored[car.car_id].step() for _ in range(20)] == [car.noise.step() for _ in range(20)]
+
+
+def test_restored_stream_does_not_repeat_itself(tmp_path, sessions):
+    random = SimulationRandom(7)
+    car = make_car(random, 5, 5)
+    before = CarNoise(random.generator(STREAM_CAR, 5), block_size=8)
+    produced = [before.step() for _ in range(5)]
+    write_checkpoint(str(tmp_path / "c.npz"), capture([car]))
+
+    (car_id, state, pos), = checkpoint_noise(read_checkpoint(str(tmp_path / "c.npz")))
+    noise = CarNoise(random.generator(STREAM_CAR, car_id), block_size=8)
+    noise.restore(state, pos)
+    assert noise.step() not in produced
+
+
+def test_engine_checkpoint_has_no_car_noise(sessions):
+    engine = types.SimpleNamespace(**{name: np.zeros(2, dtype=COLUMN_DTYPES[name]) for name in CAR_COLUMNS},
+                                   current_geozone=np.array(["a", "b"], dtype=object))
+    for name in ENGINE_ARRAYS:
+        setattr(engine, name, np.zeros(2))
+    checkpoint = capture([], engine)
+    assert list(checkpoint_noise(checkpoint)) == []
+
+
+def test_read_checkpoint_rejects_other_formats(tmp_path):
+    path = str(tmp_path / "old.npz")
+    write_checkpoint(path, {"meta": np.array('{"format": 0}')})
+    with pytest.raises(ValueError):
+        read_checkpoint(path)
@@ -0,0 +1,58 @@
+import types
+from datetime import datetime, timezone
+
+import bson
+import numpy as np
+from bson.codec_options import CodecOptions
+
+from fleet_encoder import FleetDocumentEncoder, ROUNDED_FIELDS, FLAG_FIELDS
+from session_registry import session_registry
+
+TIMESTAMP = datetime(2024, 5, 1, 12, 30, 15, 250000, tzinfo=timezone.utc)
+
+
+def fake_engine(size: int = 4):
+    rng = np.random.default_rng(3)
+    engine = types.SimpleNamespace(
+        car_id=np.arange(10, 10 + size, dtype=np.int64),
+        current_route=np.arange(size, dtype=np.int64) + 100,
+        longitude=rng.uniform(-98, -97, size),
+        latitude=rng.uniform(30, 31, size),
+        current_geozone=np.array(["Downtown", "No active geofence", "Downtown", "Ñandú"][:size], dtype=object),
+    )
+    for name, _ in ROUNDED_FIELDS:
+        setattr(engine, name, rng.uniform(0, 1000, size))
+    for k, name in enumerate(FLAG_FIELDS):
+        setattr(engine, name, (np.arange(size) + k) % 2 == 0)
+    return engine
+
+
+def test_bson_documents_decode_to_the_dict_documents():
+    engine = fake_engine()
+    session_registry.add("s1", [10, 11])
+    session_registry.add("s2", [11])
+    try:
+        encoder = FleetDocumentEncoder(engine)
+        idx = np.array([0, 1, 3])
+        raw = encoder.bson_documents(idx, TIMESTAMP)
+        decoded = bson.decode_all(b"".join(document.raw for document in raw),
+                                  CodecOptions(tz_aware=True))
+        expected = encoder.documents(idx, TIMESTAMP.isoformat())
+    finally:
+        session_registry.remove_session("s1")
+        session_registry.remove_session("s2")
+
+    assert len(decoded) == 3
+    for got, want in zip(decoded, expected):
+        assert got.pop("timestamp") == TIMESTAMP.replace(microsecond=250000)
+        want.pop("timestamp")
+        assert got == want
+    assert decoded[0]["metadata"] == {"sessions": ["s1"]}
+    assert decoded[1]["metadata"] == {"sessions": ["s1", "s2"]}
+    assert decoded[2]["current_geozone"] == "Ñandú"
+    assert decoded[2]["coordinates"]["type"] == "Point"
+    assert isinstance(decoded[0]["car_id"], int) and isinstance(decoded[0]["is_moving"], bool)
+
+
+def test_bson_documents_of_no_rows():
+    assert FleetDocumentEncoder(fake_engine()).bson_documents(np.array([], dtype=np.int64), TIMESTAMP) == []
@@ -0,0 +1,43 @@
+import numpy as np
+
+from fleet_kpis import FleetKpis, merge_raw, status_codes, RUNNING, CRASHED, OUT_OF_FUEL, OIL_LEAK
+from fleet_registry import FleetRegistry
+
+
+def kpis_with(car_ids, running, crashed, fuel, oee):
+    kpis = FleetKpis(FleetRegistry([3, 2]))
+    car_ids = np.array(car_ids)
+    kpis.record_many(car_ids, status_codes(np.array(running), np.array(crashed), np.array(fuel, dtype=float)),
+                     np.array(oee, dtype=float), np.ones(len(car_ids)), np.ones(len(car_ids)))
+    kpis.update()
+    return kpis
+
+
+def test_status_codes_take_the_first_failure():
+    codes = status_codes(np.array([True, False, False, False]), np.array([True, True, False, False]),
+                         np.array([0.0, 0.0, 0.0, 5.0]))
+    assert codes.tolist() == [RUNNING, CRASHED, OUT_OF_FUEL, OIL_LEAK]
+
+
+def test_merged_shards_match_one_process():
+    # Cars 1-3 are fleet 1, 4-5 fleet 2
+    whole = kpis_with([1, 2, 3, 4, 5], [True, True, False, True, False], [False, False, True, False, False],
+                      [9, 9, 9, 9, 0], [0.5, 0.7, 0.0, 0.9, 0.0])
+    shard_a = kpis_with([1, 2, 3], [True, True, False], [False, False, True], [9, 9, 9], [0.5, 0.7, 0.0])
+    shard_b = kpis_with([4, 5], [True, False], [False, False], [9, 0], [0.9, 0.0])
+
+    merged = whole.render(merge_raw([shard_a.raw(), None, shard_b.raw()]))
+    assert merged["fleet"] == whole.render(whole.raw())["fleet"]
+    assert merged["fleet"]["cars"] == 5 and merged["fleet"]["out_of_fuel"] == 1
+    assert merged["fleet"]["quality"] == 0.6
+    assert [fleet["cars"] for fleet in merged["fleets"]] == [3, 2]
+    assert whole.quality == 0.6
+
+
+def test_merge_of_no_shards_is_empty():
+    kpis = FleetKpis(FleetRegistry([3, 2]))
+    merged = merge_raw([None, {}])
+    assert merged == merge_raw([])
+    rendered = kpis.render(merged)
+    assert rendered["fleet"]["cars"] == 0 and rendered["fleet"]["quality"] is None
+    assert rendered["ticks"] == 0
@@ -0,0 +1,56 @@
+import numpy as np
+
+from fleet_snapshot import FleetSnapshot, merge_views
+
+
+def record(snapshot, car_id, longitude, is_moving=True):
+    snapshot.record(car_id, longitude, 30.0, False, is_moving, True, False)
+
+
+def test_since_returns_only_the_changed_cars():
+    snapshot = FleetSnapshot(interval=0)
+    for car_id in (1, 2, 3):
+        record(snapshot, car_id, -97.0)
+    snapshot.publish(membership_version=1)
+    first = snapshot.tick
+    full = snapshot.view(np.array([1, 2, 3]))
+    assert full["full"] and [car["car_id"] for car in full["cars"]] == [1, 2, 3]
+
+    record(snapshot, 2, -97.5)
+    snapshot.publish(membership_version=1)
+    assert snapshot.tick > first
+    delta = snapshot.view(np.array([1, 2, 3]), since=first)
+    assert not delta["full"] and delta["removed"] == []
+    assert [(car["car_id"], car["coordinates"]["coordinates"]) for car in delta["cars"]] == [(2, [-97.5, 30.0])]
+    assert snapshot.view(np.array([1, 2, 3]), since=snapshot.tick)["cars"] == []
+
+
+def test_unchanged_rows_keep_the_tick_and_forgotten_cars_are_removed():
+    snapshot = FleetSnapshot(interval=0)
+    record(snapshot, 1, -97.0)
+    snapshot.publish(membership_version=1)
+    tick = snapshot.tick
+    snapshot.publish(membership_version=1)
+    assert snapshot.tick == tick  # nothing changed, same ETag
+
+    snapshot.forget()
+    snapshot.publish(membership_version=1)
+    delta = snapshot.view(np.array([1]), since=tick)
+    assert delta["cars"] == [] and delta["removed"] == [1]
+
+
+def test_membership_change_makes_the_reply_full():
+    snapshot = FleetSnapshot(interval=0)
+    record(snapshot, 1, -97.0)
+    snapshot.publish(membership_version=1)
+    tick = snapshot.tick
+    record(snapshot, 2, -97.0)
+    snapshot.publish(membership_version=2)
+    assert snapshot.view(np.array([1, 2]), since=tick)["full"]
+
+
+def test_merge_views():
+    merged = merge_views([{"tick": 5, "full": True, "cars": [{"car_id": 3}], "removed": [9]},
+                          {"tick": 4, "full": False, "cars": [{"car_id": 1}], "removed": []}])
+    assert merged == {"tick": 4, "full": False, "cars": [{"car_id": 1}, {"car_id": 3}], "removed": [9]}
+    assert merge_views([]) == {"tick": 0, "full": True, "cars": [], "removed": []}
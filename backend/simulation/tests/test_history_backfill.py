@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+from history_backfill import _clipped_walk
+
+
+def step_loop(start, deltas, low, high):
+    walk, value = [], start
+    for delta in deltas.tolist():
+        value = min(high, max(low, value + delta))
+        walk.append(value)
+    return np.array(walk)
+
+
+@pytest.mark.parametrize("start", [1.0, 0.8, 0.6, 1.3, 0.2])
+@pytest.mark.parametrize("scale", [0.02, 0.3])
+def test_clipped_walk_matches_the_step_loop(start, scale):
+    deltas = np.random.default_rng(7).uniform(-scale, scale, 20000)
+    walk = _clipped_walk(start, deltas, 0.6, 1.0)
+    np.testing.assert_allclose(walk, step_loop(start, deltas, 0.6, 1.0), rtol=0, atol=1e-9)
+    assert walk.min() >= 0.6 and walk.max() <= 1.0
+
+
+def test_clipped_walk_of_no_steps():
+    assert _clipped_walk(0.9, np.zeros(0), 0.6, 1.0).shape == (0,)
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone, timedelta
+
+from history_jobs import HistoryJob, HistoryJobManager
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def add_job(manager, job_id, finished_seconds_ago=None, documents_sent=10):
+    job = HistoryJob(job_id=job_id, session_id="s", cars_total=1, documents_sent=documents_sent,
+                     status="running" if finished_seconds_ago is None else "completed")
+    if finished_seconds_ago is not None:
+        job.finished_at = NOW - timedelta(seconds=finished_seconds_ago)
+    manager.jobs[job_id] = job
+
+
+def test_prune_forgets_expired_finished_jobs():
+    manager = HistoryJobManager(job_ttl=60, jobs_kept=10)
+    add_job(manager, "old", finished_seconds_ago=120)
+    add_job(manager, "recent", finished_seconds_ago=30)
+    add_job(manager, "running")
+    manager.prune(NOW)
+    assert sorted(manager.jobs) == ["recent", "running"]
+
+
+def test_prune_keeps_the_newest_finished_jobs():
+    manager = HistoryJobManager(job_ttl=3600, jobs_kept=2)
+    for age in range(5):
+        add_job(manager, f"job{age}", finished_seconds_ago=age)
+    add_job(manager, "running")
+    manager.prune(NOW)
+    assert sorted(manager.jobs) == ["job0", "job1", "running"]
+
+
+def test_documents_sent_counts_pruned_jobs():
+    manager = HistoryJobManager(job_ttl=60, jobs_kept=10)
+    add_job(manager, "old", finished_seconds_ago=120)
+    add_job(manager, "running")
+    manager.prune(NOW)
+    assert manager.documents_sent() == 20
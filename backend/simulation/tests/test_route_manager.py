@@ -0,0 +1,40 @@
+import json
+import os
+
+import route_manager
+from route_manager import convert_routes_to_binary, _file_digest, ROUTE_STORE_DIGEST, ROUTE_STORE_COORDS
+
+
+def write_routes(path, routes: dict):
+    with open(path, "w") as f:
+        json.dump({str(route_id): {"steps": [{"lat": lat, "lng": lng} for lat, lng in steps],
+                                   "distancePerStep": 10.0, "timePerStep": 1.0}
+                   for route_id, steps in routes.items()}, f)
+
+
+def test_store_digest_is_written_with_the_store_and_follows_its_contents(tmp_path):
+    write_routes(tmp_path / "a.json", {1: [(30.0, -97.0), (30.1, -97.1)]})
+    write_routes(tmp_path / "b.json", {1: [(30.0, -97.0), (30.2, -97.2)]})
+    convert_routes_to_binary(str(tmp_path / "a.json"), str(tmp_path / "a"))
+    convert_routes_to_binary(str(tmp_path / "b.json"), str(tmp_path / "b"))
+
+    digest = _file_digest(str(tmp_path / "a"))
+    with open(tmp_path / "a" / ROUTE_STORE_DIGEST) as f:
+        assert f.read() == digest
+    assert digest == route_manager._hash_files([str(tmp_path / "a" / name) for name in ("index.npy", ROUTE_STORE_COORDS)])
+    assert digest != _file_digest(str(tmp_path / "b"))
+
+
+def test_store_without_digest_is_keyed_without_reading_coords(tmp_path, monkeypatch):
+    write_routes(tmp_path / "a.json", {1: [(30.0, -97.0), (30.1, -97.1)]})
+    convert_routes_to_binary(str(tmp_path / "a.json"), str(tmp_path / "a"))
+    os.remove(tmp_path / "a" / ROUTE_STORE_DIGEST)
+
+    hashed = []
+    hash_files = route_manager._hash_files
+    monkeypatch.setattr(route_manager, "_hash_files", lambda paths: hashed.extend(paths) or hash_files(paths))
+    first = _file_digest(str(tmp_path / "a"))
+    assert not any(path.endswith(ROUTE_STORE_COORDS) for path in hashed)
+
+    os.utime(tmp_path / "a" / ROUTE_STORE_COORDS, ns=(0, 0))  # coords.npy rewritten
+    assert _file_digest(str(tmp_path / "a")) != first
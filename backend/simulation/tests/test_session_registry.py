@@ -0,0 +1,53 @@
+import numpy as np
+
+from session_registry import SessionRegistry
+
+
+def test_add_returns_only_new_members():
+    registry = SessionRegistry("test")
+    assert registry.add("a", [3, 1, 3]).tolist() == [1, 3]
+    assert registry.add("a", [1, 5]).tolist() == [5]
+    assert registry.add("a", []).tolist() == []
+    assert registry.cars_of("a").tolist() == [1, 3, 5]
+    assert registry.cars_of("missing").tolist() == []
+
+
+def test_sessions_of_and_sessions_for():
+    registry = SessionRegistry("test")
+    registry.add("a", [1, 2])
+    registry.add("b", [2, 7])
+    assert registry.sessions_of(2) == ("a", "b")
+    assert registry.sessions_for([1, 2, 7, 9]) == [("a",), ("a", "b"), ("b",), ()]
+    assert sorted(registry.sessions()) == ["a", "b"]
+
+
+def test_remove_car_and_remove_session():
+    registry = SessionRegistry("test")
+    registry.add("a", [1, 2])
+    registry.add("b", [2, 7])
+    before = registry.sessions_of(2)
+
+    registry.remove_car(2)
+    assert registry.sessions_of(2) == ()
+    assert registry.cars_of("a").tolist() == [1]
+    assert registry.cars_of("b").tolist() == [7]
+    assert before == ("a", "b")  # tuples handed out are never mutated
+
+    registry.remove_session("b")
+    registry.remove_session("b")
+    assert registry.sessions_of(7) == ()
+    assert registry.sessions() == ["a"]
+
+
+def test_version_bumps_on_membership_changes_only():
+    registry = SessionRegistry("test")
+    registry.add("a", [1])
+    version = registry.version
+    registry.add("a", [1])
+    assert registry.version == version
+    registry.add("a", np.array([4]))
+    assert registry.version > version
+    version = registry.version
+    registry.clear()
+    assert registry.version > version
+    assert registry.sessions() == [] and registry.sessions_of(1) == ()
@@ -0,0 +1,39 @@
+import numpy as np
+
+from shard_coordinator import Shard, merge_clocks, split_car_ids
+
+
+def test_split_car_ids_covers_every_car_once():
+    blocks = split_car_ids(10, 3)
+    assert blocks == [(1, 3), (4, 4), (8, 3)]
+    car_ids = [car_id for first, count in blocks for car_id in range(first, first + count)]
+    assert car_ids == list(range(1, 11))
+
+
+def test_split_car_ids_with_more_shards_than_cars():
+    blocks = split_car_ids(2, 4)
+    assert sum(count for _, count in blocks) == 2
+    assert len(blocks) == 4
+    assert split_car_ids(0, 2) == [(1, 0), (1, 0)]
+
+
+def test_shard_owns_its_block():
+    shard = Shard(0, None, None)
+    shard.first_car_id, shard.num_cars = split_car_ids(10, 3)[1]
+    assert shard.owns(np.arange(1, 11)).nonzero()[0].tolist() == [3, 4, 5, 6]
+
+
+def test_merge_clocks_reports_the_slowest_shard_and_the_skew():
+    clocks = [
+        {"mode": "fast", "now": "2024-01-01T00:00:10", "shard": 0},
+        {"mode": "fast", "now": "2024-01-01T00:00:04.5", "shard": 1},
+        {"mode": "fast", "now": "2024-01-01T00:00:07", "shard": 2},
+    ]
+    merged = merge_clocks(clocks)
+    assert merged["shard"] == 1
+    assert merged["now"] == "2024-01-01T00:00:04.5"
+    assert merged["skew_seconds"] == 5.5
+
+
+def test_merge_clocks_of_no_shards():
+    assert merge_clocks([]) is None
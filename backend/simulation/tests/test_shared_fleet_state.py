@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from fleet_kpis import fleet_kpis
+from fleet_snapshot import fleet_snapshot
+from shared_fleet_state import SharedFleetState, FleetStateReader
+
+CARS = 2000
+
+
+def read_in_another_process(name, ready, stop, results):
+    """Read until stopped: every publish fills all rows with its generation, a torn read mixes two of them."""
+    reader = FleetStateReader(name)
+    ready.set()
+    reads = torn = timeouts = 0
+    while not stop.is_set():
+        try:
+            state = reader.read()
+        except TimeoutError:
+            timeouts += 1
+            continue
+        if state is None:
+            continue
+        reads += 1
+        generation = state["generation"]
+        tracked = state["tracked"]
+        if not (np.all(state["position"][tracked] == generation) and np.all(state["scores"][tracked] == generation)
+                and tracked[1:CARS + 1].all()):
+            torn += 1
+    reader.close()
+    results.put((reads, torn, timeouts))
+
+
+def test_reader_in_another_process_never_sees_a_torn_publish():
+    name = f"test_fleet_state_{os.getpid()}"
+    writer = SharedFleetState(name, slots=2, capacity=CARS + 1)
+    writer.open()
+    car_ids = np.arange(1, CARS + 1)
+    context = multiprocessing.get_context("spawn")
+    ready, stop, results = context.Event(), context.Event(), context.Queue()
+    reader = context.Process(target=read_in_another_process, args=(name, ready, stop, results))
+    reader.start()
+    try:
+        assert ready.wait(30)
+        deadline = time.monotonic() + 1.5
+        publishes = 0
+        while time.monotonic() < deadline:
+            value = np.full(CARS, float(publishes + 1))  # the generation of the next publish
+            fleet_snapshot.record_many(car_ids, value, value, value > 0, value > 0, value > 0, value < 0)
+            fleet_kpis.record_many(car_ids, np.zeros(CARS, dtype=np.int8), value, value, value)
+            writer.publish()
+            publishes += 1
+        stop.set()
+        reads, torn, _ = results.get(timeout=30)
+        reader.join(30)
+    finally:
+        stop.set()
+        if reader.is_alive():
+            reader.terminate()
+        fleet_snapshot.forget()
+        fleet_kpis.forget()
+        writer.shm.close()
+        writer.shm.unlink()
+    assert publishes > 100 and reads > 100
+    assert torn == 0
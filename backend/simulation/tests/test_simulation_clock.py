@@ -0,0 +1,92 @@
+import asyncio
+
+from simulation_clock import SimulationClock
+
+START = "2024-01-01T00:00:00+00:00"
+
+
+def test_fast_clock_jumps_to_the_next_wake_up():
+    async def scenario():
+        clock = SimulationClock("fast", start=START)
+        woken = []
+
+        async def car(name, step):
+            for _ in range(3):
+                await clock.sleep(step)
+                woken.append((clock.elapsed(), name))
+
+        await asyncio.gather(clock.track(asyncio.create_task(car("a", 10))),
+                             clock.track(asyncio.create_task(car("b", 25))))
+        return clock, woken
+
+    clock, woken = asyncio.run(scenario())
+    assert woken == [(10, "a"), (20, "a"), (25, "b"), (30, "a"), (50, "b"), (75, "b")]
+    assert clock.now().isoformat() == "2024-01-01T00:01:15+00:00"
+
+
+def test_fast_clock_waits_for_a_participant_busy_on_io():
+    async def scenario():
+        clock = SimulationClock("fast", start=START)
+        io_done = asyncio.Event()
+        seen = []
+
+        async def writer():
+            await clock.sleep(1)
+            await io_done.wait()  # a slow sink write, many loop passes
+            seen.append(("writer", clock.elapsed()))
+            await clock.sleep(1)
+
+        async def car():
+            for _ in range(5):
+                await clock.sleep(1)
+            seen.append(("car", clock.elapsed()))
+
+        tasks = [clock.track(asyncio.create_task(writer())), clock.track(asyncio.create_task(car()))]
+        for _ in range(50):
+            await asyncio.sleep(0)
+        held = clock.elapsed()
+        io_done.set()
+        await asyncio.gather(*tasks)
+        return held, seen
+
+    held, seen = asyncio.run(scenario())
+    assert held == 1  # nothing moved while the writer waited
+    assert seen == [("writer", 1), ("car", 5)]
+
+
+def test_observers_and_cancelled_participants_do_not_hold_the_clock():
+    async def scenario():
+        clock = SimulationClock("fast", start=START)
+
+        async def forever():
+            while True:
+                await clock.sleep(1)
+
+        async def stuck():
+            await asyncio.Event().wait()
+
+        car = clock.track(asyncio.create_task(forever()))
+        blocked = clock.track(asyncio.create_task(stuck()))
+        await asyncio.sleep(0)
+        blocked.cancel()
+        await clock.sleep(100)  # not a participant, woken in order
+        elapsed = clock.elapsed()
+        car.cancel()
+        await asyncio.gather(car, blocked, return_exceptions=True)
+        return elapsed
+
+    assert asyncio.run(scenario()) == 100
+
+
+def test_horizon_holds_the_clock():
+    async def scenario():
+        clock = SimulationClock("fast", start=START)
+        clock.horizon = clock.start.timestamp() + 30
+        car = clock.track(asyncio.create_task(clock.sleep(60)))
+        await asyncio.sleep(0.05)
+        held = clock.elapsed()
+        clock.horizon = None
+        await car
+        return held, clock.elapsed()
+
+    assert asyncio.run(scenario()) == (30, 60)
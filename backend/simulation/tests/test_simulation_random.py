@@ -0,0 +1,41 @@
+import numpy as np
+
+from simulation_random import STREAM_CAR, STREAM_FLEET_ENGINE, CarNoise, SimulationRandom
+
+
+def car_steps(random: SimulationRandom, car_id: int, count: int) -> list:
+    noise = CarNoise(random.generator(STREAM_CAR, car_id), block_size=16)
+    return [noise.step() for _ in range(count)]
+
+
+def test_same_seed_gives_the_same_streams():
+    first, second = SimulationRandom(1234), SimulationRandom(1234)
+    assert car_steps(first, 7, 40) == car_steps(second, 7, 40)
+    assert np.array_equal(first.generator(STREAM_FLEET_ENGINE).random(8),
+                          second.generator(STREAM_FLEET_ENGINE).random(8))
+
+
+def test_streams_do_not_depend_on_creation_order():
+    random = SimulationRandom(99)
+    a_first = car_steps(random, 1, 10)
+    b_second = car_steps(random, 2, 10)
+    assert car_steps(random, 2, 10) == b_second
+    assert car_steps(random, 1, 10) == a_first
+    assert a_first != b_second
+
+
+def test_other_seed_gives_other_streams():
+    assert car_steps(SimulationRandom(1), 7, 10) != car_steps(SimulationRandom(2), 7, 10)
+
+
+def test_reset_without_seed_records_the_fresh_seed():
+    random = SimulationRandom()
+    replay = SimulationRandom(random.seed)
+    assert car_steps(random, 3, 5) == car_steps(replay, 3, 5)
+
+
+def test_car_noise_ranges():
+    for speed, crash, availability in car_steps(SimulationRandom(5), 0, 200):
+        assert -4.35 <= speed < 4.25
+        assert 0 <= crash < 1
+        assert -0.02 <= availability < 0.02
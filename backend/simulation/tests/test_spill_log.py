@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+
+from spill_log import SpillLog, CURSOR_FILE, RECORD_HEADER
+
+
+class FakeSink:
+    """Records the batches it is given; accepts the first `accept` writes (all of them when None)."""
+
+    def __init__(self, accept: int = None):
+        self.accept = accept
+        self.live = []
+        self.historic = []
+
+    async def _write(self, batches, documents):
+        if self.accept is not None and len(self.live) + len(self.historic) >= self.accept:
+            return False
+        batches.append(documents)
+        return True
+
+    async def write(self, documents):
+        return await self._write(self.live, documents)
+
+    async def write_historic(self, documents):
+        return await self._write(self.historic, documents)
+
+
+def batch(first: int, size: int = 3):
+    return [{"car_id": car_id, "timestamp": f"2024-01-01T00:00:{car_id:02d}", "speed": 1.5 * car_id}
+            for car_id in range(first, first + size)]
+
+
+async def replay(log: SpillLog, sink: FakeSink, batches: int):
+    """Run the replayer until the sink has `batches` batches (or a second has passed)."""
+    task = asyncio.create_task(log.replay(sink, rate=0, retry_interval=0.01))
+    for _ in range(100):
+        if len(sink.live) + len(sink.historic) >= batches:
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".log"))
+
+
+def test_append_and_replay_in_order(tmp_path):
+    async def scenario():
+        log = SpillLog(str(tmp_path), fsync=False)
+        assert await log.append(batch(1))
+        assert await log.append(batch(4), historic=True)
+        assert await log.append(batch(7))
+        assert log.pending()
+
+        sink = FakeSink()
+        await replay(log, sink, 3)
+        return log, sink
+
+    log, sink = asyncio.run(scenario())
+    assert sink.live == [batch(1), batch(7)]
+    assert sink.historic == [batch(4)]
+    assert not log.pending()
+    assert segment_files(tmp_path) == []
+    assert log.stats()["spill_documents_spilled"] == 9
+    assert log.stats()["spill_documents_replayed"] == 9
+
+
+def test_cursor_commit_survives_a_restart(tmp_path):
+    async def first_run():
+        log = SpillLog(str(tmp_path), fsync=False)
+        for first in (1, 4, 7):
+            await log.append(batch(first))
+        sink = FakeSink(accept=1)  # goes down after the first batch
+        await replay(log, sink, 1)
+        await asyncio.sleep(0.05)
+        return sink
+
+    assert asyncio.run(first_run()).live == [batch(1)]
+    with open(tmp_path / CURSOR_FILE) as f:
+        cursor = json.load(f)
+    assert cursor["offset"] > 0
+
+    async def second_run():
+        log = SpillLog(str(tmp_path), fsync=False)
+        assert (log.cursor_segment, log.cursor_offset) == (cursor["segment"], cursor["offset"])
+        sink = FakeSink()
+        await replay(log, sink, 2)
+        return sink
+
+    # Only what was not committed is replayed again
+    assert asyncio.run(second_run()).live == [batch(4), batch(7)]
+
+
+def test_torn_tail_is_ignored(tmp_path):
+    async def crash():
+        log = SpillLog(str(tmp_path), fsync=False)
+        await log.append(batch(1))
+        await log.append(batch(4))
+
+    asyncio.run(crash())
+    [segment] = segment_files(tmp_path)
+    path = tmp_path / segment
+    os.truncate(path, os.path.getsize(path) - 5)  # the second record was cut short by a crash
+
+    async def restart():
+        log = SpillLog(str(tmp_path), fsync=False)
+        await log.append(batch(7))  # never appended to the torn segment
+        sink = FakeSink()
+        await replay(log, sink, 2)
+        return log, sink
+
+    log, sink = asyncio.run(restart())
+    assert sink.live == [batch(1), batch(7)]
+    assert log.corrupt_records == 0
+    assert not log.pending()
+
+
+def test_corrupt_record_is_skipped(tmp_path):
+    async def spill():
+        log = SpillLog(str(tmp_path), fsync=False)
+        await log.append(batch(1))
+        await log.append(batch(4))
+
+    asyncio.run(spill())
+    [segment] = segment_files(tmp_path)
+    with open(tmp_path / segment, "r+b") as f:
+        f.seek(RECORD_HEADER.size + 10)  # inside the first payload
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    async def restart():
+        log = SpillLog(str(tmp_path), fsync=False)
+        sink = FakeSink()
+        await replay(log, sink, 1)
+        return log, sink
+
+    log, sink = asyncio.run(restart())
+    assert sink.live == [batch(4)]
+    assert log.corrupt_records == 1
+
+
+def test_segments_roll_over_and_are_removed_once_replayed(tmp_path):
+    async def scenario():
+        log = SpillLog(str(tmp_path), segment_max_bytes=200, fsync=False)
+        for first in range(1, 20, 3):
+            await log.append(batch(first))
+        segments = len(segment_files(tmp_path))
+        sink = FakeSink()
+        await replay(log, sink, 7)
+        return segments, sink
+
+    segments, sink = asyncio.run(scenario())
+    assert segments > 1
+    assert sink.live == [batch(first) for first in range(1, 20, 3)]
+    assert segment_files(tmp_path) == []
+
+
+def test_batches_beyond_max_bytes_are_dropped(tmp_path):
+    async def scenario():
+        log = SpillLog(str(tmp_path), max_bytes=600, fsync=False)
+        results = [await log.append(batch(first)) for first in range(1, 30, 3)]
+        return log, results
+
+    log, results = asyncio.run(scenario())
+    kept = results.count(True)
+    assert 0 < kept < len(results)
+    assert results == [True] * kept + [False] * (len(results) - kept)
+    assert log.disk_bytes() <= 600
+    assert log.documents_spilled == 3 * kept
+    assert log.documents_dropped == 3 * (len(results) - kept)
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from spill_log import SpillLog
+from telemetry_pipeline import TelemetryPipeline
+
+
+class GatedSend:
+    """Send callable that holds every batch until opened, recording the documents it was given."""
+
+    def __init__(self, success: bool = True):
+        self.success = success
+        self.gate = asyncio.Event()
+        self.started = asyncio.Event()
+        self.sent = []
+
+    async def __call__(self, batch):
+        self.started.set()
+        await self.gate.wait()
+        self.sent.extend(document["n"] for document in batch)
+        return self.success
+
+
+async def stalled_pipeline(policy: str, spill_log=None) -> (TelemetryPipeline, GatedSend):
+    """
+    A pipeline whose queue (2 documents) is full: document 0 is being sent, 1 waits for the
+    only send slot, 2 and 3 are queued.
+    """
+    send = GatedSend()
+    pipeline = TelemetryPipeline(send, batch_size=1, flush_interval=0.01, max_queue=2, max_in_flight=1,
+                                 overflow_policy=policy, spill_log=spill_log)
+    pipeline.start()
+    await pipeline.put({"n": 0})
+    await send.started.wait()
+    await pipeline.put({"n": 1})
+    await asyncio.sleep(0.05)  # the flusher takes it and waits for the send slot
+    await pipeline.put({"n": 2})
+    await pipeline.put({"n": 3})
+    assert pipeline.queue.full()
+    assert pipeline.in_flight == 1
+    return pipeline, send
+
+
+async def drain(pipeline: TelemetryPipeline, send: GatedSend):
+    send.gate.set()
+    await pipeline.stop()
+
+
+def test_block_waits_for_room():
+    async def scenario():
+        pipeline, send = await stalled_pipeline("block")
+        put = asyncio.create_task(pipeline.put({"n": 4}))
+        await asyncio.sleep(0.05)
+        blocked = not put.done()
+        send.gate.set()
+        await asyncio.wait_for(put, 1)
+        await drain(pipeline, send)
+        return pipeline, send, blocked
+
+    pipeline, send, blocked = asyncio.run(scenario())
+    assert blocked
+    assert send.sent == [0, 1, 2, 3, 4]
+    assert pipeline.documents_dropped == 0
+
+
+def test_drop_newest_keeps_the_queue():
+    async def scenario():
+        pipeline, send = await stalled_pipeline("drop_newest")
+        await asyncio.wait_for(pipeline.put({"n": 4}), 1)
+        await drain(pipeline, send)
+        return pipeline, send
+
+    pipeline, send = asyncio.run(scenario())
+    assert send.sent == [0, 1, 2, 3]
+    assert pipeline.documents_dropped == 1
+
+
+def test_drop_oldest_makes_room():
+    async def scenario():
+        pipeline, send = await stalled_pipeline("drop_oldest")
+        await asyncio.wait_for(pipeline.put({"n": 4}), 1)
+        await drain(pipeline, send)
+        return pipeline, send
+
+    pipeline, send = asyncio.run(scenario())
+    assert send.sent == [0, 1, 3, 4]
+    assert pipeline.documents_dropped == 1
+
+
+def test_spill_moves_the_oldest_to_the_spill_log(tmp_path):
+    async def scenario():
+        spill_log = SpillLog(str(tmp_path), fsync=False)
+        pipeline, send = await stalled_pipeline("spill", spill_log)
+        await asyncio.wait_for(pipeline.put({"n": 4}), 1)
+        await drain(pipeline, send)
+        return pipeline, send, spill_log
+
+    pipeline, send, spill_log = asyncio.run(scenario())
+    assert send.sent == [0, 1, 3, 4]
+    assert pipeline.documents_dropped == 0
+    assert pipeline.documents_spilled == 1
+    _, documents, _, _ = spill_log._read_next()
+    assert documents == [{"n": 2}]
+
+
+def test_spill_policy_needs_a_spill_log():
+    with pytest.raises(ValueError):
+        TelemetryPipeline(GatedSend(), overflow_policy="spill")
+
+
+def test_failed_batches_are_spilled(tmp_path):
+    async def scenario():
+        spill_log = SpillLog(str(tmp_path), fsync=False)
+        send = GatedSend(success=False)
+        send.gate.set()
+        pipeline = TelemetryPipeline(send, batch_size=2, flush_interval=0.01, max_retries=1, retry_backoff=0.01,
+                                     spill_log=spill_log)
+        pipeline.start()
+        await pipeline.put_many([{"n": 0}, {"n": 1}])
+        await pipeline.stop()
+        return pipeline, send, spill_log
+
+    pipeline, send, spill_log = asyncio.run(scenario())
+    assert send.sent == [0, 1, 0, 1]  # first attempt and one retry
+    assert pipeline.batches_failed == 1
+    assert pipeline.documents_spilled == 2
+    assert spill_log._read_next()[1] == [{"n": 0}, {"n": 1}]
+
+
+def test_put_when_not_running(tmp_path):
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await TelemetryPipeline(GatedSend()).put({"n": 0})
+        spill_log = SpillLog(str(tmp_path), fsync=False)
+        pipeline = TelemetryPipeline(GatedSend(), spill_log=spill_log)
+        await pipeline.put_many([{"n": 0}, {"n": 1}])
+        return pipeline
+
+    assert asyncio.run(scenario()).documents_spilled == 2
@@ -0,0 +1,40 @@
+import asyncio
+
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import BulkWriteError
+
+from telemetry_sinks import MongoSink
+
+
+class FakeCollection:
+    """insert_many like pymongo's for raw documents: no inserted_ids come back."""
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.inserted = []
+
+    async def insert_many(self, documents, ordered=True):
+        if self.error is not None:
+            raise self.error
+        assert all(isinstance(document, RawBSONDocument) for document in documents)
+        self.inserted.extend(documents)
+
+
+def mongo_sink(collection) -> MongoSink:
+    sink = MongoSink.__new__(MongoSink)  # no client
+    super(MongoSink, sink).__init__()
+    sink.collection = collection
+    return sink
+
+
+def test_mongo_sink_counts_the_inserted_batch():
+    sink = mongo_sink(FakeCollection())
+    batch = [{"car_id": car_id, "timestamp": "2024-01-01T00:00:00"} for car_id in range(5)]
+    assert asyncio.run(sink.write(batch))
+    assert (sink.documents_written, sink.batches_written) == (5, 1)
+
+
+def test_mongo_sink_counts_a_partial_insert():
+    sink = mongo_sink(FakeCollection(BulkWriteError({"nInserted": 3, "writeErrors": []})))
+    assert not asyncio.run(sink.write([{"car_id": car_id} for car_id in range(5)]))
+    assert (sink.documents_written, sink.batches_written) == (3, 0)
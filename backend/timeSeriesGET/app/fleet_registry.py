@@ -0,0 +1,95 @@
+"""
+Fleet registry: which car ids belong to which fleet.
+
+Fleets are contiguous car-id ranges laid out from car 1 in fleet order, so
+the whole layout is just the size of every fleet (FLEET_SIZES, default
+"100,100,100": fleet 1 = cars 1-100, fleet 2 = 101-200, fleet 3 = 201-300).
+Every service builds a FleetRegistry from the same setting and derives its
+car_id filters from it as range predicates ($gte/$lte), which stay the same
+size however many cars a fleet has.
+
+The same module is used by simulation, timeSeriesGET and agent, keep the
+copies identical.
+"""
+import bisect
+from typing import List, NamedTuple, Optional
+
+DEFAULT_FLEET_SIZES = "100,100,100"
+
+
+class Fleet(NamedTuple):
+    number: int  # 1-based, as shown in the UI ("Fleet 1")
+    first_car_id: int
+    last_car_id: int
+
+    @property
+    def size(self) -> int:
+        return self.last_car_id - self.first_car_id + 1
+
+
+def parse_fleet_sizes(value) -> List[int]:
+    """Fleet sizes from "100,100,100" or a list of ints."""
+    if isinstance(value, str):
+        value = [part for part in value.replace(" ", "").split(",") if part]
+    sizes = [int(size) for size in value]
+    if not sizes or any(size <= 0 for size in sizes):
+        raise ValueError(f"Fleet sizes must be positive integers, got {value}")
+    return sizes
+
+
+class FleetRegistry:
+    def __init__(self, sizes):
+        self.fleets = []
+        first_car_id = 1
+        for number, size in enumerate(parse_fleet_sizes(sizes), start=1):
+            self.fleets.append(Fleet(number, first_car_id, first_car_id + size - 1))
+            first_car_id += size
+        self._first_ids = [fleet.first_car_id for fleet in self.fleets]
+
+    @property
+    def total_cars(self) -> int:
+        return self.fleets[-1].last_car_id
+
+    def fleet(self, number: int) -> Optional[Fleet]:
+        """Fleet by its 1-based number, None if there is no such fleet."""
+        if isinstance(number, int) and 1 <= number <= len(self.fleets):
+            return self.fleets[number - 1]
+        return None
+
+    def fleet_of(self, car_id: int) -> Optional[Fleet]:
+        """Fleet a car id belongs to, None if it is outside every fleet."""
+        index = bisect.bisect_right(self._first_ids, car_id) - 1
+        if index >= 0 and car_id <= self.fleets[index].last_car_id:
+            return self.fleets[index]
+        return None
+
+    def selection(self, number: int, count: int = None) -> Optional[tuple]:
+        """(first, last) car id of the first count cars of a fleet (the whole fleet without count), None if empty."""
+        fleet = self.fleet(number)
+        if fleet is None:
+            return None
+        count = fleet.size if count is None else min(int(count), fleet.size)
+        if count <= 0:
+            return None
+        return fleet.first_car_id, fleet.first_car_id + count - 1
+
+    def car_id_condition(self, number: int, count: int = None) -> Optional[dict]:
+        """car_id range predicate of a fleet (or its first count cars), None if empty."""
+        selection = self.selection(number, count)
+        if selection is None:
+            return None
+        return {"car_id": {"$gte": selection[0], "$lte": selection[1]}}
+
+    def car_id_filter(self, numbers) -> dict:
+        """$or of the range predicates of the given fleet numbers, {} (no filter) for none."""
+        conditions = [self.car_id_condition(number) for number in numbers]
+        conditions = [condition for condition in conditions if condition]
+        return {"$or": conditions} if conditions else {}
+
+    def to_dict(self) -> dict:
+        return {
+            "total_cars": self.total_cars,
+            "fleets": [{"fleet": f.number, "first_car_id": f.first_car_id, "last_car_id": f.last_car_id, "size": f.size}
+                       for f in self.fleets],
+        }
+
@@ -11,6 +11,8 @@ from bson import ObjectId
 from typing import List, Optional  
 import math  
 import json
+import os
+from fleet_registry import FleetRegistry, DEFAULT_FLEET_SIZES
 
 
 # Configure logging
@@ -23,6 +25,9 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Car-id range of every fleet, same FLEET_SIZES setting as the simulation
+fleet_registry = FleetRegistry(os.getenv("FLEET_SIZES", DEFAULT_FLEET_SIZES))
+
 @router.get("/timeseries")  
 async def get_timeseries_entries():  
     pipeline = [  
@@ -133,30 +138,15 @@ def calculate_distance(point1, point2):
 
 def build_car_id_filter(car_id_filter: List[int]) -> dict:  
     """  
-    Build car_id filter based on array containing 1, 2, and/or 3  
+    Build car_id filter based on an array of fleet numbers (1, 2, 3, ... see fleet_registry)  
       
     Args:  
-        car_id_filter: List containing any combination of [1, 2, 3] or empty []  
+        car_id_filter: List of fleet numbers or empty []  
       
     Returns:  
-        MongoDB match condition for car_id ranges  
+        MongoDB match condition for car_id ranges ($gte/$lte per fleet)  
     """  
-    if not car_id_filter:  # Empty array - no car_id filtering  
-        return {}  
-      
-    # Build car_id ranges based on filter array  
-    car_id_conditions = []  
-      
-    if 1 in car_id_filter:  
-        car_id_conditions.append({"car_id": {"$gte": 1, "$lte": 100}})  
-      
-    if 2 in car_id_filter:  
-        car_id_conditions.append({"car_id": {"$gte": 101, "$lte": 200}})  
-      
-    if 3 in car_id_filter:  
-        car_id_conditions.append({"car_id": {"$gte": 201, "$lte": 300}})  
-      
-    return {"$or": car_id_conditions}  
+    return fleet_registry.car_id_filter(car_id_filter)  
   
 @router.post("/timeseries/nearest-geofence")          
 async def get_vehicles_nearest_to_geofence(          
@@ -174,7 +164,7 @@ async def get_vehicles_nearest_to_geofence(
         geofence_names: List of geofence names to search near  
         min_distance: Minimum distance in meters (default: 0)  
         max_distance: Maximum distance in meters (default: 10000)  
-        car_id_filter: Optional filter array [1,2,3] for car_id ranges:  
+        car_id_filter: Optional array of fleet numbers for car_id ranges (FLEET_SIZES), by default:  
             - 1: car_id 1-100  
             - 2: car_id 101-200    
             - 3: car_id 201-300  
@@ -182,7 +172,7 @@ async def get_vehicles_nearest_to_geofence(
     """          
     try:          
         # Validate car_id_filter values  
-        valid_car_filters = [f for f in car_id_filter if f in [1, 2, 3]]  
+        valid_car_filters = [f for f in car_id_filter if fleet_registry.fleet(f)]  
           
         # First, get the geofence(s) centroid(s)          
         geofences = list(geofence_coll.find({"name": {"$in": geofence_names}}))          
@@ -326,7 +316,7 @@ async def get_vehicles_inside_geofence(
     Args:  
         session_id: Session identifier  
         geofence_names: List of geofence names to search within  
-        car_id_filter: Optional filter array [1,2,3] for car_id ranges:  
+        car_id_filter: Optional array of fleet numbers for car_id ranges (FLEET_SIZES), by default:  
             - 1: car_id 1-100  
             - 2: car_id 101-200    
             - 3: car_id 201-300  
@@ -334,7 +324,7 @@ async def get_vehicles_inside_geofence(
     """          
     try:  
         # Validate car_id_filter values  
-        valid_car_filters = [f for f in car_id_filter if f in [1, 2, 3]]  
+        valid_car_filters = [f for f in car_id_filter if fleet_registry.fleet(f)]  
           
         # Get the geofence(s)          
         geofences = list(geofence_coll.find({"name": {"$in": geofence_names}}))          
@@ -431,8 +421,9 @@ def understand_fleet_number(user_preferences: str):
         user_preferences (str): User preferences string.
 
     Returns:
-        [int]: an array of the last car IDs in the fleet
-        for example [50,150,250] for fleets 1,2,3 so we know we should search for car IDs 0-50, 100-150, 200-250
+        [int]: an array with the number of cars selected in every fleet
+        for example [50,50,50] for fleets 1,2,3 so we know we should search for the first 50 car IDs of each fleet
+        (1-50, 101-150, 201-250 with the default fleet_registry)
     """
     fleet_numbers = []
     for preference in user_preferences:
@@ -457,22 +448,11 @@ def build_match_stage(user_preferences: str = None):
 
     # Handle empty fleet_capacity
     if fleet_capacity and len(fleet_capacity) > 0:
-        match_stage["$or"] = []
-        for fleet_size in fleet_capacity:
-            
-            car_ids1 = None
-            car_ids2 = None
-            car_ids3 = None
-
-            if fleet_size[0] > 0:
-                car_ids1 = list(range(0, fleet_capacity[0]))  # Car IDs 0-99
-                match_stage["$or"].append({"car_id": {"$in": car_ids1}})
-            if fleet_size[2] > 0:
-                car_ids2 = list(range(100, fleet_capacity[1]))  # Car IDs 100-199
-                match_stage["$or"].append({"car_id": {"$in": car_ids2}})
-            if fleet_size[3] > 0:
-                car_ids3 = list(range(200, fleet_capacity[2]))  # Car IDs 200-299
-                match_stage["$or"].append({"car_id": {"$in": car_ids3}})
+        # One car_id range per fleet, the first fleet_capacity[i] cars of fleet i+1
+        conditions = [fleet_registry.car_id_condition(number, count) for number, count in enumerate(fleet_capacity, start=1)]
+        conditions = [condition for condition in conditions if condition]
+        if conditions:
+            match_stage["$or"] = conditions
 
     else:
         match_stage = {}  # No filtering applied
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, status, Body
+from fastapi import APIRouter, status, Body, Request
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder  
 from database import timeseries_coll
@@ -6,12 +6,65 @@ from datetime import datetime
 from model.timeseriesModel import TimeseriesModel
 from typing import List  # Import List  
 import logging
+from pydantic import TypeAdapter, ValidationError
 from pymongo.operations import InsertOne
+from bson import decode_all
+from bson.raw_bson import RawBSONDocument
+from bson.codec_options import CodecOptions
+from bson.errors import InvalidBSON
+from collections.abc import Mapping
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+BSON_CONTENT_TYPE = "application/bson"
+_raw_codec_options = CodecOptions(document_class=RawBSONDocument)
+_entries_adapter = TypeAdapter(List[TimeseriesModel])
+
+
+async def read_batch(request: Request):
+    """
+    Read a batch body in either wire format.
+
+    application/bson: concatenated BSON documents, kept as RawBSONDocument so
+    the driver writes the received bytes as they are (no model, no re-encoding).
+    Only the fields the collection is keyed and indexed on are checked.
+    Anything else: a JSON list validated against TimeseriesModel, as before.
+    Returns (documents, is_raw). Raises ValueError for a bad document.
+    """
+    body = await request.body()
+    if request.headers.get("content-type", "").split(";")[0].strip() == BSON_CONTENT_TYPE:
+        documents = decode_all(body, _raw_codec_options)
+        for i, doc in enumerate(documents):
+            _check_raw_entry(i, doc)
+        return documents, True
+    return _entries_adapter.validate_json(body), False
+
+
+def _check_raw_entry(i: int, doc: RawBSONDocument):
+    """Required keys and types of a raw BSON entry: timestamp (date), car_id (int), coordinates (GeoJSON Point)."""
+    timestamp = doc.get("timestamp")
+    if not isinstance(timestamp, datetime):
+        raise ValueError(f"Document {i}: timestamp must be a BSON date")
+    car_id = doc.get("car_id")
+    if not isinstance(car_id, int) or isinstance(car_id, bool):
+        raise ValueError(f"Document {i}: car_id must be an integer")
+    coordinates = doc.get("coordinates")
+    if not isinstance(coordinates, Mapping) or coordinates.get("type") != "Point":
+        raise ValueError(f"Document {i}: coordinates must be a GeoJSON Point")
+    point = coordinates.get("coordinates")
+    if (not isinstance(point, list) or len(point) != 2
+            or not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in point)):
+        raise ValueError(f"Document {i}: coordinates must be a GeoJSON Point")
+
+
+def _bad_batch(e: Exception):
+    return JSONResponse(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        content=jsonable_encoder({"message": "Invalid batch body", "error": str(e)})
+    )
+
 @router.post("/timeseries")
 async def create_timeseries_entry(entry: TimeseriesModel):
     #print("Creating timeseries entry...")
@@ -39,8 +92,28 @@ async def create_timeseries_entry(entry: TimeseriesModel):
     
 
 @router.post("/historic-batch")  
-async def create_historic_batch(entries: List[TimeseriesModel]):  
+async def create_historic_batch(request: Request):  
     try:
+        entries, is_raw = await read_batch(request)
+    except (InvalidBSON, ValidationError, ValueError) as e:
+        return _bad_batch(e)
+    if not entries:
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=jsonable_encoder({"message": "No entries provided"})
+        )
+    try:
+        if is_raw:
+            # Already BSON with real dates, straight to the driver (no inserted_ids come back for raw documents)
+            result = timeseries_coll.bulk_write([InsertOne(entry) for entry in entries], ordered=False)
+            return JSONResponse(
+                status_code=status.HTTP_201_CREATED,
+                content=jsonable_encoder({
+                    "message": "Historical entries processed",
+                    "inserted_count": result.inserted_count
+                })
+            )
+
         # Convert entries directly to documents
         documents = []
         for doc in entries:
@@ -73,8 +146,12 @@ async def create_historic_batch(entries: List[TimeseriesModel]):
         )
     
 @router.post("/timeseries-batch")  
-async def create_timeseries_batch(entries: List[TimeseriesModel]):  
-    """Create multiple timeseries entries in batch for real-time data."""  
+async def create_timeseries_batch(request: Request):  
+    """Create multiple timeseries entries in batch for real-time data (JSON or BSON body)."""  
+    try:  
+        entries, is_raw = await read_batch(request)  
+    except (InvalidBSON, ValidationError, ValueError) as e:  
+        return _bad_batch(e)  
     try:  
         if not entries:  
             return JSONResponse(  
@@ -82,6 +159,18 @@ async def create_timeseries_batch(entries: List[TimeseriesModel]):
                 content=jsonable_encoder({"message": "No entries provided"})  
             )  
   
+        if is_raw:  
+            # Already BSON with real dates, straight to the driver (no inserted_ids come back for raw documents)  
+            result = timeseries_coll.bulk_write([InsertOne(entry) for entry in entries], ordered=False)  
+            return JSONResponse(  
+                status_code=status.HTTP_201_CREATED,  
+                content=jsonable_encoder({  
+                    "message": "Timeseries batch created successfully",  
+                    "inserted_count": result.inserted_count,  
+                    "total_entries": len(entries)  
+                })  
+            )  
+  
         # Convert entries to documents  
         documents = []  
         for entry in entries:  